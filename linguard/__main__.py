@@ -10,8 +10,11 @@ from flask_qrcode import QRcode
 from linguard.__version__ import commit, release
 from linguard.common.models.user import users
 from linguard.common.properties import global_properties
+from linguard.common.utils.privileged import privileged_helper
 from linguard.common.utils.system import try_makedir
+from linguard.core.config.wireguard import WireguardConfig
 from linguard.core.managers.cron import cron_manager
+from linguard.core.managers.startup import startup_manager
 from linguard.core.managers.wireguard import wireguard_manager
 from linguard.web.static.assets.resources import APP_NAME
 
@@ -41,12 +44,15 @@ global_properties.workdir = workdir
 
 from linguard.core.config.web import config as web_config
 from linguard.core.config.logger import config as log_config
+from linguard.core.config.wireguard import config as wireguard_config
 from linguard.core.managers.config import config_manager
 from linguard.web.router import router
 
 app = Flask(__name__, template_folder="web/templates", static_folder="web/static")
+privileged_helper.interfaces_folder = wireguard_config.interfaces_folder
 info(f"Logging to '{log_config.logfile}'...")
-config_manager.load()
+startup_manager.run_phase("discover binaries", WireguardConfig.discover_binaries)
+startup_manager.run_phase("load config", config_manager.load)
 if log_config.overwrite:
     log_config.reset_logfile()
 
@@ -54,15 +60,19 @@ app.config['SECRET_KEY'] = web_config.secret_key
 app.register_blueprint(router)
 QRcode(app)
 login_manager.init_app(app)
-wireguard_manager.start()
-cron_manager.start()
+startup_manager.run_phase("materialize interfaces", wireguard_config.save_interfaces)
+startup_manager.run_phase("start interfaces", wireguard_manager.start)
+startup_manager.run_phase("start cron", cron_manager.start)
+startup_manager.log_summary()
 
 
 @atexit.register
 def on_exit():
     warning(f"Shutting down {APP_NAME}...")
     cron_manager.stop()
+    config_manager.flush()
     wireguard_manager.stop()
+    privileged_helper.stop()
 
 
 if __name__ == "__main__":
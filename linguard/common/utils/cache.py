@@ -0,0 +1,38 @@
+from logging import debug
+from threading import Lock
+from time import monotonic
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SnapshotCache(Generic[T]):
+    """
+    Process-wide cache of a single value which is expensive to obtain, such as the output of a command.
+
+    The value is reused for ``ttl`` seconds. Loading is single-flight: if several threads ask for an expired value at
+    the same time, only one of them calls the loader while the rest wait for its result. Values are shared among
+    callers, so they must not be modified.
+    """
+
+    def __init__(self, loader: Callable[[], T], ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self.__lock = Lock()
+        self.__value: Optional[T] = None
+        self.__expires_at = 0.0
+
+    def get(self) -> T:
+        with self.__lock:
+            now = monotonic()
+            if self.__value is None or now >= self.__expires_at:
+                debug(f"Refreshing snapshot of {getattr(self.loader, '__name__', self.loader)}...")
+                self.__value = self.loader()
+                self.__expires_at = monotonic() + self.ttl
+            return self.__value
+
+    def invalidate(self):
+        """Discard the current value, so that the next call to :meth:`get` loads a new one."""
+        with self.__lock:
+            self.__value = None
+            self.__expires_at = 0.0
@@ -1,4 +1,7 @@
+import hashlib
 import os
+from tempfile import mkstemp
+from typing import Iterable, Optional, Union
 
 
 def write_lines(content: str, path: str):
@@ -6,6 +9,52 @@ def write_lines(content: str, path: str):
         file.writelines(content)
 
 
+def write_atomically(content: Union[str, bytes, Iterable[bytes]], path: str, mode: int = 0o600):
+    """
+    Write a file so that readers see either its previous or its new content, never a partially written one, even if
+    the system crashes: the content is written to a temporary file in the same folder, flushed to disk and then moved
+    over the original file.
+
+    The content may also be given as an iterable of byte chunks, so that large files are not built in memory.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = mkstemp(dir=folder, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w" if isinstance(content, str) else "wb") as file:
+            if isinstance(content, (str, bytes)):
+                file.write(content)
+            else:
+                for chunk in content:
+                    file.write(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Persist the rename itself
+    dir_fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def get_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_file_digest(path: str) -> Optional[str]:
+    """Get the digest of a text file, as get_digest would compute it for its content, or None if it cannot be read."""
+    try:
+        with open(path, "r") as file:
+            return get_digest(file.read())
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
 def get_filename_without_extension(path: str) -> str:
     filename, extension = os.path.splitext(path)
     return os.path.basename(filename)
@@ -1,24 +1,53 @@
 import json
-from typing import List, Dict, Any
+import os
+from typing import List, Dict, Any, Set
 
 from linguard.common.utils.strings import list_to_str
 from linguard.common.utils.system import Command
 from linguard.web.static.assets.resources import EMPTY_FIELD
 
+SYS_CLASS_NET = "/sys/class/net"
+
 
 def get_system_interfaces() -> Dict[str, Any]:
     ifaces = {}
-    for iface in json.loads(Command("ip -json address").run().output):
+    for iface in json.loads(Command(["ip", "-json", "address"]).run().output or "[]"):
         ifaces[iface["ifname"]] = iface
     return ifaces
 
 
+def get_link_names() -> Set[str]:
+    """Get the names of all network interfaces, reading them from sysfs if possible."""
+    if os.path.isdir(SYS_CLASS_NET):
+        return set(os.listdir(SYS_CLASS_NET))
+    return {link["ifname"] for link in json.loads(Command(["ip", "-json", "link"]).run().output or "[]")}
+
+
 def get_default_gateway() -> str:
-    return Command("ip route | head -1 | xargs | cut -d ' ' -f 5").run().output
+    """Get the name of the interface used by the default route (or by the first route, if there is no default one)."""
+    routes = json.loads(Command(["ip", "-json", "route"]).run().output or "[]")
+    for route in routes:
+        if route.get("dst", None) == "default":
+            return route.get("dev", "")
+    return routes[0].get("dev", "") if routes else ""
+
+
+def get_interface_address(name: str) -> str:
+    """Get the first address (in CIDR notation) of an interface, preferably an IPv4 one."""
+    result = Command(["ip", "-json", "address", "show", "dev", name]).run()
+    if not result.successful:
+        return ""
+    addresses = []
+    for iface in json.loads(result.output or "[]"):
+        addresses.extend(iface.get("addr_info", []))
+    addresses.sort(key=lambda address: address.get("family", None) != "inet")
+    if not addresses:
+        return ""
+    return f"{addresses[0]['local']}/{addresses[0]['prefixlen']}"
 
 
 def get_routing_table() -> List[Dict[str, Any]]:
-    table = json.loads(Command("ip -json route").run().output)
+    table = json.loads(Command(["ip", "-json", "route"]).run().output or "[]")
     for entry in table:
         for key in entry:
             value = entry[key]
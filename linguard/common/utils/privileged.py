@@ -0,0 +1,543 @@
+"""
+Long-lived privileged helper, so that commands which must be run as root do not pay the cost of starting ``sudo``
+(PAM, sudoers parsing...) every single time.
+
+The helper is started once, through ``sudo``, by :class:`PrivilegedHelper`. It listens on a Unix socket which is only
+reachable by the user running the application, and it only runs a fixed set of operations (see :data:`OPERATIONS`):
+concrete subcommands of wg, wg-quick and ip whose arguments are validated, and the PostUp/PostDown hooks found in the
+configuration files of the interfaces, which wg-quick would run as root anyway. Neither arbitrary arguments nor
+arbitrary shell commands are run. It exits as soon as its standard input is closed, which happens when the application
+exits.
+
+This module must only depend on the standard library: it is installed as a standalone, root-owned script (see
+:data:`INSTALLED_HELPER`), out of the reach of the application's user.
+
+Protocol: every connection sends a single JSON line
+``{"argv": [...], "timeout": <seconds or null>, "input": <str or null>}`` and receives a single JSON line, either
+``{"code": <int>, "output": <str>, "err": <str>}`` or ``{"error": <reason>}`` if the request was rejected. Closing
+the connection before receiving the response kills the command.
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import re
+import select
+import shlex
+import shutil
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+from logging import debug, warning, error, info, basicConfig
+from socketserver import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+from tempfile import mkdtemp
+from threading import Lock, Thread
+from time import sleep, monotonic
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable
+
+SOCKET_FILENAME = "helper.sock"
+# Folder in which the socket's private folder is created, as allowed by the sudoers entry written by install.sh
+SOCKET_PARENT_FOLDER = "/tmp"
+# Standalone copy of this module and interpreter used to run it, both owned by root (see install.sh)
+INSTALLED_HELPER = "/usr/local/lib/linguard/privileged.py"
+INSTALLED_PYTHON = "/usr/bin/python3"
+# Commands containing any of these must be run by a shell, which the helper never does
+SHELL_CHARACTERS = ("|", "&", ";", "<", ">", "$", "`", "\n")
+START_TIMEOUT = 5
+# Extra seconds to wait for the helper to reply once a command has timed out
+REQUEST_TIMEOUT_MARGIN = 5
+# Seconds between checks of whether the client of a running command is still waiting for it
+CLIENT_POLL_INTERVAL = 0.05
+# Exit code of commands which timed out, as in coreutils' timeout
+TIMEOUT_CODE = 124
+
+# Valid interface names, as checked by wg-quick
+INTERFACE_NAME_REGEX = re.compile(r"^[a-zA-Z0-9_=+.-]{1,15}$")
+PUBLIC_KEY_REGEX = re.compile(r"^[A-Za-z0-9+/]{43}=$")
+
+
+def is_interface_name(server: "PrivilegedHelperServer", value: str) -> bool:
+    return bool(INTERFACE_NAME_REGEX.match(value))
+
+
+def is_wireguard_interface(server: "PrivilegedHelperServer", value: str) -> bool:
+    """Whether the value is the name of an existing WireGuard interface, so that no other link can be modified."""
+    if not is_interface_name(server, value):
+        return False
+    try:
+        with open(os.path.join("/sys/class/net", value, "uevent"), "r") as f:
+            return "DEVTYPE=wireguard" in f.read().split()
+    except OSError:
+        return False
+
+
+def is_public_key(server: "PrivilegedHelperServer", value: str) -> bool:
+    return bool(PUBLIC_KEY_REGEX.match(value))
+
+
+def is_ipv4_interface(server: "PrivilegedHelperServer", value: str) -> bool:
+    try:
+        ipaddress.IPv4Interface(value)
+        return "/" in value
+    except ValueError:
+        return False
+
+
+def is_ipv4_network(server: "PrivilegedHelperServer", value: str) -> bool:
+    try:
+        ipaddress.IPv4Network(value, strict=False)
+        return True
+    except ValueError:
+        return False
+
+
+def is_ipv4_networks(server: "PrivilegedHelperServer", value: str) -> bool:
+    return all(is_ipv4_network(server, network) for network in value.split(","))
+
+
+def is_mtu(server: "PrivilegedHelperServer", value: str) -> bool:
+    return value.isdigit() and 68 <= int(value) <= 65535
+
+
+def is_interface_conf(server: "PrivilegedHelperServer", value: str) -> bool:
+    """Whether the value is the configuration file of an interface, right inside the interfaces folder."""
+    if not server.interfaces_folder or os.path.dirname(value) != server.interfaces_folder:
+        return False
+    name, extension = os.path.splitext(os.path.basename(value))
+    if extension != ".conf" or not is_interface_name(server, name):
+        return False
+    try:
+        return stat.S_ISREG(os.lstat(value).st_mode)
+    except OSError:
+        return False
+
+
+def is_interface_hook(server: "PrivilegedHelperServer", value: str) -> bool:
+    """Whether the value is a PostUp/PostDown hook of an interface, as found in its configuration file."""
+    if not server.interfaces_folder:
+        return False
+    try:
+        filenames = os.listdir(server.interfaces_folder)
+    except OSError:
+        return False
+    for filename in filenames:
+        path = os.path.join(server.interfaces_folder, filename)
+        if not is_interface_conf(server, path):
+            continue
+        name = os.path.splitext(filename)[0]
+        try:
+            with open(path, "r") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            key, separator, hook = line.partition("=")
+            if separator and key.strip() in ("PostUp", "PostDown") and hook.strip().replace("%i", name) == value:
+                return True
+    return False
+
+
+Argument = Union[str, Callable[["PrivilegedHelperServer", str], bool]]
+# Operations which may be run, by binary. Every argument is either a literal or a function validating it.
+OPERATIONS: Dict[str, Tuple[Tuple[Argument, ...], ...]] = {
+    "wg": (
+        ("show", "interfaces"),
+        ("show", "all", "dump"),
+        ("show", is_wireguard_interface, "dump"),
+        ("set", is_wireguard_interface, "peer", is_public_key, "allowed-ips", is_ipv4_networks),
+        ("set", is_wireguard_interface, "peer", is_public_key, "remove"),
+        ("setconf", is_wireguard_interface, "/dev/stdin"),
+    ),
+    "wg-quick": (
+        ("up", is_interface_conf),
+        ("down", is_interface_conf),
+    ),
+    "ip": (
+        ("link", "add", "dev", is_interface_name, "type", "wireguard"),
+        ("link", "delete", "dev", is_wireguard_interface),
+        ("link", "set", "mtu", is_mtu, "up", "dev", is_wireguard_interface),
+        ("-4", "address", "add", is_ipv4_interface, "dev", is_wireguard_interface),
+        ("-4", "route", "replace", is_ipv4_network, "dev", is_wireguard_interface),
+    ),
+    "sh": (
+        ("-c", is_interface_hook),
+    ),
+}
+ALLOWED_BINARIES = tuple(OPERATIONS.keys())
+
+
+def request(path: str, argv: List[str], timeout: float = None, input: str = None) -> Dict[str, Any]:
+    """
+    Send a command to the helper listening on the given socket and wait for its result.
+
+    :param path: Path to the socket.
+    :param argv: Command to run.
+    :param timeout: Seconds the helper waits for the command to finish before killing it.
+    :param input: Data sent to the standard input of the command.
+    :return: The response of the helper.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout + REQUEST_TIMEOUT_MARGIN if timeout else None)
+        sock.connect(path)
+        with sock.makefile("rw", encoding="utf-8") as f:
+            f.write(json.dumps({"argv": argv, "timeout": timeout, "input": input}) + "\n")
+            f.flush()
+            return json.loads(f.readline())
+
+
+async def request_async(path: str, argv: List[str], timeout: float = None, input: str = None) -> Dict[str, Any]:
+    """
+    Same as :func:`request`, without blocking the event loop. Cancelling it closes the connection, so that the helper
+    kills the command.
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write((json.dumps({"argv": argv, "timeout": timeout, "input": input}) + "\n").encode("utf-8"))
+        await writer.drain()
+        # The helper closes the connection right after the response, which may be longer than the limit of readline
+        response = await asyncio.wait_for(reader.read(), timeout + REQUEST_TIMEOUT_MARGIN if timeout else None)
+        return json.loads(response)
+    finally:
+        writer.close()
+
+
+class PrivilegedHelperHandler(StreamRequestHandler):
+
+    def handle(self):
+        try:
+            self.__check_credentials__()
+            data = json.loads(self.rfile.readline())
+            response = self.server.run(data["argv"], data.get("timeout", None), data.get("input", None),
+                                       self.request)
+        except ConnectionAbortedError as e:
+            # Nobody is waiting for the response anymore
+            debug(str(e))
+            return
+        except Exception as e:
+            response = {"error": str(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    def __check_credentials__(self):
+        if not hasattr(socket, "SO_PEERCRED"):
+            # The socket's folder is only accessible by the allowed user anyway
+            return
+        creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        if uid not in (0, self.server.allowed_uid):
+            raise PermissionError(f"uid {uid} is not allowed to use the helper.")
+
+
+class PrivilegedHelperServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, allowed_uid: int, interfaces_folder: str,
+                 operations: Dict[str, Tuple[Tuple[Argument, ...], ...]] = None):
+        self.allowed_uid = allowed_uid
+        self.interfaces_folder = os.path.abspath(interfaces_folder) if interfaces_folder else ""
+        self.operations = OPERATIONS if operations is None else operations
+        self.binaries = {}
+        for name in self.operations:
+            path_to_binary = shutil.which(name)
+            if path_to_binary:
+                self.binaries[name] = os.path.realpath(path_to_binary)
+        # Clients wait for the socket to exist, so it must not be visible until its permissions are set
+        tmp_path = f"{path}.tmp"
+        umask = os.umask(0o177)
+        try:
+            super().__init__(tmp_path, PrivilegedHelperHandler)
+        finally:
+            os.umask(umask)
+        if os.geteuid() == 0:
+            os.chown(tmp_path, allowed_uid, -1, follow_symlinks=False)
+        os.replace(tmp_path, path)
+
+    def resolve(self, binary: str) -> str:
+        """Get the path to a binary if, and only if, it is one of the allowed binaries."""
+        name = os.path.basename(binary)
+        resolved = self.binaries.get(name, None)
+        if not resolved:
+            raise PermissionError(f"'{binary}' is not allowed.")
+        if os.sep in binary and os.path.realpath(binary) != resolved:
+            raise PermissionError(f"'{binary}' is not allowed: expected {resolved}.")
+        return resolved
+
+    def is_allowed(self, name: str, args: List[str]) -> bool:
+        """Whether the arguments given to a binary match one of its allowed operations."""
+        for operation in self.operations.get(name, ()):
+            if len(operation) != len(args):
+                continue
+            if all(arg == expected if isinstance(expected, str) else expected(self, arg)
+                   for arg, expected in zip(args, operation)):
+                return True
+        return False
+
+    def run(self, argv: List[str], timeout: float = None, input: str = None,
+            connection: socket.socket = None) -> Dict[str, Any]:
+        """
+        Run an allowed operation.
+
+        :param argv: Command to run.
+        :param timeout: Seconds to wait for the command to finish before killing it.
+        :param input: Data sent to the standard input of the command.
+        :param connection: Connection of the client which requested the command, which is killed if the client closes
+            the connection before it finishes.
+        :raises ConnectionAbortedError: If the command was killed because the client closed the connection.
+        """
+        if not isinstance(argv, list) or len(argv) < 1 or not all(isinstance(arg, str) for arg in argv):
+            raise ValueError("Invalid command.")
+        if input is not None and not isinstance(input, str):
+            raise ValueError("Invalid input.")
+        binary = self.resolve(argv[0])
+        if not self.is_allowed(os.path.basename(argv[0]), argv[1:]):
+            raise PermissionError(f"'{' '.join(shlex.quote(arg) for arg in argv)}' is not an allowed operation.")
+        argv = [binary] + argv[1:]
+        # In a session of its own, so that the whole process group can be killed
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+                                stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL)
+        outputs = []
+        communicate = Thread(target=lambda: outputs.append(
+            proc.communicate(input.encode("utf-8") if input is not None else None)), daemon=True)
+        communicate.start()
+        deadline = monotonic() + timeout if timeout else None
+        while communicate.is_alive():
+            if deadline and monotonic() >= deadline:
+                self.__kill__(proc, communicate)
+                return {"code": TIMEOUT_CODE, "output": "", "err": f"Timed out after {timeout} seconds."}
+            if connection and self.__is_closed__(connection):
+                self.__kill__(proc, communicate)
+                raise ConnectionAbortedError(f"Killed '{' '.join(argv)}': the client closed the connection.")
+            communicate.join(CLIENT_POLL_INTERVAL)
+        output, err = outputs[0]
+        return {"code": proc.returncode, "output": output.decode("utf-8"), "err": err.decode("utf-8")}
+
+    @staticmethod
+    def __is_closed__(connection: socket.socket) -> bool:
+        """Whether the client closed the connection, since it sends nothing once the request is sent."""
+        readable, _, _ = select.select([connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    @staticmethod
+    def __kill__(proc: subprocess.Popen, communicate: Thread):
+        """Kill the process group of a command, politely first, and wait for its output to be collected."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                pass
+            communicate.join(1)
+            if not communicate.is_alive():
+                return
+
+
+def get_socket_owner(path: str) -> int:
+    """
+    Get the user allowed to use a socket about to be created by the helper, i.e. the owner of the private folder the
+    socket must be created in.
+
+    :raises PermissionError: If the path is not the socket of a private folder of the user who ran sudo.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(path) != SOCKET_FILENAME:
+        raise PermissionError(f"The socket must be named {SOCKET_FILENAME}.")
+    folder_stat = os.lstat(folder)
+    if not stat.S_ISDIR(folder_stat.st_mode) or folder_stat.st_mode & 0o077:
+        raise PermissionError(f"{folder} must be a private folder.")
+    sudo_uid = os.environ.get("SUDO_UID", None)
+    if sudo_uid is not None and int(sudo_uid) != folder_stat.st_uid:
+        raise PermissionError(f"{folder} does not belong to the user running sudo.")
+    return folder_stat.st_uid
+
+
+class PrivilegedHelper:
+    """Client side of the helper: starts it on first use and sends commands to it."""
+
+    def __init__(self):
+        self.enabled = True
+        # Folder holding the configuration files of the interfaces, the only ones wg-quick may be run with
+        self.interfaces_folder = ""
+        self.__lock = Lock()
+        self.__proc: Optional[subprocess.Popen] = None
+        self.__folder = ""
+        self.__failed = False
+
+    @property
+    def socket_path(self) -> str:
+        return os.path.join(self.__folder, SOCKET_FILENAME)
+
+    @staticmethod
+    def split(cmd: Union[str, List[str]]) -> Optional[List[str]]:
+        """
+        Get the arguments of a command if it can be run by the helper, or None otherwise.
+
+        :param cmd: A list of arguments, or a string which would be run by a shell.
+        :return:
+        """
+        if isinstance(cmd, str):
+            if any(character in cmd for character in SHELL_CHARACTERS):
+                return None
+            try:
+                argv = shlex.split(cmd)
+            except ValueError:
+                return None
+        else:
+            argv = list(cmd)
+        if len(argv) < 1 or os.path.basename(argv[0]) not in ALLOWED_BINARIES:
+            return None
+        return argv
+
+    def run(self, cmd: Union[str, List[str]], timeout: float = None, input: str = None) \
+            -> Optional[Tuple[int, str, str]]:
+        """
+        Run a command as root using the helper.
+
+        :param cmd: Command to run, either as a list of arguments or as a string which would be run by a shell.
+        :param timeout: Seconds to wait for the command to finish before killing it.
+        :param input: Data sent to the standard input of the command.
+        :return: The exit code, output and error output of the command, or None if the helper could not run it, in
+            which case it must be run by other means (i.e. sudo).
+        """
+        if not self.enabled:
+            return None
+        argv = self.split(cmd)
+        if not argv or not self.__ensure_started__():
+            return None
+        try:
+            response = request(self.socket_path, argv, timeout, input)
+        except (OSError, ValueError) as e:
+            warning(f"Privileged helper unavailable: {e}.")
+            return None
+        return self.__get_result__(argv, response)
+
+    async def run_async(self, cmd: Union[str, List[str]], timeout: float = None, input: str = None) \
+            -> Optional[Tuple[int, str, str]]:
+        """
+        Same as :meth:`run`, without blocking the event loop. Cancelling it kills the command.
+        """
+        if not self.enabled:
+            return None
+        argv = self.split(cmd)
+        if not argv or not await asyncio.get_running_loop().run_in_executor(None, self.__ensure_started__):
+            return None
+        try:
+            response = await request_async(self.socket_path, argv, timeout, input)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            warning(f"Privileged helper unavailable: {e}.")
+            return None
+        return self.__get_result__(argv, response)
+
+    @staticmethod
+    def __get_result__(argv: List[str], response: Dict[str, Any]) -> Optional[Tuple[int, str, str]]:
+        if "error" in response:
+            warning(f"Privileged helper rejected '{' '.join(argv)}': {response['error']}.")
+            return None
+        return response["code"], response["output"], response["err"]
+
+    def is_available(self) -> bool:
+        """Whether commands can be run by the helper, which is started if needed."""
+        return self.enabled and self.__ensure_started__()
+
+    def __ensure_started__(self) -> bool:
+        with self.__lock:
+            if self.__proc and self.__proc.poll() is None:
+                return True
+            if self.__failed:
+                return False
+            if self.__proc:
+                warning("Privileged helper exited unexpectedly. Restarting it...")
+                self.__cleanup__()
+            if not self.__start__():
+                self.__failed = True
+                self.__cleanup__()
+                warning("Unable to start privileged helper: commands will be run using sudo.")
+                return False
+            return True
+
+    @staticmethod
+    def __get_python__() -> str:
+        # When embedded (i.e. by uwsgi), the executable is not a python interpreter
+        if os.path.basename(sys.executable).startswith("python"):
+            return sys.executable
+        return os.path.join(sys.prefix, "bin", "python3")
+
+    def __get_helper_command__(self) -> List[str]:
+        """Get how to run the helper: its root-owned copy if installed, or this very file otherwise."""
+        if os.path.isfile(INSTALLED_HELPER):
+            return [INSTALLED_PYTHON, INSTALLED_HELPER]
+        return [self.__get_python__(), os.path.abspath(__file__)]
+
+    def __start__(self) -> bool:
+        """Must be called holding the lock."""
+        self.__folder = mkdtemp(prefix="linguard-", dir=SOCKET_PARENT_FOLDER)
+        argv = ["sudo", "-n"] + self.__get_helper_command__() + [self.socket_path, self.interfaces_folder]
+        debug(f"Starting privileged helper ({self.socket_path})...")
+        try:
+            self.__proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        except OSError as e:
+            debug(f"Unable to run sudo: {e}")
+            return False
+        deadline = monotonic() + START_TIMEOUT
+        while monotonic() < deadline:
+            if self.__proc.poll() is not None:
+                return False
+            if os.path.exists(self.socket_path):
+                info("Privileged helper started.")
+                return True
+            sleep(0.05)
+        return False
+
+    def __cleanup__(self):
+        """Must be called holding the lock."""
+        if self.__proc:
+            if self.__proc.stdin:
+                self.__proc.stdin.close()
+            try:
+                self.__proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.__proc.kill()
+            self.__proc = None
+        if self.__folder:
+            shutil.rmtree(self.__folder, ignore_errors=True)
+            self.__folder = ""
+
+    def stop(self):
+        """Stop the helper, if running. It will be started again the next time it is needed."""
+        with self.__lock:
+            self.__cleanup__()
+            self.__failed = False
+
+
+privileged_helper = PrivilegedHelper()
+
+
+def main():
+    basicConfig(format="[%(levelname)s] %(message)s", level="INFO")
+    if len(sys.argv) != 3:
+        error(f"Usage: {sys.argv[0]} <socket path> <interfaces folder>")
+        sys.exit(1)
+    path, interfaces_folder = sys.argv[1], sys.argv[2]
+    try:
+        allowed_uid = get_socket_owner(path)
+    except OSError as e:
+        error(f"Invalid socket path: {e}")
+        sys.exit(1)
+    server = PrivilegedHelperServer(path, allowed_uid, interfaces_folder)
+    Thread(target=server.serve_forever, daemon=True).start()
+    # The application keeps our stdin open while running
+    sys.stdin.read()
+    server.shutdown()
+    server.server_close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
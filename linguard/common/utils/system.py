@@ -1,6 +1,19 @@
+import asyncio
 import os
-from logging import debug, error
-from subprocess import run, PIPE
+import shlex
+import signal
+from concurrent.futures import ThreadPoolExecutor, wait
+from logging import debug, error, warning
+from subprocess import PIPE, Popen, TimeoutExpired
+from threading import Timer
+from time import monotonic, sleep
+from typing import Iterator, Iterable, List, Union, Callable
+
+from linguard.common.utils.privileged import privileged_helper, TIMEOUT_CODE
+
+# Exit code of commands which could not be found, as in sh
+NOT_FOUND_CODE = 127
+MAX_WORKERS = 8
 
 
 class CommandResult:
@@ -16,24 +29,78 @@ class CommandResult:
 class Command:
     """
     Represents an interface to interact with a binary, executable file.
+
+    Commands given as a list of arguments are executed directly, which is faster and does not require quoting
+    anything. Commands given as a string are run by a shell, so they may use pipes, redirections and so on.
     """
 
-    def __init__(self, cmd):
+    # Seconds to wait for a command to finish before killing it
+    DEFAULT_TIMEOUT = 60
+    # Seconds to wait for sudo to signal a command run as root
+    KILL_TIMEOUT = 5
+
+    def __init__(self, cmd: Union[str, List[str]], timeout: float = DEFAULT_TIMEOUT, input: str = None):
+        """
+        :param cmd: Command, either as a list of arguments or as a string which will be run by a shell.
+        :param timeout: Seconds to wait for the command to finish before killing it.
+        :param input: Data sent to the standard input of the command, so that secrets need not be passed as arguments
+            or written to files. Not supported by iter_lines.
+        """
         self.cmd = cmd
+        self.timeout = timeout
+        self.input = input
+
+    @property
+    def shell(self) -> bool:
+        return isinstance(self.cmd, str)
+
+    def __str__(self):
+        if self.shell:
+            return self.cmd
+        return " ".join(shlex.quote(arg) for arg in self.cmd)
+
+    def __get_args__(self, as_root: bool) -> Union[str, List[str]]:
+        """Get what must be executed, prepending sudo if needed."""
+        if not as_root:
+            return self.cmd
+        if self.shell:
+            return f"sudo {self.cmd}"
+        return ["sudo"] + list(self.cmd)
 
     def run(self, as_root: bool = False) -> CommandResult:
         """
         Execute the command and return information about the execution.
-        :param as_root: Run the command as root (using sudo)
-        :return: A CommandResult object containing information about how the execution went.
+        :param as_root: Run the command as root (using the privileged helper if possible, or sudo otherwise)
+        :return: A CommandResult object containing information about how the execution went. If the command timed out,
+            its code will be TIMEOUT_CODE.
         """
-        cmd = self.cmd
-        if as_root:
-            cmd = f"sudo {cmd}"
-        debug(f"Running '{cmd}'...")
-        proc = run(cmd, shell=True, check=False, stdout=PIPE, stderr=PIPE)
-        result = CommandResult(proc.returncode, proc.stdout.decode('utf-8').strip(),
-                               proc.stderr.decode('utf-8').strip())
+        cmd = str(self)
+        result = None
+        helper_result = privileged_helper.run(self.cmd, self.timeout, self.input) if as_root else None
+        if helper_result:
+            debug(f"Ran '{cmd}' using the privileged helper.")
+            code, output, err = helper_result
+            result = CommandResult(code, output.strip(), err.strip())
+        else:
+            args = self.__get_args__(as_root)
+            if as_root:
+                cmd = f"sudo {cmd}"
+            debug(f"Running '{cmd}'...")
+            try:
+                # Run in a new session, so that the whole process group can be killed if it times out
+                proc = Popen(args, shell=self.shell, stdin=self.__get_stdin__(), stdout=PIPE, stderr=PIPE,
+                             start_new_session=True)
+            except OSError as e:
+                proc = None
+                result = CommandResult(NOT_FOUND_CODE, "", str(e))
+            if proc:
+                try:
+                    output, err = proc.communicate(self.__get_input__(), timeout=self.timeout)
+                    result = CommandResult(proc.returncode, output.decode('utf-8').strip(),
+                                           err.decode('utf-8').strip())
+                except TimeoutExpired:
+                    self.__terminate__(proc, as_root)
+                    result = CommandResult(TIMEOUT_CODE, "", f"Timed out after {self.timeout} seconds.")
         if not result.successful:
             error(f"Failed to run '{cmd}': err={result.err} | out={result.output} | code={result.code}")
         return result
@@ -41,6 +108,181 @@ class Command:
     def run_as_root(self) -> CommandResult:
         return self.run(True)
 
+    async def run_async(self, as_root: bool = False) -> CommandResult:
+        """
+        Execute the command without blocking the event loop. Cancelling the returned coroutine kills the command: the
+        privileged helper kills the commands it runs as soon as it is no longer waited for, while commands run using
+        sudo are killed using sudo as well, provided that the sudoers entries allow it.
+        :param as_root: Run the command as root (using the privileged helper if possible, or sudo otherwise)
+        :return: A CommandResult object containing information about how the execution went. If the command timed out,
+            its code will be TIMEOUT_CODE.
+        """
+        helper_result = await privileged_helper.run_async(self.cmd, self.timeout, self.input) if as_root else None
+        if helper_result:
+            debug(f"Ran '{self}' using the privileged helper.")
+            code, output, err = helper_result
+            result = CommandResult(code, output.strip(), err.strip())
+            if not result.successful:
+                error(f"Failed to run '{self}': err={result.err} | out={result.output} | code={result.code}")
+            return result
+        args = self.__get_args__(as_root)
+        cmd = f"sudo {self}" if as_root else str(self)
+        debug(f"Running '{cmd}'...")
+        try:
+            if self.shell:
+                proc = await asyncio.create_subprocess_shell(args, stdin=self.__get_stdin__(), stdout=PIPE, stderr=PIPE,
+                                                             start_new_session=True)
+            else:
+                proc = await asyncio.create_subprocess_exec(*args, stdin=self.__get_stdin__(), stdout=PIPE, stderr=PIPE,
+                                                            start_new_session=True)
+        except OSError as e:
+            error(f"Failed to run '{cmd}': {e}")
+            return CommandResult(NOT_FOUND_CODE, "", str(e))
+        try:
+            output, err = await asyncio.wait_for(proc.communicate(self.__get_input__()), self.timeout)
+            result = CommandResult(proc.returncode, output.decode('utf-8').strip(), err.decode('utf-8').strip())
+        except asyncio.TimeoutError:
+            await self.__terminate_async__(proc, as_root)
+            result = CommandResult(TIMEOUT_CODE, "", f"Timed out after {self.timeout} seconds.")
+        except asyncio.CancelledError:
+            await self.__terminate_async__(proc, as_root)
+            raise
+        if not result.successful:
+            error(f"Failed to run '{cmd}': err={result.err} | out={result.output} | code={result.code}")
+        return result
+
+    def iter_lines(self, as_root: bool = False) -> Iterator[str]:
+        """
+        Execute the command and yield its output line by line, as it is produced, instead of waiting for the command
+        to finish and holding the whole output in memory.
+        :param as_root: Run the command as root (using the privileged helper if possible, or sudo otherwise). The
+            helper does not stream the output, although its lines are yielded all the same.
+        :return: Lines of the standard output, without line breaks.
+        """
+        cmd = str(self)
+        helper_result = privileged_helper.run(self.cmd, self.timeout) if as_root else None
+        if helper_result:
+            code, output, err = helper_result
+            if code != 0:
+                error(f"Failed to run '{cmd}': err={err.strip()} | code={code}")
+            yield from output.splitlines()
+            return
+        args = self.__get_args__(as_root)
+        if as_root:
+            cmd = f"sudo {cmd}"
+        debug(f"Running '{cmd}'...")
+        try:
+            proc = Popen(args, shell=self.shell, stdout=PIPE, stderr=PIPE, universal_newlines=True,
+                         start_new_session=True)
+        except OSError as e:
+            error(f"Failed to run '{cmd}': {e}")
+            return
+        with proc:
+            # Only signal the process group: the output is being read by this thread
+            timer = Timer(self.timeout, self.__signal_group__, (proc.pid, signal.SIGTERM, as_root)) \
+                if self.timeout else None
+            if timer:
+                timer.start()
+            try:
+                for line in proc.stdout:
+                    yield line.rstrip("\n")
+                err = proc.stderr.read().strip()
+            finally:
+                if timer:
+                    timer.cancel()
+        if proc.returncode != 0:
+            error(f"Failed to run '{cmd}': err={err} | code={proc.returncode}")
+
+    def __get_stdin__(self):
+        return PIPE if self.input is not None else None
+
+    def __get_input__(self):
+        return self.input.encode("utf-8") if self.input is not None else None
+
+    @classmethod
+    def __signal_group__(cls, pid: int, sig: int, as_root: bool = False):
+        """
+        Signal the process group of a command. Commands run using sudo belong to root, so they may only be signalled
+        using sudo too: if the sudoers entries do not allow it, they are left to finish on their own.
+        """
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            if not as_root:
+                return
+            result = Command(["kill", f"-{int(sig)}", "--", f"-{pid}"], timeout=cls.KILL_TIMEOUT).run_as_root()
+            if not result.successful:
+                warning(f"Unable to signal process group {pid}: it is left to finish on its own.")
+
+    @classmethod
+    def __terminate__(cls, proc: Popen, as_root: bool = False):
+        """Kill the process group of a command, politely first, so that sudo may forward the signal."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            cls.__signal_group__(proc.pid, sig, as_root)
+            try:
+                proc.communicate(timeout=1)
+                return
+            except (TimeoutExpired, ValueError):
+                continue
+
+    @classmethod
+    async def __terminate_async__(cls, proc: asyncio.subprocess.Process, as_root: bool = False):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            # Signalling a command run as root may require running sudo, which must not block the event loop
+            await loop.run_in_executor(None, cls.__signal_group__, proc.pid, sig, as_root)
+            try:
+                await asyncio.wait_for(proc.wait(), 1)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+
+def run_many(commands: Iterable[Command], as_root: bool = False, max_workers: int = None,
+             timeout: float = None) -> List[CommandResult]:
+    """
+    Execute several commands concurrently, using a pool of threads.
+    :param commands: Commands to execute. Each one is still subject to its own timeout.
+    :param as_root: Run the commands as root (using the privileged helper if possible, or sudo otherwise)
+    :param max_workers: Maximum number of commands running at the same time. Defaults to MAX_WORKERS.
+    :param timeout: Maximum number of seconds to wait for all commands. Commands which have not started by then are
+        cancelled, and those which are still running are left to their own timeout.
+    :return: The results of the commands, in the same order. Cancelled commands get a TIMEOUT_CODE result.
+    """
+    commands = list(commands)
+    if len(commands) < 1:
+        return []
+    executor = ThreadPoolExecutor(max_workers=max_workers or min(len(commands), MAX_WORKERS))
+    try:
+        futures = [executor.submit(command.run, as_root) for command in commands]
+        done, _ = wait(futures, timeout)
+        results = []
+        for command, future in zip(commands, futures):
+            if future in done:
+                results.append(future.result())
+                continue
+            future.cancel()
+            error(f"Gave up waiting for '{command}' after {timeout} seconds.")
+            results.append(CommandResult(TIMEOUT_CODE, "", f"Cancelled after {timeout} seconds."))
+        return results
+    finally:
+        executor.shutdown(wait=False)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float, interval: float = 0.05) -> bool:
+    """
+    Poll a condition until it holds or the timeout expires.
+    :return: Whether the condition holds.
+    """
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() >= deadline:
+            return False
+        sleep(interval)
+    return True
+
 
 def try_makedir(path: str):
     try:
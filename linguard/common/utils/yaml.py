@@ -0,0 +1,27 @@
+"""
+YAML (de)serialization using libyaml when available, which is several times faster than the pure Python
+implementation of PyYAML.
+"""
+
+from typing import Any, List, Union, IO
+
+import yaml
+from yamlable import YamlAble
+from yamlable.main import YAMLABLE_PREFIX, decode_yamlable, encode_yamlable
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# yamlable only registers itself in the pure Python loaders and dumpers
+if SafeLoader is not yaml.SafeLoader:
+    SafeLoader.add_multi_constructor(YAMLABLE_PREFIX, decode_yamlable)
+if SafeDumper is not yaml.SafeDumper:
+    SafeDumper.add_multi_representer(YamlAble, encode_yamlable)
+
+
+def safe_load_all(stream: Union[str, bytes, IO]) -> List[Any]:
+    return list(yaml.load_all(stream, Loader=SafeLoader))
+
+
+def safe_dump(data: Any, stream: IO = None) -> str:
+    return yaml.dump(data, stream, Dumper=SafeDumper)
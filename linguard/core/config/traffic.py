@@ -7,8 +7,12 @@ from linguard.core.drivers.traffic_storage_driver_json import TrafficStorageDriv
 
 @yaml_info(yaml_tag='traffic')
 class TrafficConfig(BaseConfig):
+    DEFAULT_SESSION_CACHE_TTL = 3
+
     enabled: bool
     driver: TrafficStorageDriver
+    # Seconds during which a snapshot of the current session's data is shared by everyone who requests it
+    session_cache_ttl: float
 
     def __init__(self):
         super().__init__()
@@ -17,15 +21,18 @@ class TrafficConfig(BaseConfig):
     def load_defaults(self):
         self.enabled = True
         self.driver = TrafficStorageDriverJson()
+        self.session_cache_ttl = self.DEFAULT_SESSION_CACHE_TTL
 
     def load(self, config: "TrafficConfig"):
         self.enabled = config.enabled
         self.driver = config.driver
+        self.session_cache_ttl = config.session_cache_ttl
 
     def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
         return {
             "enabled": self.enabled,
             "driver": self.driver,
+            "session_cache_ttl": self.session_cache_ttl,
         }
 
     @classmethod
@@ -39,6 +46,9 @@ class TrafficConfig(BaseConfig):
         if config.enabled is None:
             config.enabled = enabled
         config.driver = dct.get("driver", None) or config.driver
+        session_cache_ttl = dct.get("session_cache_ttl", None)
+        if session_cache_ttl is not None:
+            config.session_cache_ttl = session_cache_ttl
         return config
 
 
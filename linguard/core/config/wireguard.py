@@ -1,31 +1,93 @@
 import os
-from logging import debug, warning, error
-from typing import Dict, Type, Any
+import shutil
+from logging import debug, warning, error, info
+from typing import Dict, Type, Any, NamedTuple, Tuple, Optional
 from urllib import request
 
 from yamlable import yaml_info, Y
 
 from linguard.common.properties import global_properties
-from linguard.common.utils.network import get_default_gateway
-from linguard.common.utils.system import Command
+from linguard.common.utils.network import get_default_gateway, get_interface_address
 from linguard.core.config.base import BaseConfig
+from linguard.core.drivers.model_store_sqlite import ModelStoreSqlite
+from linguard.core.utils.wireguard import get_interfaces_status
+
+# Searched in addition to the PATH, as whereis does
+SBIN_FOLDERS = ("/usr/local/sbin", "/usr/sbin", "/sbin")
+
+
+class AppliedInterface(NamedTuple):
+    """Everything which requires restarting an interface when it changes."""
+    name: str
+    conf_file: str
+    ipv4_address: str
+    listen_port: int
+    private_key: str
+    gw_iface: str
+    on_up: Tuple[str, ...]
+    on_down: Tuple[str, ...]
+    binaries: Tuple[str, ...]
+
+
+class DefaultBinary:
+    """
+    Path to a binary which, unless set, defaults to the one found in the system. Binaries are looked for the first time
+    they are needed, and only once per process.
+    """
+
+    def __init__(self, binary: str):
+        self.binary = binary
+        self.attr = ""
+
+    def __set_name__(self, owner, name):
+        self.attr = f"_{name}"
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__dict__.get(self.attr, "") or WireguardConfig.get_default_binary(self.binary)
+
+    def __set__(self, instance, value: str):
+        instance.__dict__[self.attr] = value
 
 
 @yaml_info(yaml_tag='wireguard')
 class WireguardConfig(BaseConfig):
     __IP_RETRIEVER_URL = "https://api.ipify.org"
     INTERFACES_FOLDER_NAME = "interfaces"
+    # Interfaces and peers are stored either in the configuration file or in a SQLite database
+    STORE_YAML = "yaml"
+    STORE_SQLITE = "sqlite"
+
+    # Binaries found in the system, by name
+    __default_binaries: Dict[str, str] = {}
 
     endpoint: str
-    wg_bin: str
-    wg_quick_bin: str
-    iptables_bin: str
+    wg_bin = DefaultBinary("wg")
+    wg_quick_bin = DefaultBinary("wg-quick")
+    iptables_bin = DefaultBinary("iptables")
+    ip_bin = DefaultBinary("ip")
+    # Bring interfaces up and down with a few direct calls to ip and wg, instead of using wg-quick
+    native_interfaces: bool
+    interfaces_store: str
 
     @property
     def interfaces_folder(self):
         return global_properties.join_workdir(self.INTERFACES_FOLDER_NAME)
 
+    @property
+    def store(self) -> Optional[ModelStoreSqlite]:
+        """Database where interfaces and peers are stored, or None if they are stored in the configuration file."""
+        if self.interfaces_store != self.STORE_SQLITE:
+            return None
+        filepath = global_properties.join_workdir(ModelStoreSqlite.FILENAME)
+        if not self.__store or self.__store.filepath != filepath:
+            self.__store = ModelStoreSqlite(filepath)
+        return self.__store
+
     def __init__(self):
+        self.__applied: Dict[str, AppliedInterface] = {}
+        self.__store: Optional[ModelStoreSqlite] = None
         self.load_defaults()
 
     def load_defaults(self):
@@ -33,18 +95,47 @@ class WireguardConfig(BaseConfig):
         self.iptables_bin = ""
         self.wg_bin = ""
         self.wg_quick_bin = ""
-        result = Command("whereis wg | tr ' ' '\n' | grep bin").run()
-        if result.successful:
-            self.wg_bin = result.output
-        result = Command("whereis wg-quick | tr ' ' '\n' | grep bin").run()
-        if result.successful:
-            self.wg_quick_bin = result.output
-        result = Command("whereis iptables | tr ' ' '\n' | grep bin").run()
-        if result.successful:
-            self.iptables_bin = result.output
+        self.ip_bin = ""
+        self.native_interfaces = False
+        self.interfaces_store = self.STORE_YAML
         from linguard.core.models import interfaces
         self.interfaces = interfaces
 
+    @classmethod
+    def get_default_binary(cls, name: str) -> str:
+        if name not in cls.__default_binaries:
+            cls.__default_binaries[name] = cls.__find_binary__(name)
+        return cls.__default_binaries[name]
+
+    @classmethod
+    def discover_binaries(cls):
+        """Look for all the binaries which may be used, so that it is not done when they are first needed."""
+        for descriptor in vars(cls).values():
+            if isinstance(descriptor, DefaultBinary):
+                cls.get_default_binary(descriptor.binary)
+
+    @classmethod
+    def revalidate_binaries(cls):
+        """Look again for the binaries which were not found, or which are no longer executable."""
+        for name, path in list(cls.__default_binaries.items()):
+            if path and os.access(path, os.X_OK):
+                continue
+            cls.__default_binaries[name] = cls.__find_binary__(name)
+            if cls.__default_binaries[name] != path:
+                info(f"Default {name} binary changed from '{path}' to '{cls.__default_binaries[name]}'.")
+
+    @staticmethod
+    def __find_binary__(name: str) -> str:
+        """Get the path to a binary, also looking in sbin folders, which may not be in the PATH of regular users."""
+        folders = os.environ.get("PATH", os.defpath).split(os.pathsep)
+        folders += [folder for folder in SBIN_FOLDERS if folder not in folders]
+        path = shutil.which(name, path=os.pathsep.join(folders))
+        if not path:
+            warning(f"Unable to find {name} binary.")
+            return ""
+        debug(f"Found {name} binary at {path}.")
+        return path
+
     def load(self, config: "WireguardConfig"):
         self.endpoint = config.endpoint or self.endpoint
         if not self.endpoint:
@@ -53,11 +144,45 @@ class WireguardConfig(BaseConfig):
         self.wg_bin = config.wg_bin or self.wg_bin
         self.wg_quick_bin = config.wg_quick_bin or self.wg_quick_bin
         self.iptables_bin = config.iptables_bin or self.iptables_bin
-        if config.interfaces:
-            self.interfaces.set_contents(config.interfaces)
+        self.ip_bin = config.ip_bin or self.ip_bin
+        self.native_interfaces = config.native_interfaces
+        self.interfaces_store = config.interfaces_store
+        self.__load_interfaces__(config.interfaces)
         for iface in self.interfaces.values():
             iface.conf_file = os.path.join(self.interfaces_folder, iface.name) + ".conf"
+
+    def save_interfaces(self):
+        """
+        Write the configuration file of every interface, unless it is up-to-date. The interfaces are then taken as
+        running with their current settings, so that :meth:`apply` restarts them as soon as any of those changes.
+        """
+        for iface in self.interfaces.values():
             iface.save()
+        self.__applied = self.__get_applied_state__()
+
+    def __load_interfaces__(self, interfaces: "InterfaceDict"):
+        """
+        Restore the interfaces, either from the configuration file or from the database. Interfaces are only found in
+        the configuration file if they are stored there or if the database has just been enabled, in which case they
+        are imported into it. Likewise, when the database is disabled, its interfaces are moved back to the
+        configuration file.
+        """
+        store = self.store
+        if store:
+            if interfaces:
+                store.save_all(interfaces)
+                info(f"Interfaces imported into {store.filepath}.")
+            interfaces = store.load()
+        else:
+            filepath = global_properties.join_workdir(ModelStoreSqlite.FILENAME)
+            if not interfaces and os.path.exists(filepath):
+                old_store = ModelStoreSqlite(filepath)
+                interfaces = old_store.load()
+                old_store.close()
+                os.replace(filepath, f"{filepath}.exported")
+                info(f"Interfaces exported from {filepath} to the configuration file.")
+        if interfaces:
+            self.interfaces.set_contents(interfaces)
 
     def set_default_endpoint(self):
         try:
@@ -65,8 +190,7 @@ class WireguardConfig(BaseConfig):
             debug(f"Public IP address is {self.endpoint}. This will be used as default endpoint.")
         except Exception as e:
             error(f"Unable to obtain server's public IP address: {e}")
-            ip = (Command(f"ip a show {get_default_gateway()} | grep inet | head -n1 | xargs | cut -d ' ' -f2")
-                  .run().output)
+            ip = get_interface_address(get_default_gateway())
             self.endpoint = ip.split("/")[0]
             if not self.endpoint:
                 error("Unable to automatically set endpoint.")
@@ -83,31 +207,77 @@ class WireguardConfig(BaseConfig):
         config.wg_bin = dct.get("wg_bin", None) or config.wg_bin
         config.wg_quick_bin = dct.get("wg_quick_bin", None) or config.wg_quick_bin
         config.iptables_bin = dct.get("iptables_bin", None) or config.iptables_bin
+        config.ip_bin = dct.get("ip_bin", None) or config.ip_bin
+        config.native_interfaces = dct.get("native_interfaces", False)
+        config.interfaces_store = dct.get("interfaces_store", None) or config.interfaces_store
         config.interfaces = dct.get("interfaces", None) or config.interfaces
+        # Configuration files are saved when loading the configuration
         for iface in config.interfaces.values():
             iface.conf_file = os.path.join(config.interfaces_folder, iface.name) + ".conf"
-            iface.save()
         return config
 
     def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
-        return {
+        dct = {
             "endpoint": self.endpoint,
             "wg_bin": self.wg_bin,
             "wg_quick_bin": self.wg_quick_bin,
             "iptables_bin": self.iptables_bin,
-            "interfaces": self.interfaces
+            "ip_bin": self.ip_bin,
+            "native_interfaces": self.native_interfaces,
+            "interfaces_store": self.interfaces_store,
+        }
+        if not self.store:
+            dct["interfaces"] = self.interfaces
+        return dct
+
+    def __get_applied_state__(self) -> Dict[str, AppliedInterface]:
+        binaries = (self.wg_bin, self.wg_quick_bin, self.iptables_bin)
+        return {
+            iface.uuid: AppliedInterface(iface.name, os.path.join(self.interfaces_folder, iface.name) + ".conf",
+                                         iface.ipv4_address, iface.listen_port, iface.private_key, iface.gw_iface,
+                                         tuple(iface.on_up), tuple(iface.on_down), binaries)
+            for iface in self.interfaces.values()
         }
 
     def apply(self):
+        """
+        Restart the running interfaces whose settings changed since the last time this was called, or since their
+        configuration files were saved by :meth:`save_interfaces`. Peers are not taken into account, since they are
+        pushed to running interfaces as they change, and neither is the endpoint, which is only used by the peers'
+        configuration. Interfaces added since then are only recorded, since they cannot be running with different
+        settings.
+        """
         super(WireguardConfig, self).apply()
+        previous, self.__applied = self.__applied, self.__get_applied_state__()
+        changed = []
         for iface in self.interfaces.values():
-            was_up = iface.is_up
-            iface.down()
-            if os.path.exists(iface.conf_file):
-                os.remove(iface.conf_file)
-            iface.conf_file = os.path.join(self.interfaces_folder, iface.name) + ".conf"
-            if was_up:
+            applied = self.__applied[iface.uuid]
+            if iface.uuid in previous and previous[iface.uuid] != applied:
+                changed.append((iface, previous[iface.uuid]))
+            iface.conf_file = applied.conf_file
+        if not changed:
+            debug("No interface needs to be restarted.")
+            return
+        # Gather the status of all interfaces before any of them is brought down
+        status = get_interfaces_status()
+        was_up = {iface.uuid: status.is_up(old.name) for iface, old in changed}
+        for iface, old in changed:
+            if was_up[iface.uuid]:
+                self.__stop__(iface, old)
+            if old.conf_file != iface.conf_file and os.path.exists(old.conf_file):
+                os.remove(old.conf_file)
+            if was_up[iface.uuid]:
                 iface.up()
 
+    @staticmethod
+    def __stop__(iface, old: AppliedInterface):
+        """Bring an interface down as it is running, which may be under its previous name or configuration file."""
+        name, conf_file = iface.name, iface.conf_file
+        iface.name, iface.conf_file = old.name, old.conf_file
+        try:
+            iface.down()
+        finally:
+            iface.name, iface.conf_file = name, conf_file
+
 
 config = WireguardConfig()
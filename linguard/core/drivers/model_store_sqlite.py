@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+from logging import info, debug
+from threading import RLock
+from typing import Optional, Iterable
+
+from linguard.common.utils.file import write_atomically
+from linguard.common.utils.yaml import safe_load_all, safe_dump
+from linguard.core.models import Interface, Peer, InterfaceDict, PeerDict
+
+INTERFACE_COLUMNS = ("uuid", "name", "description", "gw_iface", "ipv4_address", "listen_port", "private_key",
+                     "public_key", "auto", "on_up", "on_down")
+PEER_COLUMNS = ("uuid", "interface", "name", "description", "ipv4_address", "private_key", "public_key", "nat",
+                "dns1", "dns2")
+
+
+def __upsert__(table: str, columns: Iterable[str]) -> str:
+    columns = list(columns)
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (uuid) DO UPDATE SET {updates}")
+
+
+UPSERT_INTERFACE = __upsert__("interfaces", INTERFACE_COLUMNS)
+UPSERT_PEER = __upsert__("peers", PEER_COLUMNS)
+
+
+class ModelStoreSqlite:
+    """
+    Stores interfaces and peers as rows of a SQLite database, instead of as part of the configuration file, so that
+    changing a single interface or peer only writes a single row. Rows are indexed by uuid, name, public key and IP
+    address.
+
+    A single connection in WAL mode is shared by all threads, and its usage is serialized by a lock.
+    """
+
+    FILENAME = "interfaces.db"
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.__lock = RLock()
+        self.__connection: Optional[sqlite3.Connection] = None
+
+    def __get_connection__(self) -> sqlite3.Connection:
+        """Get the shared connection, opening it (and creating the schema) if needed. Must be called holding the lock."""
+        if self.__connection and not os.path.exists(self.filepath):
+            self.close()
+        if not self.__connection:
+            debug(f"Opening interfaces database {self.filepath}...")
+            connection = sqlite3.connect(self.filepath, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS interfaces ("
+                               "uuid TEXT PRIMARY KEY, "
+                               "name TEXT NOT NULL, "
+                               "description TEXT, "
+                               "gw_iface TEXT, "
+                               "ipv4_address TEXT NOT NULL, "
+                               "listen_port INTEGER NOT NULL, "
+                               "private_key TEXT NOT NULL, "
+                               "public_key TEXT NOT NULL, "
+                               "auto INTEGER NOT NULL, "
+                               "on_up TEXT NOT NULL, "
+                               "on_down TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS peers ("
+                               "uuid TEXT PRIMARY KEY, "
+                               "interface TEXT NOT NULL, "
+                               "name TEXT NOT NULL, "
+                               "description TEXT, "
+                               "ipv4_address TEXT NOT NULL, "
+                               "private_key TEXT NOT NULL, "
+                               "public_key TEXT NOT NULL, "
+                               "nat INTEGER NOT NULL, "
+                               "dns1 TEXT, "
+                               "dns2 TEXT)")
+            for table in ("interfaces", "peers"):
+                for column in ("name", "public_key", "ipv4_address"):
+                    connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})")
+            connection.execute("CREATE INDEX IF NOT EXISTS peers_interface ON peers (interface)")
+            connection.commit()
+            self.__connection = connection
+        return self.__connection
+
+    def close(self):
+        """Close the shared connection. It will be opened again the next time it is needed."""
+        with self.__lock:
+            if not self.__connection:
+                return
+            self.__connection.close()
+            self.__connection = None
+
+    @staticmethod
+    def __interface_row__(iface: Interface) -> tuple:
+        return (iface.uuid, iface.name, iface.description, iface.gw_iface, iface.ipv4_address, iface.listen_port,
+                iface.private_key, iface.public_key, int(bool(iface.auto)), json.dumps(iface.on_up),
+                json.dumps(iface.on_down))
+
+    @staticmethod
+    def __peer_row__(peer: Peer) -> tuple:
+        return (peer.uuid, peer.interface.uuid, peer.name, peer.description, peer.ipv4_address, peer.private_key,
+                peer.public_key, int(bool(peer.nat)), peer.dns1, peer.dns2)
+
+    def is_empty(self) -> bool:
+        if not os.path.exists(self.filepath):
+            return True
+        with self.__lock:
+            return self.__get_connection__().execute("SELECT 1 FROM interfaces LIMIT 1").fetchone() is None
+
+    def load(self) -> InterfaceDict:
+        """Get all the interfaces and their peers."""
+        ifaces = InterfaceDict()
+        if not os.path.exists(self.filepath):
+            return ifaces
+        with self.__lock:
+            connection = self.__get_connection__()
+            iface_rows = connection.execute(f"SELECT {', '.join(INTERFACE_COLUMNS)} FROM interfaces").fetchall()
+            peer_rows = connection.execute(f"SELECT {', '.join(PEER_COLUMNS)} FROM peers").fetchall()
+        peers = {}
+        for uuid, interface, name, description, ipv4_address, private_key, public_key, nat, dns1, dns2 in peer_rows:
+            peer = Peer(name=name, description=description, ipv4_address=ipv4_address, nat=bool(nat), interface=None,
+                        dns1=dns1, uuid=uuid, private_key=private_key, public_key=public_key, dns2=dns2)
+            peers.setdefault(interface, PeerDict())[uuid] = peer
+        for uuid, name, description, gw_iface, ipv4_address, listen_port, private_key, public_key, auto, on_up, \
+                on_down in iface_rows:
+            iface_peers = peers.get(uuid, PeerDict())
+            iface_peers.sort()
+            ifaces[uuid] = Interface(name=name, description=description, gw_iface=gw_iface,
+                                     ipv4_address=ipv4_address, listen_port=listen_port, auto=bool(auto),
+                                     on_up=json.loads(on_up), on_down=json.loads(on_down), uuid=uuid,
+                                     private_key=private_key, public_key=public_key, peers=iface_peers)
+        ifaces.sort()
+        return ifaces
+
+    def save_all(self, ifaces: InterfaceDict):
+        """Replace all the stored interfaces and peers."""
+        with self.__lock:
+            connection = self.__get_connection__()
+            with connection:
+                connection.execute("DELETE FROM peers")
+                connection.execute("DELETE FROM interfaces")
+                connection.executemany(UPSERT_INTERFACE, [self.__interface_row__(iface) for iface in ifaces.values()])
+                connection.executemany(UPSERT_PEER, [self.__peer_row__(peer) for iface in ifaces.values()
+                                                     for peer in iface.peers.values()])
+
+    def save_interface(self, iface: Interface):
+        """Store an interface, but not its peers."""
+        with self.__lock:
+            connection = self.__get_connection__()
+            with connection:
+                connection.execute(UPSERT_INTERFACE, self.__interface_row__(iface))
+
+    def remove_interface(self, iface: Interface):
+        """Remove an interface and all its peers."""
+        with self.__lock:
+            connection = self.__get_connection__()
+            with connection:
+                connection.execute("DELETE FROM peers WHERE interface = ?", (iface.uuid,))
+                connection.execute("DELETE FROM interfaces WHERE uuid = ?", (iface.uuid,))
+
+    def save_peer(self, peer: Peer):
+        with self.__lock:
+            connection = self.__get_connection__()
+            with connection:
+                connection.execute(UPSERT_PEER, self.__peer_row__(peer))
+
+    def remove_peer(self, peer: Peer):
+        with self.__lock:
+            connection = self.__get_connection__()
+            with connection:
+                connection.execute("DELETE FROM peers WHERE uuid = ?", (peer.uuid,))
+
+    def import_yaml(self, path: str):
+        """
+        Replace all the stored interfaces and peers by the ones of a YAML file, which may be either a configuration
+        file or a file written by :meth:`export_yaml`.
+        """
+        info(f"Importing interfaces from {path} into {self.filepath}...")
+        with open(path, "r") as file:
+            data = safe_load_all(file)[0]
+        if isinstance(data, dict) and "wireguard" in data:
+            data = data["wireguard"].interfaces
+        if not isinstance(data, InterfaceDict):
+            raise ValueError(f"No interfaces found in {path}.")
+        self.save_all(data)
+        info(f"Imported {len(data)} interfaces.")
+
+    def export_yaml(self, path: str):
+        """Write all the stored interfaces and peers to a YAML file, in the format used by the configuration file."""
+        info(f"Exporting interfaces from {self.filepath} to {path}...")
+        write_atomically(safe_dump(self.load()), path)
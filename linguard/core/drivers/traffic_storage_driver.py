@@ -1,11 +1,13 @@
 import json
-from datetime import datetime
-from typing import Dict, Any, Type
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Any, Type, Iterable, Optional, Tuple, Set, Sequence
 
 from yamlable import YamlAble, Y
 
+from linguard.common.utils.file import write_atomically
 from linguard.core.models import interfaces
-from linguard.core.utils.tools import run_tool
+from linguard.core.utils.wireguard import get_wg_stats
 
 
 # Wireguard treats tx data as data sent by the server and rx data as data received by the server.
@@ -25,6 +27,74 @@ class TrafficData:
         self.last_handshake = last_handshake
 
 
+class TrafficArrays:
+    """Stored traffic data of a device: timestamps (unix epochs), rx and tx values, aligned by position."""
+
+    def __init__(self, timestamps: Sequence[int], rx: Sequence[int], tx: Sequence[int]):
+        self.timestamps = timestamps
+        self.rx = rx
+        self.tx = tx
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+class TrafficTotalsFile:
+    """
+    JSON file holding the last stored (cumulative) traffic data of every device, which looks like
+    ``{"version": 1, "totals": {<uuid>: {"rx": <bytes>, "tx": <bytes>}, ...}}``. It allows drivers which store the
+    history of samples as plain files to retrieve the totals without reading the whole history.
+
+    The file is read only if it changed, and it is considered outdated if the data file has been modified after it.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        self.__totals: Optional[Dict[str, TrafficData]] = None
+        self.__stat: Optional[Tuple[str, int, float]] = None
+
+    def load(self, filepath: str, data_filepath: str) -> Optional[Dict[str, TrafficData]]:
+        """
+        Get the stored totals.
+
+        :param filepath: Path to the totals file.
+        :param data_filepath: Path to the file holding the history of samples the totals belong to.
+        :return: The totals, indexed by device, or None if they are missing or outdated and must be rebuilt from the
+            data file. The returned dictionary is shared, so it must not be modified.
+        """
+        if not os.path.exists(filepath) or not os.path.exists(data_filepath):
+            return None
+        stat = os.stat(filepath)
+        if os.path.getmtime(data_filepath) > stat.st_mtime:
+            return None
+        key = (filepath, stat.st_ino, stat.st_mtime)
+        if self.__totals is not None and self.__stat == key:
+            return self.__totals
+        try:
+            with open(filepath, "r") as f:
+                json_data = json.load(f)
+            if json_data.get("version", None) != self.VERSION:
+                return None
+            totals = {device: TrafficData(data["rx"], data["tx"]) for device, data in json_data["totals"].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        self.__totals = totals
+        self.__stat = key
+        return self.__totals
+
+    def save(self, filepath: str, totals: Dict[str, TrafficData]):
+        """Write the totals atomically, so that a crash never leaves a truncated file (and resets the totals)."""
+        json_data = {
+            "version": self.VERSION,
+            "totals": {device: {"rx": data.rx, "tx": data.tx} for device, data in totals.items()}
+        }
+        write_atomically(json.dumps(json_data), filepath, mode=0o644)
+        stat = os.stat(filepath)
+        self.__totals = totals
+        self.__stat = (filepath, stat.st_ino, stat.st_mtime)
+
+
 class TrafficStorageDriver(YamlAble):
 
     DEFAULT_TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
@@ -45,52 +115,68 @@ class TrafficStorageDriver(YamlAble):
         :return: A dictionary containing traffic data of peers and interfaces, indexed by their names.
         """
         dct = {}
-        json_data = run_tool("wg-json").output
-        data = json.loads(json_data)
+        data = get_wg_stats()
         for iface in interfaces.values():
-            if iface.name not in data:
+            iface_stats = data.get(iface.name, None)
+            if not iface_stats:
                 continue
             iface_rx = 0
             iface_tx = 0
             for peer in iface.peers.values():
-                if peer.public_key not in data[iface.name]["peers"]:
+                peer_stats = iface_stats.peers.get(peer.public_key, None)
+                if not peer_stats:
                     continue
-                peer_data = data[iface.name]["peers"][peer.public_key]
-                peer_rx = 0
-                peer_tx = 0
-                if "transferRx" in peer_data:
-                    peer_tx = int(peer_data["transferRx"])
-                if "transferTx" in peer_data:
-                    peer_rx = int(peer_data["transferTx"])
-                last_handshake = None
-                if "latestHandshake" in peer_data:
-                    last_handshake = datetime.fromtimestamp(int(peer_data["latestHandshake"]))
+                peer_tx = peer_stats.transfer_rx
+                peer_rx = peer_stats.transfer_tx
                 iface_tx += peer_rx
                 iface_rx += peer_tx
-                dct[peer.uuid] = TrafficData(peer_rx, peer_tx, last_handshake)
+                dct[peer.uuid] = TrafficData(peer_rx, peer_tx, peer_stats.latest_handshake)
             dct[iface.uuid] = TrafficData(iface_rx, iface_tx)
         return dct
 
-    def get_session_and_stored_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+    def get_session_and_stored_data(self, devices: Iterable[str] = None) -> Dict[datetime, Dict[str, TrafficData]]:
         """
         Get the stored traffic data and merge it with the current session's data.
 
+        :param devices: UUIDs of the interfaces and peers to retrieve. If not specified, all of them will be retrieved.
         :return:
         """
-        stored_traffic = self.load_data()
-        session_traffic = self.get_session_data()
-        if len(stored_traffic) > 0:
-            for device, traffic in session_traffic.items():
-                # Look for last registered data of device
-                for data in reversed(list(stored_traffic.values())):
-                    if device in data:
-                        traffic.rx += data[device].rx
-                        traffic.tx += data[device].tx
-                        break
+        if devices is not None:
+            devices = set(devices)
+        stored_traffic = self.query(devices)
+        session_traffic = self.__get_cumulative_session_data__(devices, self.load_totals())
         if len(session_traffic) > 0:
             stored_traffic[datetime.now()] = session_traffic
         return stored_traffic
 
+    def get_session_and_stored_totals(self, devices: Iterable[str] = None) -> Dict[str, TrafficData]:
+        """
+        Get the total traffic data of every device, which is the current session's data plus the last stored data.
+
+        :param devices: UUIDs of the interfaces and peers to retrieve. If not specified, all of them will be retrieved.
+        :return: A dictionary containing traffic data of interfaces and peers, indexed by UUID.
+        """
+        if devices is not None:
+            devices = set(devices)
+        stored_totals = self.load_totals()
+        totals = {device: TrafficData(traffic.rx, traffic.tx) for device, traffic in stored_totals.items()
+                  if devices is None or device in devices}
+        totals.update(self.__get_cumulative_session_data__(devices, stored_totals))
+        return totals
+
+    def __get_cumulative_session_data__(self, devices: Optional[Set[str]],
+                                        stored_totals: Dict[str, TrafficData]) -> Dict[str, TrafficData]:
+        """Get the current session's data of the given devices, added to their last stored data."""
+        session_traffic = {}
+        for device, traffic in self.get_session_data().items():
+            if devices is not None and device not in devices:
+                continue
+            if device in stored_totals:
+                traffic.rx += stored_totals[device].rx
+                traffic.tx += stored_totals[device].tx
+            session_traffic[device] = traffic
+        return session_traffic
+
     def save_data(self):
         """
         Save updated traffic data.
@@ -107,6 +193,86 @@ class TrafficStorageDriver(YamlAble):
         """
         pass
 
+    def load_totals(self) -> Dict[str, TrafficData]:
+        """
+        Get the last stored traffic data of every device which, since stored data is cumulative, is its total traffic
+        data up to the last sample. Drivers should override this method so that the whole history is not scanned.
+
+        :return: A dictionary containing traffic data of interfaces and peers, indexed by UUID. It must not be modified.
+        """
+        totals = {}
+        for data in (self.load_data() or {}).values():
+            totals.update(data)
+        return totals
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        """
+        Get stored traffic data, restricted to the given devices and time range. Drivers should override this method
+        in order to avoid loading data which is not going to be used.
+
+        :param devices: UUIDs of the interfaces and peers to retrieve. If not specified, all of them will be retrieved.
+        :param start: Oldest timestamp (inclusive) to retrieve.
+        :param end: Newest timestamp (inclusive) to retrieve.
+        :param step: If specified, only the last sample of every interval of this length will be retrieved.
+        :return: A dictionary containing traffic data of the requested devices, indexed by timestamp.
+        """
+        data = {}
+        for timestamp, traffic_data in self.load_data().items():
+            if not self.__in_range__(timestamp, start, end):
+                continue
+            if devices is not None:
+                traffic_data = {device: traffic_data[device] for device in devices if device in traffic_data}
+                if len(traffic_data) < 1:
+                    continue
+            data[timestamp] = traffic_data
+        return self.__downsample__(data, step)
+
+    def query_arrays(self, device: str, start: datetime = None, end: datetime = None) -> TrafficArrays:
+        """
+        Get the stored traffic data of a single device as aligned sequences, which is cheaper than :meth:`query` since
+        no dictionary has to be built per timestamp. Drivers storing data by device should override this method in
+        order to return the stored values without copying them.
+
+        :param device: UUID of the interface or peer.
+        :param start: Oldest timestamp (inclusive) to retrieve.
+        :param end: Newest timestamp (inclusive) to retrieve.
+        :return: Timestamps (unix epochs), rx and tx values of the device, aligned by position.
+        """
+        timestamps, rx, tx = [], [], []
+        for timestamp, traffic_data in self.query([device], start, end).items():
+            if device in traffic_data:
+                timestamps.append(int(timestamp.timestamp()))
+                rx.append(traffic_data[device].rx)
+                tx.append(traffic_data[device].tx)
+        return TrafficArrays(timestamps, rx, tx)
+
+    @staticmethod
+    def __in_range__(timestamp: datetime, start: datetime = None, end: datetime = None) -> bool:
+        if start and timestamp < start:
+            return False
+        if end and timestamp > end:
+            return False
+        return True
+
+    @staticmethod
+    def __downsample__(data: Dict[datetime, Dict[str, TrafficData]],
+                       step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        """
+        Keep only the last sample of every device for each interval of length ``step``. Since stored traffic data is
+        cumulative, the last sample of an interval summarizes the whole interval.
+        """
+        if not step or len(data) < 1:
+            return data
+        seconds = step.total_seconds()
+        buckets = {}
+        for timestamp in sorted(data.keys()):
+            bucket = int(timestamp.timestamp() // seconds)
+            _, merged = buckets.get(bucket, (None, {}))
+            merged.update(data[timestamp])
+            buckets[bucket] = (timestamp, merged)
+        return {timestamp: merged for timestamp, merged in buckets.values()}
+
     def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
         return {
             "timestamp_format": self.timestamp_format
@@ -118,3 +284,7 @@ class TrafficStorageDriver(YamlAble):
                            yaml_tag=""
                            ):  # type: (...) -> Y
         return TrafficStorageDriver(dct.get("timestamp_format", None))
+
+    def __reduce__(self):
+        # Drivers may hold locks and open connections, so they are pickled as their YAML representation
+        return self.__class__.__from_yaml_dict__, (self.__to_yaml_dict__(), self.__yaml_tag_suffix__)
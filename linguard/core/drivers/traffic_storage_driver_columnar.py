@@ -0,0 +1,292 @@
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from logging import info, debug, warning
+from threading import RLock
+from typing import Dict, Any, Type, Iterable, Optional, Tuple, NamedTuple, List
+
+from yamlable import yaml_info, Y
+
+from linguard.common.properties import global_properties
+from linguard.common.utils.file import write_atomically
+from linguard.common.utils.system import try_makedir
+from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData, TrafficArrays
+
+
+class Column(NamedTuple):
+    """Memory-mapped column file: rows of ``width`` int64 values, without the header."""
+    width: int
+    values: memoryview
+
+    @property
+    def rows(self) -> int:
+        return len(self.values) // self.width if self.width else 0
+
+
+@yaml_info(yaml_tag='traffic_storage_driver_columnar')
+class TrafficStorageDriverColumnar(TrafficStorageDriver):
+    """
+    Driver which stores the timestamps (unix epochs), rx and tx counters as three column files of native int64
+    values, which are memory-mapped when read. Every sample appends a row to each column: its timestamp, and the
+    counters of every device, which owns a fixed slot of the rows given by its position in a compact index table.
+
+    Column files start with the number of values of their rows, so that rows can be widened when devices are added.
+    Saving a sample appends a single row to each file, and reading the data of a device does not require parsing nor
+    copying anything: see :meth:`query_arrays`.
+    """
+
+    FOLDER_NAME = "traffic"
+    INDEX_FILENAME = "devices.json"
+    VERSION = 2
+    COLUMNS = ("ts", "rx", "tx")
+    ITEM_FORMAT = "q"
+    ITEM_SIZE = struct.calcsize(ITEM_FORMAT)
+    # Device slots of the first rows, which are doubled every time they fall short
+    MIN_WIDTH = 16
+
+    def __init__(self, timestamp_format: str = TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT):
+        super().__init__(timestamp_format)
+        self.__lock = RLock()
+        # Slot and first row of every device
+        self.__index: Optional[Dict[str, Tuple[int, int]]] = None
+        self.__index_stat: Optional[Tuple[int, float]] = None
+        self.__columns: Dict[str, Tuple[Tuple[int, int], Column]] = {}
+
+    @property
+    def filepath(self):
+        return global_properties.join_workdir(self.FOLDER_NAME)
+
+    @property
+    def index_filepath(self):
+        return os.path.join(self.filepath, self.INDEX_FILENAME)
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "Columnar"
+
+    def __get_column_path__(self, column: str) -> str:
+        return os.path.join(self.filepath, f"{column}.bin")
+
+    def __load_index__(self) -> Dict[str, Tuple[int, int]]:
+        """Get the device index table, reading it only if it changed. Must be called holding the lock."""
+        if not os.path.exists(self.index_filepath):
+            self.__index = {}
+            self.__index_stat = None
+            return self.__index
+        stat = os.stat(self.index_filepath)
+        stat = (stat.st_ino, stat.st_mtime)
+        if self.__index is not None and self.__index_stat == stat:
+            return self.__index
+        with open(self.index_filepath, "r") as f:
+            json_data = json.load(f)
+        if json_data.get("version", None) != self.VERSION:
+            warning(f"Ignoring traffic data stored in {self.filepath}: unsupported version.")
+            json_data = {"devices": [], "first_rows": []}
+        self.__index = {device: (slot, first_row) for slot, (device, first_row)
+                        in enumerate(zip(json_data["devices"], json_data["first_rows"]))}
+        self.__index_stat = stat
+        return self.__index
+
+    def __save_index__(self, index: Dict[str, Tuple[int, int]]):
+        """Must be called holding the lock."""
+        devices = sorted(index.keys(), key=lambda device: index[device][0])
+        json_data = {"version": self.VERSION, "devices": devices,
+                     "first_rows": [index[device][1] for device in devices]}
+        write_atomically(json.dumps(json_data), self.index_filepath, mode=0o644)
+        stat = os.stat(self.index_filepath)
+        self.__index_stat = (stat.st_ino, stat.st_mtime)
+
+    def __get_column__(self, column: str) -> Column:
+        """Get a read-only view of a column file, mapping it only if it changed. Must be called holding the lock."""
+        path = self.__get_column_path__(column)
+        if not os.path.exists(path):
+            return Column(0, memoryview(b"").cast(self.ITEM_FORMAT))
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_size)
+        cached = self.__columns.get(column, None)
+        if cached and cached[0] == key:
+            return cached[1]
+        if stat.st_size < self.ITEM_SIZE:
+            mapped = Column(0, memoryview(b"").cast(self.ITEM_FORMAT))
+        else:
+            size = stat.st_size - stat.st_size % self.ITEM_SIZE
+            with open(path, "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)).cast(self.ITEM_FORMAT)
+            width = max(view[0], 1)
+            # Ignore a trailing partial row, which could only be the result of an interrupted write
+            rows = (len(view) - 1) // width
+            mapped = Column(width, view[1:1 + rows * width])
+        # The previous mapping is not explicitly released, since it may still be in use by callers of query_arrays: it
+        # is unmapped as soon as it is no longer referenced, so only one mapping per column is kept alive by the driver.
+        self.__columns[column] = (key, mapped)
+        return mapped
+
+    def __get_columns__(self) -> Tuple[int, Dict[str, Column]]:
+        """
+        Get the number of complete rows and every column. Must be called holding the lock.
+
+        Columns may differ in length if a write was interrupted, in which case only the rows present in all of them are
+        complete.
+        """
+        columns = {column: self.__get_column__(column) for column in self.COLUMNS}
+        return min(column.rows for column in columns.values()), columns
+
+    @staticmethod
+    def __get_value__(column: Column, row: int, slot: int) -> int:
+        if slot >= column.width:
+            return 0
+        return column.values[row * column.width + slot]
+
+    def __get_arrays__(self, rows: int, columns: Dict[str, Column], slot: int, first_row: int) -> TrafficArrays:
+        """Must be called holding the lock."""
+        rx, tx = columns["rx"], columns["tx"]
+        if slot >= rx.width or slot >= tx.width or first_row >= rows:
+            empty = memoryview(b"").cast(self.ITEM_FORMAT)
+            return TrafficArrays(empty, empty, empty)
+        return TrafficArrays(columns["ts"].values[first_row:rows],
+                             rx.values[first_row * rx.width + slot:rows * rx.width:rx.width],
+                             tx.values[first_row * tx.width + slot:rows * tx.width:tx.width])
+
+    def __widen__(self, column: str, current: Column, rows: int, width: int):
+        """
+        Rewrite a column file so that its rows have the given number of values, the new ones being zeros. Must be
+        called holding the lock.
+
+        Each column file is replaced atomically and describes its own width, so a crash between the widening of two
+        columns leaves valid files behind: readers only use the rows present in every column, devices beyond the
+        width of a column are treated as absent, and the next save widens whatever column is still too narrow.
+        """
+        debug(f"Widening traffic column {column} to {width} values...")
+        padding = bytes((width - current.width) * self.ITEM_SIZE)
+
+        def chunks():
+            yield struct.pack(self.ITEM_FORMAT, width)
+            for row in range(rows):
+                yield current.values[row * current.width:(row + 1) * current.width].tobytes() + padding
+
+        write_atomically(chunks(), self.__get_column_path__(column), mode=0o644)
+
+    def __append__(self, row: int, values: Dict[str, List[int]]):
+        """
+        Write a new row at the end of every column. Must be called holding the lock.
+
+        Rows are written at the given position, thus overwriting the leftovers of an interrupted write instead of
+        truncating files which may be memory-mapped by readers.
+        """
+        # The timestamp is written last, so that readers never see it before its values
+        for column in ("rx", "tx", "ts"):
+            width = len(values[column])
+            with open(self.__get_column_path__(column), "r+b") as f:
+                f.seek(self.ITEM_SIZE + row * width * self.ITEM_SIZE)
+                f.write(struct.pack(f"{width}{self.ITEM_FORMAT}", *values[column]))
+                f.truncate()
+
+    def save_data(self):
+        info("Updating traffic data...")
+        session_data = self.get_session_data()
+        if len(session_data) < 1:
+            info("No traffic data to store.")
+            return
+        timestamp = int(datetime.now().timestamp())
+        with self.__lock:
+            try_makedir(self.filepath)
+            index = self.__load_index__()
+            rows, columns = self.__get_columns__()
+            # Devices which are not part of the session keep their last values, which are still their totals
+            values = {}
+            for device, (slot, first_row) in index.items():
+                if rows > first_row:
+                    values[slot] = (self.__get_value__(columns["rx"], rows - 1, slot),
+                                    self.__get_value__(columns["tx"], rows - 1, slot))
+            index_updated = False
+            for device, traffic_data in session_data.items():
+                if device not in index:
+                    index[device] = (len(index), rows)
+                    index_updated = True
+                    debug(f"Added {device} to the device index table at slot {index[device][0]}.")
+                slot = index[device][0]
+                rx, tx = values.get(slot, (0, 0))
+                values[slot] = (rx + traffic_data.rx, tx + traffic_data.tx)
+            width = self.MIN_WIDTH
+            while width < len(index):
+                width *= 2
+            if not columns["ts"].width:
+                self.__widen__("ts", columns["ts"], rows, 1)
+            for column in ("rx", "tx"):
+                if columns[column].width < len(index):
+                    self.__widen__(column, columns[column], rows, width)
+            if index_updated:
+                self.__save_index__(index)
+            rows, columns = self.__get_columns__()
+            row = {"ts": [timestamp]}
+            for i, column in enumerate(("rx", "tx")):
+                row[column] = [0] * columns[column].width
+                for slot, slot_values in values.items():
+                    row[column][slot] = slot_values[i]
+            self.__append__(rows, row)
+        info("Traffic data updated.")
+
+    def query_arrays(self, device: str, start: datetime = None, end: datetime = None) -> TrafficArrays:
+        """
+        Get the stored traffic data of a device as read-only int64 views of the columns, without copying anything.
+
+        :param device: UUID of the interface or peer.
+        :param start: Oldest timestamp (inclusive) to retrieve.
+        :param end: Newest timestamp (inclusive) to retrieve.
+        :return: Timestamps (unix epochs), rx and tx values of the device, aligned by position.
+        """
+        with self.__lock:
+            position = self.__load_index__().get(device, None)
+            if position is None:
+                empty = memoryview(b"").cast(self.ITEM_FORMAT)
+                return TrafficArrays(empty, empty, empty)
+            rows, columns = self.__get_columns__()
+            arrays = self.__get_arrays__(rows, columns, *position)
+        low = bisect_left(arrays.timestamps, int(start.timestamp())) if start else 0
+        high = bisect_right(arrays.timestamps, int(end.timestamp())) if end else len(arrays)
+        return TrafficArrays(arrays.timestamps[low:high], arrays.rx[low:high], arrays.tx[low:high])
+
+    def load_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+        return self.query()
+
+    def load_totals(self) -> Dict[str, TrafficData]:
+        totals = {}
+        if not os.path.exists(self.filepath):
+            return totals
+        with self.__lock:
+            rows, columns = self.__get_columns__()
+            for device, (slot, first_row) in self.__load_index__().items():
+                if rows > first_row:
+                    totals[device] = TrafficData(self.__get_value__(columns["rx"], rows - 1, slot),
+                                                 self.__get_value__(columns["tx"], rows - 1, slot))
+        return totals
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        data = {}
+        if not os.path.exists(self.filepath):
+            return data
+        if devices is None:
+            with self.__lock:
+                devices = list(self.__load_index__().keys())
+        for device in devices:
+            arrays = self.query_arrays(device, start, end)
+            for timestamp, rx, tx in zip(arrays.timestamps, arrays.rx, arrays.tx):
+                data.setdefault(timestamp, {})[device] = TrafficData(rx, tx)
+        data = {datetime.fromtimestamp(timestamp): data[timestamp] for timestamp in sorted(data.keys())}
+        return self.__downsample__(data, step)
+
+    def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
+        dct = super(TrafficStorageDriverColumnar, self).__to_yaml_dict__()
+        return dct
+
+    @classmethod
+    def __from_yaml_dict__(cls,      # type: Type[Y]
+                           dct,      # type: Dict[str, Any]
+                           yaml_tag=""
+                           ):  # type: (...) -> Y
+        timestamp_format = dct.get("timestamp_format", None) or TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT
+        return TrafficStorageDriverColumnar(timestamp_format)
@@ -1,76 +1,155 @@
-import copy
 import json
 import os
-from datetime import datetime
-from logging import info
-from typing import Dict, Any, Type
+from datetime import datetime, timedelta
+from logging import info, debug
+from threading import RLock
+from typing import Dict, Any, Type, Iterable, List, Tuple
 
 from yamlable import yaml_info, Y
 
 from linguard.common.properties import global_properties
-from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData
-from linguard.core.models import interfaces, get_all_peers
+from linguard.common.utils.file import write_atomically
+from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData, TrafficTotalsFile
+from linguard.core.exceptions import WireguardError
+from linguard.core.models import get_all_peers
+
+# A sample is stored as [timestamp, device data], where timestamp is a unix epoch.
+Sample = List[Any]
 
 
 @yaml_info(yaml_tag='traffic_storage_driver_json')
 class TrafficStorageDriverJson(TrafficStorageDriver):
+    """
+    Driver which stores traffic data of peers and interfaces in a JSON file. Since version 2, the file looks like
+    ``{"version": 3, "samples": [[<unix epoch>, {<uuid>: {"rx": <bytes>, "tx": <bytes>}, ...}], ...]}``, while version
+    1 files used timestamps formatted according to ``timestamp_format`` as keys. Either way, ``timestamp_format`` is
+    only used to display timestamps. Versions 1 and 2 did not store interfaces' data, which had to be calculated from
+    their peers' data every time it was loaded.
+
+    Files using an old version are read as if they had been upgraded, and they are actually upgraded the next time data
+    is saved. The last stored data of every device is also kept in a separate file, so that totals can be retrieved
+    without reading all samples.
+    """
 
     FILENAME = "traffic.json"
+    TOTALS_FILENAME = "traffic.totals.json"
+    VERSION = 3
 
     def __init__(self, timestamp_format: str = TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT):
         super().__init__(timestamp_format)
+        self.__totals_file = TrafficTotalsFile()
+        # Serializes writers. Files are replaced atomically, so readers never need it.
+        self.__lock = RLock()
 
     @property
     def filepath(self):
         return global_properties.join_workdir(self.FILENAME)
 
+    @property
+    def totals_filepath(self):
+        return global_properties.join_workdir(self.TOTALS_FILENAME)
+
     @classmethod
     def get_name(cls) -> str:
         return "JSON"
 
     def save_data(self):
         info("Updating traffic data...")
-        merged_data = self.get_session_and_stored_data()
-        with open(self.filepath, "w") as f:
-            json_data = {}
+        with self.__lock:
+            # Files using an old version are upgraded here, since all samples are written anyway
+            merged_data = self.get_session_and_stored_data()
+            samples = []
+            totals = {}
             for timestamp, data in merged_data.items():
                 device_data = {}
                 for device, traffic_data in data.items():
-                    if device in interfaces.keys():
-                        # Do not store interface data, since it will be calculated from peers data
-                        break
                     device_data[device] = {"rx": traffic_data.rx, "tx": traffic_data.tx}
-                json_data[timestamp.strftime(self.timestamp_format)] = device_data
-            json.dump(json_data, f)
+                samples.append([int(timestamp.timestamp()), device_data])
+                totals.update(data)
+            self.__write__(samples)
+            self.__totals_file.save(self.totals_filepath, totals)
         info("Traffic data updated.")
 
+    def __write__(self, samples: List[Sample]):
+        """Must be called holding the lock."""
+        write_atomically(json.dumps({"version": self.VERSION, "samples": samples}), self.filepath, mode=0o644)
+
+    @classmethod
+    def read_samples(cls, filepath: str, timestamp_format: str) -> Tuple[int, List[Sample]]:
+        """
+        Read a file written by this driver, whatever its format version.
+
+        :param filepath: Path to the file.
+        :param timestamp_format: Format used to store timestamps by version 1 files.
+        :return: The version of the file and its samples, as ``[timestamp, device data]`` pairs whose timestamps are
+            unix epochs, as stored by the current version.
+        """
+        with open(filepath, "r") as f:
+            json_data = json.load(f)
+        if "version" not in json_data:
+            # Version 1 files map timestamps formatted using timestamp_format to device data
+            version = 1
+            samples = [[int(datetime.strptime(k, timestamp_format).timestamp()), v] for k, v in json_data.items()]
+        else:
+            version = json_data["version"]
+            if version > cls.VERSION:
+                raise WireguardError(f"Unsupported traffic data file version: {version}.")
+            samples = json_data["samples"]
+        if version < 3:
+            cls.__add_interfaces_data__(samples)
+        return version, samples
+
+    @staticmethod
+    def __add_interfaces_data__(samples: List[Sample]):
+        """Calculate the traffic data of interfaces from their peers' data, which is all old versions stored."""
+        peers = get_all_peers()
+        for _, device_data in samples:
+            for uuid, traffic_data in list(device_data.items()):
+                peer = peers.get(uuid, None)
+                if not peer or not peer.interface:
+                    continue
+                iface_data = device_data.setdefault(peer.interface.uuid, {"rx": 0, "tx": 0})
+                iface_data["rx"] += traffic_data["tx"]
+                iface_data["tx"] += traffic_data["rx"]
+
     def load_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+        return self.query()
+
+    def load_totals(self) -> Dict[str, TrafficData]:
+        totals = self.__totals_file.load(self.totals_filepath, self.filepath)
+        if totals is None:
+            with self.__lock:
+                totals = super(TrafficStorageDriverJson, self).load_totals()
+                if os.path.exists(self.filepath):
+                    debug(f"Rebuilt traffic totals from {self.filepath}.")
+                    self.__totals_file.save(self.totals_filepath, totals)
+        return totals
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
         data = {}
         if not os.path.exists(self.filepath):
             return data
-        with open(self.filepath, "r") as f:
-            json_data = json.load(f)
-        for k, v in json_data.items():
+        version, samples = self.read_samples(self.filepath, self.timestamp_format)
+        if version < self.VERSION:
+            debug(f"{self.filepath} uses version {version}: it will be upgraded the next time data is saved.")
+        if devices is not None:
+            devices = set(devices)
+        start_epoch = int(start.timestamp()) if start else None
+        end_epoch = int(end.timestamp()) if end else None
+        for timestamp, v in samples:
+            if start_epoch and timestamp < start_epoch:
+                continue
+            if end_epoch and timestamp > end_epoch:
+                continue
             device_data = {}
-            for device, traffic_data in v.items():
-                device_data[device] = TrafficData(traffic_data["rx"], traffic_data["tx"])
-            data[datetime.strptime(k, self.timestamp_format)] = device_data
-        # Calculate interfaces traffic data
-        data_with_interfaces = copy.deepcopy(data)
-        peers = get_all_peers()
-        for timestamp, peer in data.items():
-            for uuid, peer_data in peer.items():
-                peer = peers.get(uuid, None)
-                if not peer:
-                    continue
-                iface = peer.interface
-                if iface.uuid not in data_with_interfaces[timestamp]:
-                    data_with_interfaces[timestamp][iface.uuid] = TrafficData(rx_bytes=peer_data.tx,
-                                                                              tx_bytes=peer_data.rx)
-                    continue
-                data_with_interfaces[timestamp][iface.uuid].tx += peer_data.rx
-                data_with_interfaces[timestamp][iface.uuid].rx += peer_data.tx
-        return data_with_interfaces
+            for uuid, traffic_data in v.items():
+                if devices is None or uuid in devices:
+                    device_data[uuid] = TrafficData(traffic_data["rx"], traffic_data["tx"])
+            if devices is not None and len(device_data) < 1:
+                continue
+            data[datetime.fromtimestamp(timestamp)] = device_data
+        return self.__downsample__(data, step)
 
     def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
         dct = super(TrafficStorageDriverJson, self).__to_yaml_dict__()
@@ -81,5 +160,5 @@ class TrafficStorageDriverJson(TrafficStorageDriver):
                            dct,      # type: Dict[str, Any]
                            yaml_tag=""
                            ):  # type: (...) -> Y
-        timestamp_format = dct.get("timestamp_format", None)
+        timestamp_format = dct.get("timestamp_format", None) or TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT
         return TrafficStorageDriverJson(timestamp_format)
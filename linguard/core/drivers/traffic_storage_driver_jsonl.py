@@ -0,0 +1,162 @@
+import json
+import os
+from datetime import datetime, timedelta
+from logging import info, warning, debug
+from threading import RLock
+from typing import Dict, Any, Type, Iterable
+
+from yamlable import yaml_info, Y
+
+from linguard.common.properties import global_properties
+from linguard.common.utils.file import write_atomically
+from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData, TrafficTotalsFile
+from linguard.core.drivers.traffic_storage_driver_json import TrafficStorageDriverJson
+
+
+@yaml_info(yaml_tag='traffic_storage_driver_jsonl')
+class TrafficStorageDriverJsonl(TrafficStorageDriver):
+    """
+    Append-only driver which stores traffic data as JSON Lines, one record per sample. Every record looks like
+    ``{"timestamp": <unix epoch>, "data": {<uuid>: {"rx": <bytes>, "tx": <bytes>}, ...}}`` and contains the
+    cumulative traffic data of every peer and interface at that moment, so saving a sample only requires appending a
+    single line to the file. The last stored data of every device is also kept in a separate file, so that neither
+    saving a sample nor retrieving totals require replaying the whole file.
+    """
+
+    FILENAME = "traffic.jsonl"
+    TOTALS_FILENAME = "traffic.jsonl.totals.json"
+    LEGACY_FILENAME = "traffic.json"
+
+    def __init__(self, timestamp_format: str = TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT):
+        super().__init__(timestamp_format)
+        self.__totals_file = TrafficTotalsFile()
+        # Serializes writers, so that concurrent saves neither duplicate samples nor lose totals
+        self.__lock = RLock()
+
+    @property
+    def filepath(self):
+        return global_properties.join_workdir(self.FILENAME)
+
+    @property
+    def totals_filepath(self):
+        return global_properties.join_workdir(self.TOTALS_FILENAME)
+
+    @property
+    def legacy_filepath(self):
+        return global_properties.join_workdir(self.LEGACY_FILENAME)
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "JSON Lines"
+
+    def load_totals(self) -> Dict[str, TrafficData]:
+        totals = self.__totals_file.load(self.totals_filepath, self.filepath)
+        if totals is None:
+            # Missing or outdated: replay the file (migrating legacy data if needed) and store the result
+            with self.__lock:
+                totals = super(TrafficStorageDriverJsonl, self).load_totals()
+                if os.path.exists(self.filepath):
+                    debug(f"Rebuilt traffic totals from {self.filepath}.")
+                    self.__totals_file.save(self.totals_filepath, totals)
+        return totals
+
+    def save_data(self):
+        info("Updating traffic data...")
+        session_data = self.get_session_data()
+        if len(session_data) < 1:
+            info("No traffic data to store.")
+            return
+        with self.__lock:
+            last_data = self.load_totals()
+            device_data = {}
+            for device, traffic_data in session_data.items():
+                if device in last_data:
+                    traffic_data.rx += last_data[device].rx
+                    traffic_data.tx += last_data[device].tx
+                device_data[device] = {"rx": traffic_data.rx, "tx": traffic_data.tx}
+            self.__append__(datetime.now(), device_data)
+            totals = dict(last_data)
+            totals.update(session_data)
+            self.__totals_file.save(self.totals_filepath, totals)
+        info("Traffic data updated.")
+
+    def __append__(self, timestamp: datetime, device_data: Dict[str, Dict[str, int]]):
+        """Must be called holding the lock."""
+        record = {"timestamp": int(timestamp.timestamp()), "data": device_data}
+        with open(self.filepath, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def load_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+        return self.query()
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        data = {}
+        if not os.path.exists(self.filepath):
+            if not os.path.exists(self.legacy_filepath):
+                return data
+            with self.__lock:
+                # Another thread may have migrated the data while waiting for the lock
+                if not os.path.exists(self.filepath):
+                    self.migrate()
+        if devices is not None:
+            devices = set(devices)
+        start_epoch = int(start.timestamp()) if start else None
+        end_epoch = int(end.timestamp()) if end else None
+        with open(self.filepath, "r") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Most likely a partially written line, caused by an abrupt shutdown while appending a sample.
+                    warning(f"Skipping malformed traffic record at {self.filepath}:{line_number}.")
+                    continue
+                timestamp = record["timestamp"]
+                if start_epoch and timestamp < start_epoch:
+                    continue
+                if end_epoch and timestamp > end_epoch:
+                    # Records are appended in chronological order
+                    break
+                device_data = {}
+                for device, traffic_data in record["data"].items():
+                    if devices is None or device in devices:
+                        device_data[device] = TrafficData(traffic_data["rx"], traffic_data["tx"])
+                if devices is not None and len(device_data) < 1:
+                    continue
+                data[datetime.fromtimestamp(timestamp)] = device_data
+        return self.__downsample__(data, step)
+
+    def migrate(self, legacy_filepath: str = "", timestamp_format: str = ""):
+        """
+        Convert traffic data stored by the JSON driver into the JSON Lines format. The original file is left
+        untouched.
+
+        :param legacy_filepath: Path to the file written by the JSON driver. Defaults to the one in the workdir.
+        :param timestamp_format: Format used by version 1 files of the JSON driver to store timestamps. Defaults to
+            this driver's.
+        :return:
+        """
+        legacy_filepath = legacy_filepath or self.legacy_filepath
+        timestamp_format = timestamp_format or self.timestamp_format
+        info(f"Migrating traffic data from {legacy_filepath} to {self.filepath}...")
+        _, samples = TrafficStorageDriverJson.read_samples(legacy_filepath, timestamp_format)
+        records = [json.dumps({"timestamp": timestamp, "data": device_data}) + "\n"
+                   for timestamp, device_data in samples]
+        with self.__lock:
+            write_atomically("".join(records), self.filepath, mode=0o644)
+        debug(f"Migrated {len(samples)} samples.")
+        info("Traffic data migrated.")
+
+    def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
+        dct = super(TrafficStorageDriverJsonl, self).__to_yaml_dict__()
+        return dct
+
+    @classmethod
+    def __from_yaml_dict__(cls,      # type: Type[Y]
+                           dct,      # type: Dict[str, Any]
+                           yaml_tag=""
+                           ):  # type: (...) -> Y
+        timestamp_format = dct.get("timestamp_format", None) or TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT
+        return TrafficStorageDriverJsonl(timestamp_format)
@@ -0,0 +1,244 @@
+import json
+import os
+from datetime import datetime, timedelta
+from logging import info, debug, warning
+from threading import RLock
+from typing import Dict, Any, Type, Iterable, List, Optional
+
+from yamlable import yaml_info, Y
+
+from linguard.common.properties import global_properties
+from linguard.common.utils.file import write_atomically
+from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData
+from linguard.core.exceptions import WireguardError
+
+# A point is stored as [timestamp, rx, tx], where timestamp is a unix epoch.
+Point = List[int]
+Series = Dict[str, List[Point]]
+
+
+class RoundRobinTier:
+    """Resolution level of a round robin store: one point every ``step`` seconds, keeping up to ``rows`` points."""
+
+    def __init__(self, step: int, rows: int):
+        self.step = step
+        self.rows = rows
+
+    @property
+    def retention(self) -> int:
+        return self.step * self.rows
+
+    def to_dict(self) -> Dict[str, int]:
+        return {"step": self.step, "rows": self.rows}
+
+    @classmethod
+    def from_dict(cls, dct: Dict[str, Any]) -> "RoundRobinTier":
+        try:
+            step = int(dct["step"])
+            rows = int(dct["rows"])
+        except (KeyError, TypeError, ValueError):
+            raise WireguardError(f"Invalid round robin tier: {dct}. Expected something like "
+                                 f"{{\"step\": 300, \"rows\": 576}}.")
+        if step < 1 or rows < 1:
+            raise WireguardError(f"Invalid round robin tier: {dct}. Both step and rows must be positive.")
+        return RoundRobinTier(step, rows)
+
+    def __eq__(self, other):
+        return isinstance(other, RoundRobinTier) and self.step == other.step and self.rows == other.rows
+
+
+@yaml_info(yaml_tag='traffic_storage_driver_rrd')
+class TrafficStorageDriverRrd(TrafficStorageDriver):
+    """
+    Fixed-size driver which keeps traffic data at several resolutions, in the fashion of RRDtool. Every sample is
+    consolidated into each tier by keeping the last value of every interval (stored data is cumulative), and points
+    older than the retention of a tier are discarded, so the size of the file and the cost of a query are bounded by
+    the number of devices and the number of rows of each tier.
+    """
+
+    FILENAME = "traffic.rrd.json"
+    VERSION = 1
+    # 5 minutes for 2 days, 1 hour for 60 days and 1 day for 5 years
+    DEFAULT_TIERS = [RoundRobinTier(300, 576), RoundRobinTier(3600, 1440), RoundRobinTier(86400, 1825)]
+
+    def __init__(self, timestamp_format: str = TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT,
+                 tiers: List[RoundRobinTier] = None):
+        super().__init__(timestamp_format)
+        self.tiers = tiers or list(self.DEFAULT_TIERS)
+        self.__validate_tiers__(self.tiers)
+        self.__lock = RLock()
+        self.__series: Optional[List[Series]] = None
+        self.__mtime = None
+
+    @property
+    def filepath(self):
+        return global_properties.join_workdir(self.FILENAME)
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "Round robin"
+
+    @staticmethod
+    def __validate_tiers__(tiers: List[RoundRobinTier]):
+        for finer, coarser in zip(tiers, tiers[1:]):
+            if coarser.step <= finer.step:
+                raise WireguardError("Round robin tiers must be sorted by step, from the finest to the coarsest.")
+
+    def __load__(self) -> List[Series]:
+        """Get the stored series of every tier, reading the file only if it changed. Must be called holding the lock."""
+        if not os.path.exists(self.filepath):
+            self.__series = [{} for _ in self.tiers]
+            self.__mtime = None
+            return self.__series
+        mtime = os.path.getmtime(self.filepath)
+        if self.__series is not None and self.__mtime == mtime:
+            return self.__series
+        with open(self.filepath, "r") as f:
+            json_data = json.load(f)
+        if json_data.get("version", None) != self.VERSION:
+            raise WireguardError(f"Unsupported round robin file version: {json_data.get('version', None)}.")
+        stored_tiers = [RoundRobinTier.from_dict(tier) for tier in json_data["tiers"]]
+        if stored_tiers == self.tiers:
+            self.__series = json_data["series"]
+        else:
+            warning("Round robin tiers have changed. Consolidating stored traffic data into the new tiers...")
+            self.__series = self.__reconsolidate__(json_data["series"])
+        self.__mtime = mtime
+        return self.__series
+
+    def __reconsolidate__(self, old_series: List[Series]) -> List[Series]:
+        """Feed every stored point, at the best resolution available, into the current tiers."""
+        series = [{} for _ in self.tiers]
+        devices = set()
+        for tier_series in old_series:
+            devices.update(tier_series.keys())
+        for device in devices:
+            for point in self.__merge_tiers__([tier_series.get(device, []) for tier_series in old_series]):
+                self.__insert__(series, device, point)
+        return series
+
+    def __save__(self, series: List[Series]):
+        """Write all series atomically. Must be called holding the lock."""
+        json_data = {
+            "version": self.VERSION,
+            "tiers": [tier.to_dict() for tier in self.tiers],
+            "series": series
+        }
+        write_atomically(json.dumps(json_data), self.filepath, mode=0o644)
+        self.__mtime = os.path.getmtime(self.filepath)
+
+    def __insert__(self, series: List[Series], device: str, point: Point):
+        """Consolidate a point into every tier, discarding those points which are beyond each tier's retention."""
+        timestamp = point[0]
+        for tier, tier_series in zip(self.tiers, series):
+            points = tier_series.setdefault(device, [])
+            bucket = timestamp // tier.step
+            if points and points[-1][0] // tier.step == bucket:
+                points[-1] = list(point)
+            else:
+                points.append(list(point))
+            oldest_bucket = bucket - tier.rows
+            while points and points[0][0] // tier.step <= oldest_bucket:
+                points.pop(0)
+
+    @staticmethod
+    def __merge_tiers__(device_series: List[List[Point]]) -> List[Point]:
+        """
+        Combine the points of a device stored in several tiers (sorted from the finest to the coarsest), so that
+        coarser tiers only contribute points older than those available at a finer resolution.
+        """
+        merged = []
+        boundary = None
+        for points in device_series:
+            if boundary is not None:
+                points = [point for point in points if point[0] < boundary]
+            if points:
+                merged = points + merged
+                boundary = points[0][0]
+        return merged
+
+    def __prune__(self, series: List[Series], now: int):
+        """Remove devices without data in the coarsest tier, which is the one with the longest retention."""
+        oldest = now - self.tiers[-1].retention
+        for device in list(series[-1].keys()):
+            points = series[-1][device]
+            if points and points[-1][0] > oldest:
+                continue
+            debug(f"Removing expired traffic data of {device}...")
+            for tier_series in series:
+                tier_series.pop(device, None)
+
+    def save_data(self):
+        info("Updating traffic data...")
+        session_data = self.get_session_data()
+        if len(session_data) < 1:
+            info("No traffic data to store.")
+            return
+        timestamp = int(datetime.now().timestamp())
+        with self.__lock:
+            series = self.__load__()
+            last_data = self.load_totals()
+            for device, traffic_data in session_data.items():
+                if device in last_data:
+                    traffic_data.rx += last_data[device].rx
+                    traffic_data.tx += last_data[device].tx
+                self.__insert__(series, device, [timestamp, traffic_data.rx, traffic_data.tx])
+            self.__prune__(series, timestamp)
+            self.__save__(series)
+        info("Traffic data updated.")
+
+    def load_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+        return self.query()
+
+    def load_totals(self) -> Dict[str, TrafficData]:
+        if not os.path.exists(self.filepath):
+            return {}
+        totals = {}
+        with self.__lock:
+            # Every point is consolidated into all tiers, so the last point of any tier is the last stored one
+            for device, points in self.__load__()[-1].items():
+                if points:
+                    totals[device] = TrafficData(points[-1][1], points[-1][2])
+        return totals
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        data = {}
+        if not os.path.exists(self.filepath):
+            return data
+        with self.__lock:
+            series = self.__load__()
+            # Use only those tiers whose resolution is enough for the requested step
+            tiers = [i for i, tier in enumerate(self.tiers) if not step or tier.step >= step.total_seconds()]
+            if len(tiers) < 1:
+                tiers = [len(self.tiers) - 1]
+            if devices is None:
+                devices = set()
+                for i in tiers:
+                    devices.update(series[i].keys())
+            start_epoch = int(start.timestamp()) if start else None
+            end_epoch = int(end.timestamp()) if end else None
+            for device in devices:
+                points = self.__merge_tiers__([series[i].get(device, []) for i in tiers])
+                for timestamp, rx, tx in points:
+                    if start_epoch and timestamp < start_epoch:
+                        continue
+                    if end_epoch and timestamp > end_epoch:
+                        break
+                    data.setdefault(timestamp, {})[device] = TrafficData(rx, tx)
+        data = {datetime.fromtimestamp(timestamp): data[timestamp] for timestamp in sorted(data.keys())}
+        return self.__downsample__(data, step)
+
+    def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
+        dct = super(TrafficStorageDriverRrd, self).__to_yaml_dict__()
+        dct["tiers"] = [tier.to_dict() for tier in self.tiers]
+        return dct
+
+    @classmethod
+    def __from_yaml_dict__(cls,      # type: Type[Y]
+                           dct,      # type: Dict[str, Any]
+                           yaml_tag=""
+                           ):  # type: (...) -> Y
+        timestamp_format = dct.get("timestamp_format", None) or TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT
+        tiers = [RoundRobinTier.from_dict(tier) for tier in dct.get("tiers", None) or []]
+        return TrafficStorageDriverRrd(timestamp_format, tiers)
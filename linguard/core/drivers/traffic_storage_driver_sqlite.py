@@ -0,0 +1,158 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from logging import info, debug
+from threading import RLock
+from typing import Dict, Any, Type, Optional, Iterable
+
+from yamlable import yaml_info, Y
+
+from linguard.common.properties import global_properties
+from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver, TrafficData
+
+
+@yaml_info(yaml_tag='traffic_storage_driver_sqlite')
+class TrafficStorageDriverSqlite(TrafficStorageDriver):
+    """
+    Driver which stores traffic data in a SQLite database, as ``(timestamp, device, rx, tx)`` rows indexed by device
+    and timestamp. Timestamps are stored as unix epochs. The last row of every device is also kept in the ``totals``
+    table, which is updated in the same transaction.
+
+    A single connection in WAL mode is shared by all threads (the cron thread and request threads), and its usage
+    is serialized by a lock.
+    """
+
+    FILENAME = "traffic.db"
+
+    def __init__(self, timestamp_format: str = TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT):
+        super().__init__(timestamp_format)
+        self.__lock = RLock()
+        self.__connection: Optional[sqlite3.Connection] = None
+        self.__connection_path = ""
+
+    @property
+    def filepath(self):
+        return global_properties.join_workdir(self.FILENAME)
+
+    @classmethod
+    def get_name(cls) -> str:
+        return "SQLite"
+
+    def __get_connection__(self) -> sqlite3.Connection:
+        """
+        Get the shared connection, opening it (and creating the schema) if needed. Must be called holding the lock.
+        """
+        path = self.filepath
+        if self.__connection and (self.__connection_path != path or not os.path.exists(path)):
+            self.close()
+        if not self.__connection:
+            debug(f"Opening traffic database {path}...")
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS traffic ("
+                               "timestamp INTEGER NOT NULL, "
+                               "device TEXT NOT NULL, "
+                               "rx INTEGER NOT NULL, "
+                               "tx INTEGER NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS traffic_device_timestamp ON traffic (device, timestamp)")
+            connection.execute("CREATE TABLE IF NOT EXISTS totals ("
+                               "device TEXT PRIMARY KEY, "
+                               "timestamp INTEGER NOT NULL, "
+                               "rx INTEGER NOT NULL, "
+                               "tx INTEGER NOT NULL)")
+            if not connection.execute("SELECT 1 FROM totals LIMIT 1").fetchone():
+                # Databases created before the totals table existed
+                connection.execute("INSERT INTO totals (device, timestamp, rx, tx) "
+                                   "SELECT device, MAX(timestamp), rx, tx FROM traffic GROUP BY device")
+            connection.commit()
+            self.__connection = connection
+            self.__connection_path = path
+        return self.__connection
+
+    def close(self):
+        """Close the shared connection. It will be opened again the next time it is needed."""
+        with self.__lock:
+            if not self.__connection:
+                return
+            self.__connection.close()
+            self.__connection = None
+            self.__connection_path = ""
+
+    def save_data(self):
+        info("Updating traffic data...")
+        session_data = self.get_session_data()
+        if len(session_data) < 1:
+            info("No traffic data to store.")
+            return
+        timestamp = int(datetime.now().timestamp())
+        with self.__lock:
+            connection = self.__get_connection__()
+            last_data = self.load_totals()
+            rows = []
+            for device, traffic_data in session_data.items():
+                if device in last_data:
+                    traffic_data.rx += last_data[device].rx
+                    traffic_data.tx += last_data[device].tx
+                rows.append((timestamp, device, traffic_data.rx, traffic_data.tx))
+            with connection:
+                connection.executemany("INSERT INTO traffic (timestamp, device, rx, tx) VALUES (?, ?, ?, ?)", rows)
+                connection.executemany("INSERT OR REPLACE INTO totals (timestamp, device, rx, tx) "
+                                       "VALUES (?, ?, ?, ?)", rows)
+        info("Traffic data updated.")
+
+    def load_totals(self) -> Dict[str, TrafficData]:
+        if not os.path.exists(self.filepath):
+            return {}
+        with self.__lock:
+            rows = self.__get_connection__().execute("SELECT device, rx, tx FROM totals").fetchall()
+        return {device: TrafficData(rx, tx) for device, rx, tx in rows}
+
+    def load_data(self) -> Dict[datetime, Dict[str, TrafficData]]:
+        return self.query()
+
+    def query(self, devices: Iterable[str] = None, start: datetime = None, end: datetime = None,
+              step: timedelta = None) -> Dict[datetime, Dict[str, TrafficData]]:
+        data = {}
+        if not os.path.exists(self.filepath):
+            return data
+        conditions = []
+        params = []
+        if devices is not None:
+            devices = list(devices)
+            if len(devices) < 1:
+                return data
+            conditions.append(f"device IN ({', '.join('?' * len(devices))})")
+            params.extend(devices)
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(int(start.timestamp()))
+        if end:
+            conditions.append("timestamp <= ?")
+            params.append(int(end.timestamp()))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        if step:
+            # Since values are cumulative, keep only the last sample of each device for every interval. SQLite
+            # returns the values of the row holding the maximum timestamp of each group.
+            sql = (f"SELECT MAX(timestamp), device, rx, tx FROM traffic {where} "
+                   f"GROUP BY device, timestamp / ? ORDER BY 1")
+            params.append(max(int(step.total_seconds()), 1))
+        else:
+            sql = f"SELECT timestamp, device, rx, tx FROM traffic {where} ORDER BY timestamp"
+        with self.__lock:
+            rows = self.__get_connection__().execute(sql, params).fetchall()
+        for timestamp, device, rx, tx in rows:
+            data.setdefault(datetime.fromtimestamp(timestamp), {})[device] = TrafficData(rx, tx)
+        return data
+
+    def __to_yaml_dict__(self):  # type: (...) -> Dict[str, Any]
+        dct = super(TrafficStorageDriverSqlite, self).__to_yaml_dict__()
+        return dct
+
+    @classmethod
+    def __from_yaml_dict__(cls,      # type: Type[Y]
+                           dct,      # type: Dict[str, Any]
+                           yaml_tag=""
+                           ):  # type: (...) -> Y
+        timestamp_format = dct.get("timestamp_format", None) or TrafficStorageDriver.DEFAULT_TIMESTAMP_FORMAT
+        return TrafficStorageDriverSqlite(timestamp_format)
@@ -1,30 +1,55 @@
+import hashlib
 import os
-from logging import info, warning, error
-
-import yaml
+import pickle
+from contextlib import contextmanager
+from logging import info, warning, error, debug
+from threading import RLock, Timer
+from typing import Optional, Dict, Any
 
+from linguard.__version__ import release, commit
 from linguard.common.models.user import UserDict, users
 from linguard.common.properties import global_properties
+from linguard.common.utils.file import write_atomically, get_digest
+from linguard.common.utils.yaml import safe_load_all, safe_dump
 from linguard.common.utils.logs import log_exception
 from linguard.common.utils.system import try_makedir
 from linguard.core.config.logger import config as logger_config
 from linguard.core.config.traffic import config as traffic_config
 from linguard.core.config.web import config as web_config
 from linguard.core.config.wireguard import config as wireguard_config
+from linguard.core.models import Interface, Peer
 from linguard.web.static.assets.resources import APP_NAME
 
 
 class ConfigManager:
 
     CONFIG_FILENAME = f"{APP_NAME.lower()}.yaml"
+    # Seconds to wait for further changes before writing the configuration file
+    SAVE_DELAY = 1
+    SNAPSHOT_FILENAME = f".{CONFIG_FILENAME}.snapshot"
+    # Must be increased whenever pickled classes change in an incompatible way
+    SNAPSHOT_VERSION = 2
 
     def __init__(self):
         self.config_filepath = None
+        self.__lock = RLock()
+        self.__dirty = False
+        # Configuration serialized by the thread which changed it, waiting to be written
+        self.__pending: Optional[str] = None
+        self.__timer: Optional[Timer] = None
+        self.__batches = 0
+        # Digest of the configuration file as last read or written
+        self.__digest = ""
+
+    @property
+    def snapshot_filepath(self) -> str:
+        return os.path.join(os.path.dirname(self.config_filepath), self.SNAPSHOT_FILENAME)
 
     def load(self):
         try:
             self.config_filepath = global_properties.join_workdir(self.CONFIG_FILENAME)
             self.__load_config__()
+            # Loading may fill in missing values: store them, but out of the way of the startup
             self.save(apply=False)
         except Exception as e:
             log_exception(e, is_fatal=True)
@@ -43,8 +68,7 @@ class ConfigManager:
             warning(f"Unable to restore configuration file {self.config_filepath}: not found.")
             info("Using default configuration...")
             return
-        with open(self.config_filepath, "r") as file:
-            config = list(yaml.safe_load_all(file))[0]
+        config = self.read_config()
         if "logger" in config:
             logger_config.load(config["logger"])
             logger_config.apply()
@@ -67,23 +91,172 @@ class ConfigManager:
         info(f"Configuration restored!")
 
     def save(self, apply: bool = True):
-        info("Saving configuration...")
+        """
+        Mark the configuration as changed and apply it. The configuration file is not written right away, but once no
+        more changes have been made for SAVE_DELAY seconds, or when the current batch ends (see :meth:`batch`), so that
+        consecutive changes result in a single write.
+
+        The configuration is serialized right away though, by the thread which changed it, so that the delayed write
+        never serializes models while requests are modifying them.
+        """
+        with self.__lock:
+            self.__dirty = True
+            if self.__batches < 1:
+                self.__dump__()
+                self.__schedule__()
+        if not apply:
+            return
+        logger_config.apply()
+        wireguard_config.apply()
+        web_config.apply()
+        traffic_config.apply()
+
+    def save_interface(self, iface: Interface, apply: bool = True):
+        """Persist an interface (but not its peers) which was added or modified, and apply the configuration."""
+        store = wireguard_config.store
+        if store:
+            store.save_interface(iface)
+        self.save(apply)
+
+    def remove_interface(self, iface: Interface):
+        """Persist the removal of an interface and its peers, and apply the configuration."""
+        store = wireguard_config.store
+        if store:
+            store.remove_interface(iface)
+        self.save()
+
+    def save_peer(self, peer: Peer):
+        """Persist a peer which was added or modified. Peers are applied as they change, so nothing else is done."""
+        store = wireguard_config.store
+        if store:
+            store.save_peer(peer)
+            return
+        self.save(apply=False)
+
+    def remove_peer(self, peer: Peer):
+        """Persist the removal of a peer."""
+        store = wireguard_config.store
+        if store:
+            store.remove_peer(peer)
+            return
+        self.save(apply=False)
+
+    @contextmanager
+    def batch(self):
+        """Group all the changes saved within the context in a single write, done as soon as it exits."""
+        with self.__lock:
+            self.__batches += 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__batches -= 1
+                if self.__batches < 1:
+                    self.flush()
+
+    def flush(self):
+        """Write the configuration file now if there are pending changes."""
+        with self.__lock:
+            if self.__timer:
+                self.__timer.cancel()
+                self.__timer = None
+            if self.__dirty:
+                self.__dump__()
+            self.__write__()
+
+    def __dump__(self):
+        """Serialize the configuration, to be written by :meth:`__write__`. Must be called holding the lock."""
         config = {
             "logger": logger_config,
             "web": web_config,
             "wireguard": wireguard_config,
             "traffic": traffic_config,
         }
+        self.__pending = safe_dump(config)
+        self.__dirty = False
+
+    def __write__(self):
+        """Write the last serialized configuration, if any. Must be called holding the lock."""
+        content, self.__pending = self.__pending, None
+        if content is None:
+            return
+        info("Saving configuration...")
+        digest = get_digest(content)
+        if digest == self.__digest and os.path.exists(self.config_filepath):
+            # Keep the file untouched, so that its snapshot remains valid
+            info("Configuration is up-to-date.")
+            return
         try_makedir(os.path.dirname(self.config_filepath))
-        with open(self.config_filepath, "w") as file:
-            yaml.safe_dump(config, file)
+        write_atomically(content, self.config_filepath)
+        self.__digest = digest
         info("Configuration saved!")
-        if not apply:
+
+    def __schedule__(self):
+        """Must be called holding the lock."""
+        if self.__timer:
             return
-        logger_config.apply()
-        wireguard_config.apply()
-        web_config.apply()
-        traffic_config.apply()
+        self.__timer = Timer(self.SAVE_DELAY, self.__flush_pending__)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __flush_pending__(self):
+        with self.__lock:
+            self.__timer = None
+            try:
+                # Changes made within an ongoing batch are not serialized yet: they are written when the batch ends
+                self.__write__()
+            except Exception as e:
+                log_exception(e)
+
+    def read_config(self) -> Dict[str, Any]:
+        """
+        Parse the configuration file. Parsed objects are also pickled to a snapshot, which is used instead of the file
+        as long as the file does not change: either its modification time and size, or its content, must match.
+        """
+        stat = os.stat(self.config_filepath)
+        snapshot = self.__read_snapshot__()
+        if snapshot and (snapshot["mtime_ns"], snapshot["size"]) == (stat.st_mtime_ns, stat.st_size):
+            debug(f"Using configuration snapshot {self.snapshot_filepath}.")
+            self.__digest = snapshot["digest"]
+            return pickle.loads(snapshot["config"])
+        with open(self.config_filepath, "rb") as file:
+            content = file.read()
+        self.__digest = hashlib.sha256(content).hexdigest()
+        if snapshot and snapshot["digest"] == self.__digest:
+            debug(f"Using configuration snapshot {self.snapshot_filepath}.")
+            config = pickle.loads(snapshot["config"])
+        else:
+            config = safe_load_all(content)[0]
+        self.__write_snapshot__(config, stat)
+        return config
+
+    def __read_snapshot__(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.snapshot_filepath):
+            return None
+        try:
+            with open(self.snapshot_filepath, "rb") as file:
+                snapshot = pickle.load(file)
+            if snapshot.get("version", None) != (self.SNAPSHOT_VERSION, release, commit):
+                debug("Ignoring configuration snapshot: it was written by another version.")
+                return None
+            return snapshot
+        except Exception as e:
+            warning(f"Ignoring invalid configuration snapshot: {e}")
+            return None
+
+    def __write_snapshot__(self, config: Dict[str, Any], stat: os.stat_result):
+        """Must be called before the parsed objects are loaded, since loading modifies them."""
+        try:
+            snapshot = {
+                "version": (self.SNAPSHOT_VERSION, release, commit),
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "digest": self.__digest,
+                "config": pickle.dumps(config, pickle.HIGHEST_PROTOCOL),
+            }
+            write_atomically(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL), self.snapshot_filepath)
+        except Exception as e:
+            warning(f"Unable to write configuration snapshot: {e}")
 
     @staticmethod
     def save_credentials():
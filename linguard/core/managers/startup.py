@@ -0,0 +1,43 @@
+from logging import info, debug
+from time import perf_counter
+from typing import Callable, Dict, Any
+
+
+class StartupManager:
+    """
+    Runs the startup of the application as a sequence of phases, each of which is run only once and timed, so that
+    the time spent in each of them can be logged and queried.
+    """
+
+    def __init__(self):
+        # Seconds spent in each phase, in order of execution
+        self.phases: Dict[str, float] = {}
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def run_phase(self, name: str, function: Callable[[], Any]):
+        if name in self.phases:
+            debug(f"Skipping startup phase '{name}': already run.")
+            return
+        info(f"Startup phase '{name}'...")
+        start = perf_counter()
+        try:
+            function()
+        finally:
+            self.phases[name] = perf_counter() - start
+        info(f"Startup phase '{name}' done in {self.phases[name] * 1000:.1f} ms.")
+
+    def log_summary(self):
+        phases = ", ".join(f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases.items())
+        info(f"Started in {self.total * 1000:.1f} ms ({phases}).")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "phases": dict(self.phases),
+        }
+
+
+startup_manager = StartupManager()
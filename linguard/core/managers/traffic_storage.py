@@ -5,7 +5,11 @@ from schedule import repeat, every
 
 from linguard.core.config.traffic import config
 from linguard.core.drivers.traffic_storage_driver import TrafficStorageDriver
+from linguard.core.drivers.traffic_storage_driver_columnar import TrafficStorageDriverColumnar
 from linguard.core.drivers.traffic_storage_driver_json import TrafficStorageDriverJson
+from linguard.core.drivers.traffic_storage_driver_jsonl import TrafficStorageDriverJsonl
+from linguard.core.drivers.traffic_storage_driver_rrd import TrafficStorageDriverRrd
+from linguard.core.drivers.traffic_storage_driver_sqlite import TrafficStorageDriverSqlite
 
 
 @repeat(every(1).hours)
@@ -31,3 +35,7 @@ def unregister_driver(name: str):
 
 
 register_driver(TrafficStorageDriverJson())
+register_driver(TrafficStorageDriverJsonl())
+register_driver(TrafficStorageDriverSqlite())
+register_driver(TrafficStorageDriverRrd())
+register_driver(TrafficStorageDriverColumnar())
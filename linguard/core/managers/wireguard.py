@@ -1,32 +1,98 @@
-from logging import info
+from concurrent.futures import ThreadPoolExecutor
+from logging import info, error
+from typing import Callable, Dict, Iterable, Optional
 
+from linguard.common.utils.logs import log_exception
 from linguard.core.exceptions import WireguardError
-from linguard.core.models import interfaces
+from linguard.core.models import interfaces, Interface
+from linguard.core.utils.wireguard import invalidate_interfaces_status, wg_stats_cache
 
 
 class WireguardManager:
+    # Maximum number of interfaces brought up or down at the same time
+    MAX_WORKERS = 8
+
+    @classmethod
+    def __operate__(cls, ifaces: Iterable[Interface], operation: Callable[[Interface], None]) \
+            -> Dict[str, WireguardError]:
+        """
+        Run an operation on several interfaces concurrently.
+
+        :return: The errors raised by the operation, indexed by the name of the interface.
+        """
+        ifaces = list(ifaces)
+        if len(ifaces) < 1:
+            return {}
+
+        def run(iface: Interface) -> Optional[WireguardError]:
+            try:
+                operation(iface)
+            except WireguardError as e:
+                return e
+            except Exception as e:
+                log_exception(e)
+                return WireguardError(str(e))
+
+        with ThreadPoolExecutor(max_workers=min(len(ifaces), cls.MAX_WORKERS)) as executor:
+            results = list(executor.map(run, ifaces))
+        # The status gathered during the current request (if any) is outdated
+        invalidate_interfaces_status()
+        errors = {iface.name: e for iface, e in zip(ifaces, results) if e}
+        for name, e in errors.items():
+            error(f"Interface {name}: {e}")
+        return errors
 
     @staticmethod
-    def start():
+    def __save_traffic__():
+        """Store the traffic data once for all the interfaces about to be brought down."""
+        from linguard.core.config.traffic import config
+        if config.enabled:
+            wg_stats_cache.invalidate()
+            config.driver.save_data()
+
+    def start(self, ifaces: Iterable[Interface] = None) -> Dict[str, WireguardError]:
+        """
+        Bring interfaces up.
+
+        :param ifaces: Interfaces to bring up. Defaults to the ones which must be brought up automatically.
+        :return: The errors raised, indexed by the name of the interface.
+        """
         info("Starting VPN server...")
-        for iface in interfaces.values():
-            if not iface.auto:
-                continue
-            try:
-                iface.up()
-            except WireguardError:
-                pass
+        if ifaces is None:
+            ifaces = filter(lambda iface: iface.auto, interfaces.values())
+        errors = self.__operate__(ifaces, lambda iface: iface.up())
         info("VPN server started.")
+        return errors
 
-    @staticmethod
-    def stop():
+    def stop(self, ifaces: Iterable[Interface] = None) -> Dict[str, WireguardError]:
+        """
+        Bring interfaces down.
+
+        :param ifaces: Interfaces to bring down. Defaults to all of them.
+        :return: The errors raised, indexed by the name of the interface.
+        """
         info("Stopping VPN server...")
-        for iface in interfaces.values():
-            try:
-                iface.down()
-            except WireguardError:
-                pass
+        if ifaces is None:
+            ifaces = interfaces.values()
+        self.__save_traffic__()
+        errors = self.__operate__(ifaces, lambda iface: iface.down(save_traffic=False))
         info("VPN server stopped.")
+        return errors
+
+    def restart(self, ifaces: Iterable[Interface] = None) -> Dict[str, WireguardError]:
+        """
+        Restart interfaces.
+
+        :param ifaces: Interfaces to restart. Defaults to all of them.
+        :return: The errors raised, indexed by the name of the interface.
+        """
+        info("Restarting VPN server...")
+        if ifaces is None:
+            ifaces = interfaces.values()
+        self.__save_traffic__()
+        errors = self.__operate__(ifaces, lambda iface: iface.restart(save_traffic=False))
+        info("VPN server restarted.")
+        return errors
 
 
 wireguard_manager = WireguardManager()
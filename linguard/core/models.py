@@ -4,18 +4,20 @@ import os
 import re
 from logging import info, warning, error, debug
 from random import randint
-from time import sleep
-from typing import Dict, Any, Type, List, Mapping
+from typing import Dict, Any, Type, List, Mapping, Optional, Tuple
 from uuid import uuid4 as gen_uuid
 
 from coolname import generate_slug
 from yamlable import YamlAble, yaml_info, Y
 
 from linguard.common.models.enhanced_dict import EnhancedDict, V, K
-from linguard.common.utils.file import write_lines
-from linguard.common.utils.system import Command, try_makedir
+from linguard.common.utils.file import write_atomically, get_digest, get_file_digest
+from linguard.common.utils.network import get_link_names
+from linguard.common.utils.privileged import privileged_helper
+from linguard.common.utils.system import Command, CommandResult, try_makedir, wait_until
 from linguard.core.exceptions import WireguardError
-from linguard.core.utils.wireguard import get_wg_interface_status
+from linguard.core.utils.wireguard import get_wg_interface_status, wg_stats_cache, get_interfaces_status, \
+    invalidate_interfaces_status, set_wg_peer, remove_wg_peer, generate_privkey, generate_pubkey
 
 
 @yaml_info(yaml_tag='interface')
@@ -29,6 +31,10 @@ class Interface(YamlAble):
     REGEX_IPV4_PARTIAL = "([1-9]|[1-9]\d|1\d{2}|2[0-4]\d|25[0-5])(\.(\d|[1-9]\d|1\d{2}|2[0-4]\d|25[0-5])){3}"
     REGEX_IPV4 = f"^{REGEX_IPV4_PARTIAL}$"
     REGEX_IPV4_CIDR = f"^{REGEX_IPV4_PARTIAL}\/(3[0-2]|[1-2]\d|\d)$"
+    # Seconds to wait for the device to disappear when restarting
+    RESTART_TIMEOUT = 5
+    # Default MTU set by wg-quick
+    MTU = 1420
 
     @property
     def wg_quick_bin(self):
@@ -50,9 +56,10 @@ class Interface(YamlAble):
         self.peers = peers or PeerDict()
         for peer in self.peers.values():
             peer.interface = self
-        from linguard.core.utils.wireguard import generate_privkey, generate_pubkey
         from linguard.core.config.wireguard import config
         self.conf_file = f"{os.path.join(config.interfaces_folder, self.name)}.conf"
+        # Path and digest of the last configuration written
+        self.__saved_conf: Optional[Tuple[str, str]] = None
         self.private_key = private_key or generate_privkey()
         if not private_key:
             warning("Generating new public key because no private key was provided.")
@@ -110,24 +117,44 @@ class Interface(YamlAble):
             iface += f"PostUp = {cmd}\n"
         for cmd in self.on_down:
             iface += f"PostDown = {cmd}\n"
+        return iface + self.__generate_peers_conf__()
 
+    def generate_wg_conf(self) -> str:
+        """Generate the configuration for this interface understood by wg setconf, i.e. without wg-quick's fields."""
+        iface = ("[Interface]\n"
+                 f"PrivateKey = {self.private_key}\n"
+                 f"ListenPort = {self.listen_port}\n")
+        return iface + self.__generate_peers_conf__()
+
+    def __generate_peers_conf__(self) -> str:
         peers = ""
         for peer in self.peers.values():
             peers += (f"\n[Peer]\n"
                       f"PublicKey = {peer.public_key}\n"
                       f"AllowedIPs = {peer.ipv4_address}\n")
-        return iface + peers
+        return peers
 
     def save(self):
-        """Store the current wireguard configuration for this interface in the file system."""
-        debug(f"Saving configuration of interface {self.name} to {self.conf_file}...")
-        try_makedir(os.path.dirname(self.conf_file))
-        write_lines(self.generate_conf(), self.conf_file)
-        debug(f"Configuration saved!")
+        """
+        Store the current wireguard configuration for this interface in the file system, unless the file is already
+        up-to-date.
+        """
+        conf = self.generate_conf()
+        saved_conf = (self.conf_file, get_digest(conf))
+        if saved_conf == self.__saved_conf and os.path.exists(self.conf_file):
+            return
+        if get_file_digest(self.conf_file) == saved_conf[1]:
+            debug(f"Configuration of interface {self.name} is up-to-date.")
+        else:
+            debug(f"Saving configuration of interface {self.name} to {self.conf_file}...")
+            try_makedir(os.path.dirname(self.conf_file))
+            write_atomically(conf, self.conf_file)
+            debug(f"Configuration saved!")
+        self.__saved_conf = saved_conf
 
     @property
     def is_up(self):
-        return Command(f"ip a | grep -w {self.name}").run().successful
+        return get_interfaces_status().is_up(self.name)
 
     @property
     def is_down(self):
@@ -143,36 +170,119 @@ class Interface(YamlAble):
             warning(f"Unable to bring {self.name} up: already up.")
             return
         self.save()
-        result = Command(f"{self.wg_quick_bin} up {self.conf_file}").run_as_root()
+        from linguard.core.config.wireguard import config
+        if config.native_interfaces:
+            result = self.__up_native__()
+        else:
+            result = Command([self.wg_quick_bin, "up", self.conf_file]).run_as_root()
+        wg_stats_cache.invalidate()
+        invalidate_interfaces_status()
         if result.successful:
             info(f"Interface {self.name} started.")
         else:
             error(f"Failed to start interface {self.name}: code={result.code} | err={result.err} | out={result.output}")
             raise WireguardError(result.err)
 
-    def down(self):
+    def down(self, save_traffic: bool = True):
+        """
+        Bring the interface down.
+
+        :param save_traffic: Store the traffic data of all interfaces before, so that the counters of this one are not
+            lost. Callers stopping several interfaces at once should do it only once beforehand.
+        """
         info(f"Stopping interface {self.name}...")
         if self.is_down:
             warning(f"Unable to bring {self.name} down: already down.")
             return
         from linguard.core.config.traffic import config
-        if config.enabled:
+        if save_traffic and config.enabled:
+            # Store the latest counters, not a snapshot which may be a few seconds old
+            wg_stats_cache.invalidate()
             config.driver.save_data()
-        result = Command(f"{self.wg_quick_bin} down {self.conf_file}").run_as_root()
+        from linguard.core.config.wireguard import config as wireguard_config
+        if wireguard_config.native_interfaces:
+            result = self.__down_native__()
+        else:
+            result = Command([self.wg_quick_bin, "down", self.conf_file]).run_as_root()
+        wg_stats_cache.invalidate()
+        invalidate_interfaces_status()
         if result.successful:
             info(f"Interface {self.name} stopped.")
         else:
             error(f"Failed to stop interface {self.name}: code={result.code} | err={result.err} | out={result.output}")
             raise WireguardError(result.err)
 
+    def __up_native__(self) -> CommandResult:
+        """
+        Bring the interface up as wg-quick does, but running ip and wg directly: create the link, load the keys and
+        peers through wg's standard input, set the address, bring the link up, add routes to the peers outside of the
+        interface's network and run the PostUp hooks.
+        """
+        self.__check_native__()
+        from linguard.core.config.wireguard import config
+        network = ipaddress.IPv4Interface(self.ipv4_address).network
+        commands = [
+            Command([config.ip_bin, "link", "add", "dev", self.name, "type", "wireguard"]),
+            Command([config.wg_bin, "setconf", self.name, "/dev/stdin"], input=self.generate_wg_conf()),
+            Command([config.ip_bin, "-4", "address", "add", self.ipv4_address, "dev", self.name]),
+            Command([config.ip_bin, "link", "set", "mtu", str(self.MTU), "up", "dev", self.name]),
+        ]
+        routes = {ipaddress.IPv4Interface(peer.ipv4_address).network for peer in self.peers.values()}
+        for route in sorted(filter(lambda r: not r.subnet_of(network), routes)):
+            commands.append(Command([config.ip_bin, "-4", "route", "replace", str(route), "dev", self.name]))
+        commands += self.__get_hooks__(self.on_up)
+        for command in commands:
+            result = command.run_as_root()
+            if not result.successful:
+                if command is not commands[0]:
+                    Command([config.ip_bin, "link", "delete", "dev", self.name]).run_as_root()
+                return result
+        return CommandResult(0, "", "")
+
+    def __down_native__(self) -> CommandResult:
+        """Bring the interface down as wg-quick does: delete the link and run the PostDown hooks."""
+        self.__check_native__()
+        from linguard.core.config.wireguard import config
+        result = Command([config.ip_bin, "link", "delete", "dev", self.name]).run_as_root()
+        if not result.successful:
+            return result
+        for command in self.__get_hooks__(self.on_down):
+            hook_result = command.run_as_root()
+            if not hook_result.successful:
+                result = hook_result
+        return result
+
+    @staticmethod
+    def __check_native__():
+        """
+        Make sure that native interfaces can be managed: ip and the PostUp/PostDown hooks are only allowed to be run as
+        root by the privileged helper, not by the sudoers entries, which only cover wg and wg-quick.
+        """
+        if not privileged_helper.is_available():
+            raise WireguardError("native interfaces require the privileged helper, which is not running. Make sure "
+                                 "it is installed or disable native_interfaces.")
+
+    def __get_hooks__(self, hooks: List[str]) -> List[Command]:
+        """
+        Get the commands of PostUp/PostDown hooks. As wg-quick does, every line is run by a shell of its own, so that
+        the whole line (pipes, redirections, chained commands...) is run as root.
+        """
+        commands = []
+        for hook in hooks:
+            for line in hook.replace("%i", self.name).splitlines():
+                if line.strip():
+                    commands.append(Command(["sh", "-c", line.strip()]))
+        return commands
+
     def apply(self):
         self.down()
         self.save()
         self.up()
 
-    def restart(self):
-        self.down()
-        sleep(1)
+    def restart(self, save_traffic: bool = True):
+        self.down(save_traffic)
+        if not wait_until(lambda: self.name not in get_link_names(), self.RESTART_TIMEOUT):
+            warning(f"Interface {self.name} still exists after {self.RESTART_TIMEOUT} seconds.")
         self.up()
 
     def remove(self):
@@ -199,6 +309,21 @@ class Interface(YamlAble):
     def add_peer(self, peer: "Peer"):
         self.peers[peer.uuid] = peer
         self.peers.sort()
+        self.push_peer(peer)
+
+    def push_peer(self, peer: "Peer"):
+        """Add or update a peer on the running interface, if up, without restarting it."""
+        if self.is_down:
+            return
+        self.save()
+        set_wg_peer(self.name, peer.public_key, [peer.ipv4_address])
+
+    def withdraw_peer(self, peer: "Peer"):
+        """Remove a peer from the running interface, if up, without restarting it."""
+        if self.is_down:
+            return
+        self.save()
+        remove_wg_peer(self.name, peer.public_key)
 
     @classmethod
     def generate_valid_name(cls) -> str:
@@ -271,7 +396,6 @@ class Peer(YamlAble):
         self.dns1 = dns1
         self.dns2 = dns2
         self.uuid = uuid or gen_uuid().hex
-        from linguard.core.utils.wireguard import generate_privkey, generate_pubkey
         self.private_key = private_key or generate_privkey()
         if not private_key:
             warning("Generating new public key because no private key was provided.")
@@ -338,21 +462,31 @@ class Peer(YamlAble):
 
     def edit(self, name: str, description: str, ipv4_address: str, interface: Interface, dns1: str, dns2: str,
              nat: bool):
-        self.remove()
+        moved = interface != self.interface
+        if moved:
+            self.remove()
+        address_changed = ipv4_address != self.ipv4_address
         self.name = name
         self.description = description
         self.ipv4_address = ipv4_address
         self.interface = interface
-        self.interface.add_peer(self)
         self.dns1 = dns1
         self.dns2 = dns2
         self.nat = nat
+        if moved:
+            self.interface.add_peer(self)
+            return
+        self.interface.peers.sort()
+        # The rest of the fields are only used by the peer's own configuration
+        if address_changed:
+            self.interface.push_peer(self)
 
     def remove(self):
         if self.uuid not in self.interface.peers:
             return
         del self.interface.peers[self.uuid]
         self.interface.peers.sort()
+        self.interface.withdraw_peer(self)
 
     @classmethod
     def is_ip_in_use(cls, ip: str, peer_to_exclude: "Peer" = None) -> bool:
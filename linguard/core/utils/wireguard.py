@@ -1,29 +1,214 @@
+import base64
+import binascii
+from datetime import datetime
+from logging import warning
+from typing import Dict, Optional, List, Iterable, Iterator, Union, Set
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, PublicFormat, NoEncryption
+from flask import has_request_context, g
+
+from linguard.common.utils.cache import SnapshotCache
+from linguard.common.utils.network import get_link_names
 from linguard.common.utils.system import Command
 from linguard.core.exceptions import WireguardError
 
+INTERFACES_STATUS_KEY = "interfaces_status"
+
+
+class InterfacesStatus:
+    """
+    Status of all network interfaces, gathered at once: existing links are read from sysfs and running WireGuard
+    interfaces from a single ``wg show interfaces``. Each source is only queried the first time it is needed.
+    """
+
+    def __init__(self):
+        self.__links: Optional[Set[str]] = None
+        self.__wireguard: Optional[Set[str]] = None
+
+    @property
+    def links(self) -> Set[str]:
+        if self.__links is None:
+            self.__links = get_link_names()
+        return self.__links
+
+    @property
+    def wireguard(self) -> Set[str]:
+        if self.__wireguard is None:
+            from linguard.core.config.wireguard import config
+            result = Command([config.wg_bin, "show", "interfaces"]).run_as_root()
+            self.__wireguard = set(result.output.split()) if result.successful else set()
+        return self.__wireguard
+
+    def is_up(self, name: str) -> bool:
+        return name in self.links
+
+    def get_status(self, name: str) -> str:
+        if name in self.wireguard:
+            return "up"
+        return "down"
+
+
+def get_interfaces_status() -> InterfacesStatus:
+    """
+    Get the status of all network interfaces. While handling a request, it is gathered only once per request (unless
+    an interface is brought up or down).
+    """
+    if not has_request_context():
+        return InterfacesStatus()
+    status = g.get(INTERFACES_STATUS_KEY, None)
+    if status is None:
+        status = InterfacesStatus()
+        setattr(g, INTERFACES_STATUS_KEY, status)
+    return status
+
+
+def invalidate_interfaces_status():
+    """Discard the status gathered during the current request, if any."""
+    if has_request_context():
+        g.pop(INTERFACES_STATUS_KEY, None)
+
 
 def is_wg_iface_up(iface_name: str) -> bool:
-    from linguard.core.config.wireguard import config
-    return Command(f"{config.wg_bin} show {iface_name}").run_as_root().successful
+    return get_interfaces_status().get_status(iface_name) == "up"
 
 
 def generate_privkey() -> str:
-    from linguard.core.config.wireguard import config
-    result = Command(f"{config.wg_bin} genkey").run_as_root()
-    if not result.successful:
-        raise WireguardError(result.err)
-    return result.output
+    """Generate a WireGuard private key (a clamped Curve25519 scalar), encoded in base64 like ``wg genkey`` does."""
+    key = bytearray(X25519PrivateKey.generate().private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption()))
+    key[0] &= 248
+    key[31] = (key[31] & 127) | 64
+    return base64.b64encode(bytes(key)).decode("ascii")
 
 
 def generate_pubkey(privkey: str) -> str:
+    """Get the base64 encoded public key of a WireGuard private key, like ``wg pubkey`` does."""
+    try:
+        key = base64.b64decode(privkey.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise WireguardError("Invalid private key: not base64 encoded.")
+    if len(key) != 32:
+        raise WireguardError("Invalid private key: it must be 32 bytes long.")
+    public_key = X25519PrivateKey.from_private_bytes(key).public_key()
+    return base64.b64encode(public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)).decode("ascii")
+
+
+def get_wg_interface_status(name: str) -> str:
+    return get_interfaces_status().get_status(name)
+
+
+def get_wg_interfaces_status(names: Iterable[str]) -> Dict[str, str]:
+    """Get the status of several interfaces at once."""
+    status = get_interfaces_status()
+    return {name: status.get_status(name) for name in names}
+
+
+class WireguardPeerStats:
+    """Runtime information of a peer, as reported by ``wg show all dump``."""
+
+    def __init__(self, interface: str, public_key: str, preshared_key: Optional[str], endpoint: Optional[str],
+                 allowed_ips: List[str], latest_handshake: Optional[datetime], transfer_rx: int, transfer_tx: int,
+                 persistent_keepalive: Optional[int]):
+        self.interface = interface
+        self.public_key = public_key
+        self.preshared_key = preshared_key
+        self.endpoint = endpoint
+        self.allowed_ips = allowed_ips
+        self.latest_handshake = latest_handshake
+        self.transfer_rx = transfer_rx
+        self.transfer_tx = transfer_tx
+        self.persistent_keepalive = persistent_keepalive
+
+
+class WireguardInterfaceStats:
+    """
+    Runtime information of an interface, as reported by ``wg show all dump``. Its private key is not kept.
+    """
+
+    def __init__(self, name: str, public_key: Optional[str], listen_port: Optional[int], fwmark: Optional[int]):
+        self.name = name
+        self.public_key = public_key
+        self.listen_port = listen_port
+        self.fwmark = fwmark
+        # Indexed by public key
+        self.peers: Dict[str, WireguardPeerStats] = {}
+
+
+def __none__(value: str, none: str = "(none)") -> Optional[str]:
+    return None if value == none else value
+
+
+def parse_wg_dump(lines: Iterable[str]) -> Iterator[Union[WireguardInterfaceStats, WireguardPeerStats]]:
+    """
+    Parse the output of ``wg show all dump`` line by line, as it is read. Every line holds the tab-separated fields of
+    either an interface or a peer, and every interface is listed before its peers.
+
+    :param lines: Lines of the output.
+    :return: An interface or peer record per line.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) == 5:
+            name, _, public_key, listen_port, fwmark = fields
+            yield WireguardInterfaceStats(name, __none__(public_key), int(listen_port) or None,
+                                          None if fwmark == "off" else int(fwmark, 0))
+        elif len(fields) == 9:
+            interface, public_key, preshared_key, endpoint, allowed_ips, latest_handshake, transfer_rx, \
+                transfer_tx, persistent_keepalive = fields
+            latest_handshake = int(latest_handshake)
+            yield WireguardPeerStats(interface, public_key, __none__(preshared_key), __none__(endpoint),
+                                     [] if allowed_ips == "(none)" else allowed_ips.split(","),
+                                     datetime.fromtimestamp(latest_handshake) if latest_handshake else None,
+                                     int(transfer_rx), int(transfer_tx),
+                                     None if persistent_keepalive == "off" else int(persistent_keepalive))
+        elif line.strip():
+            # Do not log the line itself, since it may contain keys
+            warning(f"Skipping unexpected line {line_number} of wg dump: {len(fields)} fields.")
+
+
+def __load_wg_stats__() -> Dict[str, WireguardInterfaceStats]:
     from linguard.core.config.wireguard import config
-    result = Command(f"echo {privkey} | sudo {config.wg_bin} pubkey").run()
+    stats = {}
+    for record in parse_wg_dump(Command([config.wg_bin, "show", "all", "dump"]).iter_lines(as_root=True)):
+        if isinstance(record, WireguardInterfaceStats):
+            stats[record.name] = record
+        elif record.interface in stats:
+            stats[record.interface].peers[record.public_key] = record
+    return stats
+
+
+wg_stats_cache = SnapshotCache(__load_wg_stats__, 3)
+
+
+def get_wg_stats() -> Dict[str, WireguardInterfaceStats]:
+    """
+    Get the runtime information of every running interface and its peers, as reported by ``wg show all dump``.
+    Snapshots are shared by all callers for a few seconds (see ``TrafficConfig.session_cache_ttl``), so that
+    concurrent requests do not run the command once each.
+
+    :return: A dictionary indexed by interface name. It must not be modified.
+    """
+    from linguard.core.config.traffic import config
+    wg_stats_cache.ttl = config.session_cache_ttl
+    return wg_stats_cache.get()
+
+
+def __wg_set__(args: List[str]):
+    from linguard.core.config.wireguard import config
+    result = Command([config.wg_bin, "set"] + args).run_as_root()
+    wg_stats_cache.invalidate()
     if not result.successful:
-        raise WireguardError(result.err)
-    return result.output
+        raise WireguardError(f"Unable to update running interface: {result.err or result.output}")
 
 
-def get_wg_interface_status(name: str) -> str:
-    if is_wg_iface_up(name):
-        return "up"
-    return "down"
+def set_wg_peer(iface_name: str, public_key: str, allowed_ips: List[str]):
+    """
+    Add a peer to a running interface, or replace its allowed IPs, without restarting the interface (so that the rest
+    of its peers stay connected).
+    """
+    __wg_set__([iface_name, "peer", public_key, "allowed-ips", ",".join(allowed_ips)])
+
+
+def remove_wg_peer(iface_name: str, public_key: str):
+    """Remove a peer from a running interface, without restarting the interface."""
+    __wg_set__([iface_name, "peer", public_key, "remove"])
@@ -0,0 +1,88 @@
+import asyncio
+import signal
+from time import monotonic
+
+import pytest
+
+from linguard.common.utils.system import Command, CommandResult, run_many, wait_until, TIMEOUT_CODE, NOT_FOUND_CODE
+
+
+def test_run():
+    result = Command("echo hello").run()
+    assert result.successful
+    assert result.output == "hello"
+
+
+def test_timeout():
+    start = monotonic()
+    result = Command("sleep 10", timeout=0.2).run()
+    assert monotonic() - start < 5
+    assert result.code == TIMEOUT_CODE
+    assert not result.successful
+
+
+def test_run_many():
+    start = monotonic()
+    results = run_many([Command(f"sleep 0.3 && echo {i}") for i in range(4)])
+    assert monotonic() - start < 1.2
+    assert [result.output for result in results] == ["0", "1", "2", "3"]
+    assert run_many([]) == []
+
+
+def test_run_many_timeout():
+    results = run_many([Command("sleep 0.5"), Command("echo late")], max_workers=1, timeout=0.1)
+    assert results[1].code == TIMEOUT_CODE
+
+
+def test_run_async():
+    async def main():
+        results = await asyncio.gather(Command("echo a").run_async(), Command("sleep 10", timeout=0.2).run_async())
+        assert results[0].output == "a"
+        assert results[1].code == TIMEOUT_CODE
+        task = asyncio.ensure_future(Command("sleep 10").run_async())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+
+def test_run_argv():
+    result = Command(["echo", "a; echo b", "$HOME"]).run()
+    assert result.output == "a; echo b $HOME"
+    assert str(Command(["echo", "a b"])) == "echo 'a b'"
+    result = Command(["/nonexistent/binary"]).run()
+    assert result.code == NOT_FOUND_CODE
+    assert list(Command(["/nonexistent/binary"]).iter_lines()) == []
+
+
+def test_wait_until():
+    start = monotonic()
+    assert wait_until(lambda: monotonic() - start > 0.1, 5)
+    assert not wait_until(lambda: False, 0.1)
+
+
+def test_input():
+    assert Command(["cat"], input="secret\n").run().output == "secret"
+    assert Command("tr a-z A-Z", input="secret").run().output == "SECRET"
+
+    async def main():
+        return await Command(["cat"], input="secret").run_async()
+
+    assert asyncio.run(main()).output == "secret"
+
+
+def test_signal_root_group(monkeypatch):
+    def killpg(pid, sig):
+        raise PermissionError()
+
+    commands = []
+    monkeypatch.setattr("os.killpg", killpg)
+    monkeypatch.setattr(Command, "run", lambda self, as_root=False: commands.append((self.cmd, as_root)) or
+                        CommandResult(0, "", ""))
+    Command.__signal_group__(1234, signal.SIGTERM)
+    assert commands == []
+    # Commands run using sudo belong to root
+    Command.__signal_group__(1234, signal.SIGTERM, as_root=True)
+    assert commands == [(["kill", f"-{int(signal.SIGTERM)}", "--", "-1234"], True)]
@@ -0,0 +1,56 @@
+import os
+import stat
+
+import pytest
+
+from linguard.common.utils import file
+from linguard.tests.utils import default_cleanup, create_test_iface
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    default_cleanup()
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    writes = []
+    write_atomically = file.write_atomically
+
+    def write(content: str, path: str, mode: int = 0o600):
+        writes.append(path)
+        write_atomically(content, path, mode)
+
+    monkeypatch.setattr("linguard.core.models.write_atomically", write)
+    yield writes
+
+
+def test_save_only_changes(writes):
+    iface = create_test_iface("iface1", "10.0.0.1/24", 50000)
+    try:
+        iface.save()
+        iface.save()
+        assert writes == [iface.conf_file]
+        assert stat.S_IMODE(os.stat(iface.conf_file).st_mode) == 0o600
+        with open(iface.conf_file, "r") as f:
+            assert f.read() == iface.generate_conf()
+
+        # Up-to-date files are not written again, even by another instance
+        copy = create_test_iface("iface1", "10.0.0.1/24", 50000)
+        copy.private_key = iface.private_key
+        copy.on_up, copy.on_down = iface.on_up, iface.on_down
+        copy.save()
+        assert len(writes) == 1
+
+        iface.listen_port = 50001
+        iface.save()
+        assert len(writes) == 2
+        os.remove(iface.conf_file)
+        iface.save()
+        assert len(writes) == 3
+        folder = os.path.dirname(iface.conf_file)
+        assert not [name for name in os.listdir(folder) if name.endswith(".tmp")]
+    finally:
+        if os.path.exists(iface.conf_file):
+            os.remove(iface.conf_file)
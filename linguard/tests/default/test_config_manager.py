@@ -0,0 +1,105 @@
+import os
+import shutil
+from tempfile import mkdtemp
+from time import sleep
+
+import pytest
+import yaml
+
+from linguard.core.config.web import config as web_config
+from linguard.core.managers import config
+from linguard.common.utils.yaml import safe_load_all, safe_dump
+from linguard.core.managers.config import ConfigManager
+
+
+@pytest.fixture
+def manager():
+    folder = mkdtemp()
+    manager = ConfigManager()
+    manager.config_filepath = os.path.join(folder, ConfigManager.CONFIG_FILENAME)
+    manager.SAVE_DELAY = 0.2
+    yield manager
+    manager.flush()
+    shutil.rmtree(folder)
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    writes = []
+    write_atomically = config.write_atomically
+
+    def write(content: str, path: str):
+        writes.append(path)
+        write_atomically(content, path)
+
+    monkeypatch.setattr(config, "write_atomically", write)
+    yield writes
+
+
+def test_debounce(manager, writes):
+    for _ in range(10):
+        manager.save(apply=False)
+    assert writes == []
+    sleep(0.5)
+    assert writes == [manager.config_filepath]
+    with open(manager.config_filepath, "r") as f:
+        assert "wireguard" in yaml.safe_load(f)
+
+
+def test_flush(manager, writes):
+    manager.flush()
+    assert writes == []
+    manager.save(apply=False)
+    manager.flush()
+    manager.flush()
+    assert len(writes) == 1
+    sleep(0.3)
+    assert len(writes) == 1
+
+
+def test_batch(manager, writes):
+    with manager.batch():
+        with manager.batch():
+            manager.save(apply=False)
+        manager.save(apply=False)
+        sleep(0.3)
+        assert writes == []
+    assert len(writes) == 1
+
+
+def test_write_saved_state(manager, writes, monkeypatch):
+    monkeypatch.setattr(web_config, "login_attempts", 5)
+    manager.save(apply=False)
+    # Changes which are not saved yet must not be written by the timer, which could see them half-done
+    web_config.login_attempts = 6
+    sleep(0.5)
+    assert len(writes) == 1
+    with open(manager.config_filepath, "r") as f:
+        assert safe_load_all(f.read())[0]["web"].login_attempts == 5
+
+
+def test_snapshot(manager, monkeypatch):
+    sample_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+                               "config", "linguard.sample.yaml")
+    shutil.copy(sample_file, manager.config_filepath)
+    parsed = []
+    monkeypatch.setattr(config, "safe_load_all", lambda content: parsed.append(content) or safe_load_all(content))
+    expected = manager.read_config()
+    assert len(parsed) == 1
+    assert os.path.exists(manager.snapshot_filepath)
+
+    snapshot = manager.read_config()
+    assert len(parsed) == 1
+    assert safe_dump(snapshot) == safe_dump(expected)
+    iface = next(iter(snapshot["wireguard"].interfaces.values()))
+    assert all(peer.interface is iface for peer in iface.peers.values())
+
+    # Same content, different modification time
+    os.utime(manager.config_filepath, ns=(0, 0))
+    manager.read_config()
+    assert len(parsed) == 1
+
+    with open(manager.config_filepath, "a") as f:
+        f.write("\n")
+    manager.read_config()
+    assert len(parsed) == 2
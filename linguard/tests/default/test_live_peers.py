@@ -0,0 +1,59 @@
+import pytest
+
+from linguard.common.utils.system import CommandResult
+from linguard.core.models import Interface, Peer
+from linguard.tests.utils import default_cleanup, create_test_iface
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    default_cleanup()
+
+
+@pytest.fixture
+def ifaces():
+    yield create_test_iface("iface1", "10.0.0.1/24", 50000), create_test_iface("iface2", "10.0.1.1/24", 50001)
+
+
+@pytest.fixture
+def commands(monkeypatch, ifaces):
+    commands = []
+
+    def run(self, as_root: bool = False):
+        commands.append(self.cmd[1:])
+        return CommandResult(0, "", "")
+
+    monkeypatch.setattr("linguard.common.utils.system.Command.run", run)
+    monkeypatch.setattr(Interface, "is_down", property(lambda self: False))
+    monkeypatch.setattr(Interface, "save", lambda self: None)
+    yield commands
+
+
+def test_live_peers(ifaces, commands):
+    iface1, iface2 = ifaces
+    peer = Peer(name="peer1", description="", ipv4_address="10.0.0.2/32", nat=False, interface=iface1,
+                dns1="8.8.8.8")
+    iface1.add_peer(peer)
+    assert commands == [["set", "iface1", "peer", peer.public_key, "allowed-ips", "10.0.0.2/32"]]
+
+    commands.clear()
+    peer.edit(name="peer2", description="", ipv4_address="10.0.0.2/32", interface=iface1, dns1="1.1.1.1",
+              dns2="", nat=True)
+    assert commands == []
+    peer.edit(name="peer2", description="", ipv4_address="10.0.0.3/32", interface=iface1, dns1="1.1.1.1",
+              dns2="", nat=True)
+    assert commands == [["set", "iface1", "peer", peer.public_key, "allowed-ips", "10.0.0.3/32"]]
+
+    commands.clear()
+    peer.edit(name="peer2", description="", ipv4_address="10.0.1.2/32", interface=iface2, dns1="1.1.1.1",
+              dns2="", nat=True)
+    assert commands == [["set", "iface1", "peer", peer.public_key, "remove"],
+                        ["set", "iface2", "peer", peer.public_key, "allowed-ips", "10.0.1.2/32"]]
+    assert peer.uuid not in iface1.peers
+    assert iface2.peers[peer.uuid] is peer
+
+    commands.clear()
+    peer.remove()
+    assert commands == [["set", "iface2", "peer", peer.public_key, "remove"]]
+    assert peer.uuid not in iface2.peers
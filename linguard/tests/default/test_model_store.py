@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from linguard.common.properties import global_properties
+from linguard.core.config.wireguard import WireguardConfig
+from linguard.core.drivers.model_store_sqlite import ModelStoreSqlite
+from linguard.core.models import Peer, InterfaceDict, interfaces
+from linguard.tests.utils import default_cleanup, create_test_iface, get_testing_app
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    get_testing_app()
+    yield
+    default_cleanup()
+
+
+@pytest.fixture
+def ifaces():
+    ifaces = InterfaceDict()
+    for i in range(2):
+        iface = create_test_iface(f"iface{i}", f"10.0.{i}.1/24", 50000 + i)
+        for j in range(2, 4):
+            peer = Peer(name=f"peer{i}{j}", description="", ipv4_address=f"10.0.{i}.{j}/32", nat=bool(j % 2),
+                        interface=iface, dns1="8.8.8.8", dns2="")
+            iface.peers[peer.uuid] = peer
+        ifaces[iface.uuid] = iface
+    yield ifaces
+
+
+@pytest.fixture
+def store():
+    store = ModelStoreSqlite(global_properties.join_workdir(ModelStoreSqlite.FILENAME))
+    yield store
+    store.close()
+
+
+def assert_equal(expected: InterfaceDict, actual: InterfaceDict):
+    assert list(expected.keys()) == list(actual.keys())
+    for iface in expected.values():
+        loaded = actual[iface.uuid]
+        assert loaded.__to_yaml_dict__().keys() == iface.__to_yaml_dict__().keys()
+        for key in ("name", "ipv4_address", "listen_port", "private_key", "public_key", "auto", "on_up", "on_down"):
+            assert getattr(loaded, key) == getattr(iface, key)
+        assert list(loaded.peers.keys()) == list(iface.peers.keys())
+        for peer in iface.peers.values():
+            assert loaded.peers[peer.uuid].__to_yaml_dict__() == peer.__to_yaml_dict__()
+            assert loaded.peers[peer.uuid].interface is loaded
+
+
+def test_save_load(ifaces, store):
+    assert store.is_empty()
+    store.save_all(ifaces)
+    assert not store.is_empty()
+    assert_equal(ifaces, store.load())
+
+    iface0, iface1 = ifaces.values()
+    peer = next(iter(iface0.peers.values()))
+    peer.edit(name="moved", description="", ipv4_address="10.0.1.9/32", interface=iface1, dns1="1.1.1.1", dns2="",
+              nat=True)
+    store.save_peer(peer)
+    iface1.listen_port = 50010
+    store.save_interface(iface1)
+    assert_equal(ifaces, store.load())
+
+    store.remove_peer(peer)
+    peer.remove()
+    store.remove_interface(iface0)
+    del ifaces[iface0.uuid]
+    assert_equal(ifaces, store.load())
+
+
+def test_import_export(ifaces, store):
+    store.save_all(ifaces)
+    path = global_properties.join_workdir("export.yaml")
+    store.export_yaml(path)
+    other = ModelStoreSqlite(global_properties.join_workdir("other.db"))
+    other.import_yaml(path)
+    assert_equal(ifaces, other.load())
+    other.close()
+
+
+def test_migration(ifaces):
+    loaded = WireguardConfig()
+    loaded.endpoint = "vpn.example.com"
+    loaded.interfaces = ifaces
+    loaded.interfaces_store = WireguardConfig.STORE_SQLITE
+    config = WireguardConfig()
+    config.load(loaded)
+    assert "interfaces" not in config.__to_yaml_dict__()
+    assert_equal(ifaces, config.store.load())
+    config.store.close()
+
+    # Back to the configuration file
+    interfaces.clear()
+    loaded.interfaces = InterfaceDict()
+    loaded.interfaces_store = WireguardConfig.STORE_YAML
+    config.load(loaded)
+    assert_equal(ifaces, interfaces)
+    assert config.__to_yaml_dict__()["interfaces"] is interfaces
+    assert not os.path.exists(global_properties.join_workdir(ModelStoreSqlite.FILENAME))
@@ -0,0 +1,88 @@
+import pytest
+
+from linguard.common.utils.privileged import privileged_helper
+from linguard.common.utils.system import CommandResult
+from linguard.core.config.wireguard import config
+from linguard.core.exceptions import WireguardError
+from linguard.core.models import Interface, Peer
+from linguard.tests.utils import default_cleanup, create_test_iface
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    default_cleanup()
+
+
+@pytest.fixture
+def iface():
+    iface = create_test_iface("iface1", "10.0.0.1/24", 50000)
+    iface.on_up = ["iptables -I FORWARD -i %i -j ACCEPT\niptables -I FORWARD -o %i -j ACCEPT\n"]
+    iface.on_down = ["iptables -D FORWARD -i %i -j ACCEPT"]
+    yield iface
+
+
+@pytest.fixture
+def commands(monkeypatch, iface):
+    commands = []
+
+    def run(self, as_root: bool = False):
+        commands.append(self)
+        code = 1 if self.cmd == ["sh", "-c", "iptables -I FORWARD -o iface1 -j ACCEPT"] else 0
+        return CommandResult(code, "", "")
+
+    monkeypatch.setattr("linguard.common.utils.system.Command.run", run)
+    monkeypatch.setattr(config, "native_interfaces", True)
+    monkeypatch.setattr(config, "ip_bin", "ip")
+    monkeypatch.setattr(config, "wg_bin", "wg")
+    monkeypatch.setattr(Interface, "save", lambda self: None)
+    monkeypatch.setattr(privileged_helper, "is_available", lambda: True)
+    yield commands
+
+
+def test_native_up(iface, commands, monkeypatch):
+    peer = Peer(name="peer1", description="", ipv4_address="10.0.1.2/32", nat=False, interface=iface, dns1="8.8.8.8")
+    iface.peers[peer.uuid] = peer
+    monkeypatch.setattr(Interface, "is_up", property(lambda self: False))
+    iface.on_up = ["sysctl -w net.ipv4.ip_forward=1 && iptables -I FORWARD -i %i -j ACCEPT"]
+    iface.up()
+    assert [command.cmd for command in commands] == [
+        ["ip", "link", "add", "dev", "iface1", "type", "wireguard"],
+        ["wg", "setconf", "iface1", "/dev/stdin"],
+        ["ip", "-4", "address", "add", "10.0.0.1/24", "dev", "iface1"],
+        ["ip", "link", "set", "mtu", "1420", "up", "dev", "iface1"],
+        ["ip", "-4", "route", "replace", "10.0.1.2/32", "dev", "iface1"],
+        ["sh", "-c", "sysctl -w net.ipv4.ip_forward=1 && iptables -I FORWARD -i iface1 -j ACCEPT"],
+    ]
+    conf = commands[1].input
+    assert iface.private_key in conf
+    assert peer.public_key in conf
+    assert "Address" not in conf
+    assert "PostUp" not in conf
+
+
+def test_native_up_failed_hook(iface, commands, monkeypatch):
+    monkeypatch.setattr(Interface, "is_up", property(lambda self: False))
+    with pytest.raises(WireguardError):
+        iface.up()
+    assert commands[-1].cmd == ["ip", "link", "delete", "dev", "iface1"]
+
+
+def test_native_down(iface, commands, monkeypatch):
+    monkeypatch.setattr(Interface, "is_down", property(lambda self: False))
+    iface.down(save_traffic=False)
+    assert [command.cmd for command in commands] == [
+        ["ip", "link", "delete", "dev", "iface1"],
+        ["sh", "-c", "iptables -D FORWARD -i iface1 -j ACCEPT"],
+    ]
+
+
+def test_native_without_helper(iface, commands, monkeypatch):
+    monkeypatch.setattr(privileged_helper, "is_available", lambda: False)
+    monkeypatch.setattr(Interface, "is_up", property(lambda self: False))
+    monkeypatch.setattr(Interface, "is_down", property(lambda self: False))
+    with pytest.raises(WireguardError, match="privileged helper"):
+        iface.up()
+    with pytest.raises(WireguardError, match="privileged helper"):
+        iface.down(save_traffic=False)
+    assert commands == []
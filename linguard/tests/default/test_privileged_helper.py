@@ -0,0 +1,127 @@
+import asyncio
+import os
+import shutil
+from tempfile import mkdtemp
+from threading import Thread
+
+import pytest
+
+from linguard.common.utils.privileged import PrivilegedHelper, PrivilegedHelperServer, request, get_socket_owner, \
+    OPERATIONS, privileged_helper
+from linguard.common.utils.system import Command, wait_until
+
+PUBLIC_KEY = "Q2fNqbVNSKZkDs7N6MEe25F0/LiGBITfwNf5sm8nxWI="
+HOOK = "iptables -I FORWARD -i %i -j ACCEPT; echo 1 > /proc/sys/net/ipv4/ip_forward"
+
+
+@pytest.fixture
+def folder():
+    folder = mkdtemp()
+    yield folder
+    shutil.rmtree(folder)
+
+
+@pytest.fixture
+def server(folder):
+    path = os.path.join(folder, "helper.sock")
+    operations = {"echo": (("hello", "world"),), "tr": (("a-z", "A-Z"),), "sleep": (("10.123",),)}
+    server = PrivilegedHelperServer(path, os.getuid(), folder, operations=operations)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_run(server):
+    response = request(server, ["echo", "hello", "world"])
+    assert response["code"] == 0
+    assert response["output"] == "hello world\n"
+    assert oct(os.stat(server).st_mode & 0o777) == oct(0o600)
+
+
+def test_reject_binaries(server):
+    assert "error" in request(server, ["cat", "/etc/shadow"])
+    assert "error" in request(server, ["/nonexistent/echo"])
+    assert "error" in request(server, [])
+
+
+def test_reject_arguments(server):
+    assert "error" in request(server, ["echo", "hello"])
+    assert "error" in request(server, ["echo", "hello", "world", "again"])
+    assert "error" in request(server, ["tr", "-d", "a-z"])
+
+
+def test_operations(folder):
+    server = PrivilegedHelperServer(os.path.join(folder, "helper.sock"), os.getuid(), folder, operations=OPERATIONS)
+    try:
+        conf = os.path.join(folder, "wg0.conf")
+        with open(conf, "w") as f:
+            f.write(f"[Interface]\nPostUp = {HOOK}\n")
+        assert server.is_allowed("wg", ["show", "all", "dump"])
+        assert server.is_allowed("wg-quick", ["up", conf])
+        assert server.is_allowed("ip", ["link", "add", "dev", "wg0", "type", "wireguard"])
+        assert not server.is_allowed("wg-quick", ["up", os.path.join(folder, "wg1.conf")])
+        assert not server.is_allowed("wg-quick", ["up", os.path.join(folder, "..", "wg0.conf")])
+        assert not server.is_allowed("wg-quick", ["up", "/etc/wireguard/wg0.conf"])
+        assert not server.is_allowed("wg", ["set", "lo", "peer", PUBLIC_KEY, "remove"])
+        assert not server.is_allowed("ip", ["link", "delete", "dev", "lo"])
+        assert not server.is_allowed("ip", ["netns", "exec", "ns", "sh"])
+        assert not server.is_allowed("ip", ["link", "add", "dev", "wg0; sh", "type", "wireguard"])
+        assert server.is_allowed("sh", ["-c", HOOK.replace("%i", "wg0")])
+        assert not server.is_allowed("sh", ["-c", HOOK])
+        assert not server.is_allowed("sh", ["-c", "id"])
+        assert not server.is_allowed("iptables", ["-A", "INPUT", "-j", "ACCEPT"])
+    finally:
+        server.server_close()
+
+
+def test_socket_owner(folder):
+    os.chmod(folder, 0o700)
+    assert get_socket_owner(os.path.join(folder, "helper.sock")) == os.stat(folder).st_uid
+    with pytest.raises(PermissionError):
+        get_socket_owner(os.path.join(folder, "other.sock"))
+    os.chmod(folder, 0o755)
+    with pytest.raises(PermissionError):
+        get_socket_owner(os.path.join(folder, "helper.sock"))
+
+
+def test_split():
+    assert PrivilegedHelper.split("/usr/bin/wg show wg0") == ["/usr/bin/wg", "show", "wg0"]
+    assert PrivilegedHelper.split("wg-quick up '/path with spaces/wg0.conf'") == \
+        ["wg-quick", "up", "/path with spaces/wg0.conf"]
+    assert PrivilegedHelper.split("echo key | wg pubkey") is None
+    assert PrivilegedHelper.split("wg show $(id)") is None
+    assert PrivilegedHelper.split("cat /etc/shadow") is None
+
+
+def test_input(server):
+    assert request(server, ["tr", "a-z", "A-Z"], input="secret")["output"] == "SECRET"
+    assert request(server, ["tr", "a-z", "A-Z"])["output"] == ""
+
+
+def is_sleeping() -> bool:
+    for pid in filter(str.isdigit, os.listdir("/proc")):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if f.read().split(b"\0")[1:2] == [b"10.123"]:
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+def test_cancel(server, monkeypatch):
+    monkeypatch.setattr(privileged_helper, "_PrivilegedHelper__folder", os.path.dirname(server))
+    monkeypatch.setattr(privileged_helper, "__ensure_started__", lambda: True)
+    monkeypatch.setattr("linguard.common.utils.privileged.ALLOWED_BINARIES", ("sleep",))
+
+    async def main():
+        task = asyncio.ensure_future(Command(["sleep", "10.123"]).run_async(as_root=True))
+        assert await asyncio.get_running_loop().run_in_executor(None, wait_until, is_sleeping, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # The helper kills the command as soon as nobody waits for it
+    assert wait_until(lambda: not is_sleeping(), 5)
@@ -0,0 +1,53 @@
+from threading import Thread, Event
+from time import sleep
+
+from linguard.common.utils.cache import SnapshotCache
+
+
+class Loader:
+
+    def __init__(self, delay: float = 0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self):
+        self.calls += 1
+        sleep(self.delay)
+        return {"calls": self.calls}
+
+
+def test_reuse_snapshot():
+    loader = Loader()
+    cache = SnapshotCache(loader, 60)
+    assert cache.get() is cache.get()
+    assert loader.calls == 1
+    cache.invalidate()
+    assert cache.get()["calls"] == 2
+
+
+def test_expired_snapshot():
+    loader = Loader()
+    cache = SnapshotCache(loader, 0)
+    cache.get()
+    cache.get()
+    assert loader.calls == 2
+
+
+def test_single_flight():
+    loader = Loader(delay=0.2)
+    cache = SnapshotCache(loader, 60)
+    start = Event()
+    results = []
+
+    def get():
+        start.wait()
+        results.append(cache.get())
+
+    threads = [Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    assert loader.calls == 1
+    assert all(result is results[0] for result in results)
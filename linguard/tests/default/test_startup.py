@@ -0,0 +1,51 @@
+from time import sleep
+
+import pytest
+
+from linguard.core.config.wireguard import WireguardConfig
+from linguard.core.managers.startup import StartupManager
+
+
+def test_run_phases():
+    manager = StartupManager()
+    calls = []
+    manager.run_phase("first", lambda: sleep(0.05))
+    manager.run_phase("second", lambda: calls.append("second"))
+    manager.run_phase("second", lambda: calls.append("second"))
+    assert calls == ["second"]
+    assert list(manager.phases.keys()) == ["first", "second"]
+    assert manager.phases["first"] >= 0.05
+    assert manager.total == sum(manager.phases.values())
+    assert manager.to_dict() == {"total": manager.total, "phases": manager.phases}
+
+
+def test_failed_phase_is_timed():
+    manager = StartupManager()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        manager.run_phase("failing", fail)
+    assert "failing" in manager.phases
+
+
+def test_binaries_are_discovered_once(monkeypatch):
+    found = []
+
+    def find_binary(name):
+        found.append(name)
+        return f"/usr/bin/{name}"
+
+    monkeypatch.setattr(WireguardConfig, "_WireguardConfig__default_binaries", {})
+    monkeypatch.setattr(WireguardConfig, "__find_binary__", staticmethod(find_binary))
+    config = WireguardConfig()
+    assert found == []
+    assert config.wg_bin == "/usr/bin/wg"
+    assert WireguardConfig().wg_bin == "/usr/bin/wg"
+    assert found == ["wg"]
+    WireguardConfig.discover_binaries()
+    assert sorted(found) == ["ip", "iptables", "wg", "wg-quick"]
+    config.wg_bin = "/opt/wg"
+    assert config.wg_bin == "/opt/wg"
+    assert WireguardConfig().wg_bin == "/usr/bin/wg"
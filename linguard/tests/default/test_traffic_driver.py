@@ -1,11 +1,21 @@
 import os
-from datetime import datetime
+import shutil
+from datetime import datetime, timedelta
+from threading import Thread
 from typing import Dict
 
 import pytest
 
+from linguard.core.exceptions import WireguardError
+from linguard.core.models import Interface, Peer, interfaces
+
 from linguard.core.drivers.traffic_storage_driver import TrafficData
+from linguard.core.drivers.traffic_storage_driver_columnar import TrafficStorageDriverColumnar
 from linguard.core.drivers.traffic_storage_driver_json import TrafficStorageDriverJson
+from linguard.core.drivers.traffic_storage_driver_jsonl import TrafficStorageDriverJsonl
+from linguard.core.drivers.traffic_storage_driver_rrd import TrafficStorageDriverRrd
+from linguard.core.drivers.traffic_storage_driver_sqlite import TrafficStorageDriverSqlite
+from linguard.tests.utils import SessionDataMock
 
 
 class TrafficStorageDriverJsonMock(TrafficStorageDriverJson):
@@ -42,13 +52,30 @@ class TrafficStorageDriverJsonMock(TrafficStorageDriverJson):
         }
 
 
+class TrafficStorageDriverJsonlMock(SessionDataMock, TrafficStorageDriverJsonl):
+    pass
+
+
+class TrafficStorageDriverSqliteMock(SessionDataMock, TrafficStorageDriverSqlite):
+    pass
+
+
+class TrafficStorageDriverRrdMock(SessionDataMock, TrafficStorageDriverRrd):
+    pass
+
+
+class TrafficStorageDriverColumnarMock(SessionDataMock, TrafficStorageDriverColumnar):
+    pass
+
+
 class TestJsonTrafficDriver:
 
     @pytest.fixture(autouse=True)
     def cleanup(self):
         yield
-        if self.driver and os.path.exists(self.driver.filepath):
-            os.remove(self.driver.filepath)
+        for path in [self.driver.filepath, self.driver.totals_filepath]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_load_no_data(self):
         self.driver = TrafficStorageDriverJson()
@@ -72,6 +99,49 @@ class TestJsonTrafficDriver:
         data = self.driver.get_session_and_stored_data()
         assert data is not None
         assert len(data) > 0
+        # Reading never rewrites the file
+        version, _ = self.driver.read_samples(self.driver.filepath, self.driver.timestamp_format)
+        assert version == 1
+        self.driver.save_data()
+        version, samples = self.driver.read_samples(self.driver.filepath, self.driver.timestamp_format)
+        assert version == TrafficStorageDriverJson.VERSION
+        assert len(samples) > 0
+
+    def test_upgrade_interfaces_data(self):
+        self.driver = TrafficStorageDriverJson()
+        iface = Interface(name="iface1", description="", gw_iface="eth0", ipv4_address="10.0.0.1/24",
+                          listen_port=50000, auto=False, on_up=[], on_down=[], private_key="private",
+                          public_key="public")
+        peer = Peer(name="peer1", description="", ipv4_address="10.0.0.2/24", nat=False, interface=iface,
+                    dns1="8.8.8.8", private_key="private", public_key="public")
+        iface.add_peer(peer)
+        interfaces[iface.uuid] = iface
+        try:
+            with open(self.driver.filepath, "w") as f:
+                f.write(f'{{"15/09/2021 15:24:34": {{"{peer.uuid}": {{"rx": 1, "tx": 2}}}}}}')
+            data = self.driver.query(devices=[iface.uuid])
+            self.driver.save_data()
+        finally:
+            interfaces.clear()
+        assert len(data) == 1
+        iface_data = list(data.values())[0][iface.uuid]
+        assert iface_data.rx == 2
+        assert iface_data.tx == 1
+        # Interfaces' data must have been persisted when saving
+        data = self.driver.query(devices=[iface.uuid])
+        assert len(data) == 1
+
+    def test_query(self):
+        self.driver = TrafficStorageDriverJsonMock()
+        self.driver.save_data()
+        start = datetime.strptime("15/09/2021 18:00:00", self.driver.timestamp_format)
+        end = datetime.strptime("15/09/2021 22:00:00", self.driver.timestamp_format)
+        data = self.driver.query(devices=["39a855187c4c4ca694d8c3f215e76cdd"], start=start, end=end)
+        assert len(data) == 4
+        for sample in data.values():
+            assert list(sample.keys()) == ["39a855187c4c4ca694d8c3f215e76cdd"]
+        data = self.driver.query(step=timedelta(days=365))
+        assert len(data) == 1
 
     def test_store_data(self):
         self.driver = TrafficStorageDriverJsonMock()
@@ -79,3 +149,302 @@ class TestJsonTrafficDriver:
         data = self.driver.load_data()
         assert data is not None
         assert len(data) > 0
+
+    def test_totals(self):
+        self.driver = TrafficStorageDriverJsonMock()
+        self.driver.save_data()
+        assert os.path.exists(self.driver.totals_filepath)
+        assert set(self.driver.load_totals().keys()) == {"39a855187c4c4ca694d8c3f215e76cdd",
+                                                         "39a855187c4c4ca694d8c3f215e76cde"}
+        # Totals are rebuilt from the samples if they are missing
+        os.remove(self.driver.totals_filepath)
+        self.driver = TrafficStorageDriverJson()
+        assert len(self.driver.load_totals()) == 2
+        assert os.path.exists(self.driver.totals_filepath)
+
+
+class TestJsonlTrafficDriver:
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        for path in [self.driver.filepath, self.driver.totals_filepath, self.driver.legacy_filepath]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_load_no_data(self):
+        self.driver = TrafficStorageDriverJsonl()
+        data = self.driver.get_session_and_stored_data()
+        assert data is not None
+        assert len(data) == 0
+
+    def test_store_data(self):
+        self.driver = TrafficStorageDriverJsonlMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        with open(self.driver.filepath, "r") as f:
+            assert len(f.readlines()) == 2
+        data = self.driver.load_data()
+        assert len(data) > 0
+        last = list(data.values())[-1]
+        assert last["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert last["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_query(self):
+        self.driver = TrafficStorageDriverJsonlMock()
+        self.driver.save_data()
+        data = self.driver.query(devices=["39a855187c4c4ca694d8c3f215e76cdd"])
+        assert len(data) == 1
+        assert list(list(data.values())[0].keys()) == ["39a855187c4c4ca694d8c3f215e76cdd"]
+        assert len(self.driver.query(start=datetime.now() + timedelta(days=1))) == 0
+
+    def test_totals(self):
+        self.driver = TrafficStorageDriverJsonlMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        totals = self.driver.get_session_and_stored_totals(["39a855187c4c4ca694d8c3f215e76cde"])
+        assert list(totals.keys()) == ["39a855187c4c4ca694d8c3f215e76cde"]
+        assert totals["39a855187c4c4ca694d8c3f215e76cde"].rx == 90
+        # Totals are outdated if samples are appended by someone else
+        with open(self.driver.filepath, "a") as f:
+            f.write('{"timestamp": 1631712274, "data": {"39a855187c4c4ca694d8c3f215e76cdd": {"rx": 1, "tx": 2}}}\n')
+        os.utime(self.driver.totals_filepath, (0, 0))
+        assert self.driver.load_totals()["39a855187c4c4ca694d8c3f215e76cdd"].rx == 1
+
+    def test_concurrent_saves(self):
+        self.driver = TrafficStorageDriverJsonlMock()
+        threads = [Thread(target=self.driver.save_data) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(self.driver.load_data()) > 0
+        assert self.driver.load_totals()["39a855187c4c4ca694d8c3f215e76cde"].rx == 8 * 30
+
+    def test_skip_malformed_record(self):
+        self.driver = TrafficStorageDriverJsonlMock()
+        self.driver.save_data()
+        with open(self.driver.filepath, "a") as f:
+            f.write('{"timestamp": 16317')
+        data = self.driver.load_data()
+        assert len(data) == 1
+
+    def test_migrate(self):
+        self.driver = TrafficStorageDriverJsonl()
+        with open(self.driver.legacy_filepath, "w") as f:
+            f.write("""
+            {"15/09/2021 15:24:34": {"39a855187c4c4ca694d8c3f215e76cdd": {"rx": 1, "tx": 2}}, "15/09/2021 15:25:02": {"39a855187c4c4ca694d8c3f215e76cdd": {"rx": 3, "tx": 4}}}
+            """)
+        data = self.driver.load_data()
+        assert os.path.exists(self.driver.filepath)
+        assert len(data) == 2
+        timestamp = datetime.strptime("15/09/2021 15:25:02", self.driver.timestamp_format)
+        assert data[timestamp]["39a855187c4c4ca694d8c3f215e76cdd"].tx == 4
+
+
+class TestSqliteTrafficDriver:
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        self.driver.close()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.driver.filepath + suffix):
+                os.remove(self.driver.filepath + suffix)
+
+    def test_load_no_data(self):
+        self.driver = TrafficStorageDriverSqlite()
+        data = self.driver.get_session_and_stored_data()
+        assert data is not None
+        assert len(data) == 0
+
+    def test_store_data(self):
+        self.driver = TrafficStorageDriverSqliteMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        data = self.driver.load_data()
+        assert len(data) > 0
+        last = list(data.values())[-1]
+        assert last["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert last["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_query(self):
+        self.driver = TrafficStorageDriverSqliteMock()
+        self.driver.save_data()
+        data = self.driver.query(devices=["39a855187c4c4ca694d8c3f215e76cde"])
+        assert len(data) == 1
+        sample = list(data.values())[0]
+        assert "39a855187c4c4ca694d8c3f215e76cdd" not in sample
+        assert sample["39a855187c4c4ca694d8c3f215e76cde"].rx == 30
+        assert len(self.driver.query(devices=["unknown"])) == 0
+        assert len(self.driver.query(end=datetime.now() - timedelta(days=1))) == 0
+        assert len(self.driver.query(step=timedelta(hours=1))) == 1
+
+    def test_query_arrays(self):
+        self.driver = TrafficStorageDriverSqliteMock()
+        self.driver.save_data()
+        arrays = self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cde")
+        assert len(arrays) == 1
+        assert list(arrays.rx) == [30]
+        assert list(arrays.tx) == [40]
+        assert len(self.driver.query_arrays("unknown")) == 0
+
+    def test_totals(self):
+        self.driver = TrafficStorageDriverSqliteMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        totals = self.driver.load_totals()
+        assert totals["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert totals["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+        assert self.driver.get_session_and_stored_totals()["39a855187c4c4ca694d8c3f215e76cde"].tx == 120
+
+
+class TestRrdTrafficDriver:
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        if os.path.exists(self.driver.filepath):
+            os.remove(self.driver.filepath)
+
+    def test_load_no_data(self):
+        self.driver = TrafficStorageDriverRrd()
+        data = self.driver.get_session_and_stored_data()
+        assert data is not None
+        assert len(data) == 0
+
+    def test_store_data(self):
+        self.driver = TrafficStorageDriverRrdMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        data = self.driver.load_data()
+        assert len(data) == 1
+        last = list(data.values())[-1]
+        assert last["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert last["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_totals(self):
+        self.driver = TrafficStorageDriverRrdMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        totals = self.driver.load_totals()
+        assert totals["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert totals["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_consolidation(self):
+        self.driver = TrafficStorageDriverRrd.__from_yaml_dict__({"tiers": [{"step": 10, "rows": 3},
+                                                                            {"step": 100, "rows": 2}]})
+        series = [{}, {}]
+        for timestamp in range(1000, 1300, 5):
+            self.driver.__insert__(series, "device", [timestamp, timestamp, timestamp])
+        assert [point[0] for point in series[0]["device"]] == [1275, 1285, 1295]
+        assert [point[0] for point in series[1]["device"]] == [1195, 1295]
+        merged = self.driver.__merge_tiers__([series[0]["device"], series[1]["device"]])
+        assert [point[0] for point in merged] == [1195, 1275, 1285, 1295]
+
+    def test_invalid_tiers(self):
+        self.driver = TrafficStorageDriverRrd()
+        with pytest.raises(WireguardError):
+            TrafficStorageDriverRrd.__from_yaml_dict__({"tiers": [{"step": 3600, "rows": 24},
+                                                                  {"step": 300, "rows": 12}]})
+        with pytest.raises(WireguardError):
+            TrafficStorageDriverRrd.__from_yaml_dict__({"tiers": [{"step": 0, "rows": 24}]})
+
+    def test_change_tiers(self):
+        self.driver = TrafficStorageDriverRrdMock()
+        self.driver.save_data()
+        self.driver = TrafficStorageDriverRrdMock(tiers=[TrafficStorageDriverRrd.DEFAULT_TIERS[-1]])
+        data = self.driver.load_data()
+        assert len(data) == 1
+
+
+class TestColumnarTrafficDriver:
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        if os.path.exists(self.driver.filepath):
+            shutil.rmtree(self.driver.filepath)
+
+    def test_load_no_data(self):
+        self.driver = TrafficStorageDriverColumnar()
+        data = self.driver.get_session_and_stored_data()
+        assert data is not None
+        assert len(data) == 0
+        assert len(self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cdd")) == 0
+
+    def test_store_data(self):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        data = self.driver.load_data()
+        assert len(data) > 0
+        last = list(data.values())[-1]
+        assert last["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert last["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_query_arrays(self):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        arrays = self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cde")
+        assert len(arrays) == 2
+        assert arrays.rx.tolist() == [30, 60]
+        assert arrays.tx.tolist() == [40, 80]
+        assert len(self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cde",
+                                            start=datetime.now() + timedelta(days=1))) == 0
+
+    def test_totals(self):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        self.driver.save_data()
+        totals = self.driver.load_totals()
+        assert totals["39a855187c4c4ca694d8c3f215e76cdd"].rx == 20
+        assert totals["39a855187c4c4ca694d8c3f215e76cde"].tx == 80
+
+    def test_interrupted_write(self):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        with open(os.path.join(self.driver.filepath, "rx.bin"), "ab") as f:
+            f.write(b"\x01\x02\x03")
+        assert len(self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cdd")) == 1
+        self.driver.save_data()
+        arrays = self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cdd")
+        assert arrays.rx.tolist() == [10, 20]
+
+    def test_interrupted_widen(self, monkeypatch):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        devices = {f"device{i}": TrafficData(i, 2 * i) for i in range(20)}
+        monkeypatch.setattr(self.driver, "get_session_data", lambda: dict(devices))
+        widen = self.driver.__widen__
+
+        def crash(column, *args):
+            if column == "tx":
+                raise OSError("Simulated crash")
+            widen(column, *args)
+
+        monkeypatch.setattr(self.driver, "__widen__", crash)
+        with pytest.raises(OSError):
+            self.driver.save_data()
+        assert self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cdd").rx.tolist() == [10]
+        monkeypatch.setattr(self.driver, "__widen__", widen)
+        self.driver.save_data()
+        assert self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cdd").rx.tolist() == [10, 10]
+        assert self.driver.query_arrays("device19").tx.tolist() == [38]
+
+    def test_many_devices(self, monkeypatch):
+        self.driver = TrafficStorageDriverColumnarMock()
+        self.driver.save_data()
+        devices = {f"device{i}": TrafficData(i, 2 * i) for i in range(100)}
+        monkeypatch.setattr(self.driver, "get_session_data", lambda: dict(devices))
+        fds = len(os.listdir("/proc/self/fd"))
+        for _ in range(3):
+            self.driver.save_data()
+        assert len(os.listdir("/proc/self/fd")) <= fds + len(TrafficStorageDriverColumnar.COLUMNS)
+        assert self.driver.query_arrays("device99").rx.tolist() == [99, 198, 297]
+        # Devices which were not part of the last sessions keep their totals
+        assert self.driver.query_arrays("39a855187c4c4ca694d8c3f215e76cde").rx.tolist() == [30, 30, 30, 30]
+        totals = self.driver.load_totals()
+        assert len(totals) == 102
+        assert totals["device10"].tx == 60
@@ -0,0 +1,91 @@
+import pytest
+
+from linguard.core.config.wireguard import WireguardConfig
+from linguard.core.models import Interface, interfaces
+from linguard.tests.utils import default_cleanup, create_test_iface
+
+
+class Status:
+
+    @staticmethod
+    def is_up(name: str) -> bool:
+        return True
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    default_cleanup()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr("linguard.core.config.wireguard.get_interfaces_status", lambda: Status())
+    monkeypatch.setattr(Interface, "down", lambda self: calls.append(("down", self.name, self.conf_file)))
+    monkeypatch.setattr(Interface, "up", lambda self: calls.append(("up", self.name, self.conf_file)))
+    yield calls
+
+
+def test_apply_changes_only(calls):
+    iface1 = create_test_iface("iface1", "10.0.0.1/24", 50000)
+    iface2 = create_test_iface("iface2", "10.0.1.1/24", 50001)
+    interfaces[iface1.uuid] = iface1
+    interfaces[iface2.uuid] = iface2
+    config = WireguardConfig()
+    config.apply()
+    assert calls == []
+
+    config.endpoint = "vpn.example.com"
+    config.apply()
+    assert calls == []
+
+    old_conf_file = iface1.conf_file
+    iface1.edit(name="iface3", description="", ipv4_address=iface1.ipv4_address, port=50002,
+                gw_iface=iface1.gw_iface, auto=False, on_up=iface1.on_up, on_down=iface1.on_down)
+    config.apply()
+    assert calls == [("down", "iface1", old_conf_file), ("up", "iface3", iface1.conf_file)]
+
+    calls.clear()
+    config.wg_quick_bin = "/opt/bin/wg-quick"
+    config.apply()
+    assert sorted(call[:2] for call in calls) == [("down", "iface2"), ("down", "iface3"),
+                                                    ("up", "iface2"), ("up", "iface3")]
+
+
+def test_apply_first_change(calls, monkeypatch):
+    monkeypatch.setattr(Interface, "save", lambda self: None)
+    config = WireguardConfig()
+    iface = create_test_iface("iface1", "10.0.0.1/24", 50000)
+    interfaces[iface.uuid] = iface
+    # Interfaces added since the configuration files were saved are only recorded
+    config.apply()
+    assert calls == []
+
+    config = WireguardConfig()
+    config.save_interfaces()
+    iface.edit(name=iface.name, description="", ipv4_address="10.0.2.1/24", port=iface.listen_port,
+               gw_iface=iface.gw_iface, auto=False, on_up=iface.on_up, on_down=iface.on_down)
+    # The settings the configuration file was saved with are the ones the interface is running with
+    config.apply()
+    assert calls == [("down", "iface1", iface.conf_file), ("up", "iface1", iface.conf_file)]
+
+
+def test_revalidate_binaries(monkeypatch, tmp_path):
+    binary = tmp_path / "wg"
+    binary.write_text("#!/bin/sh\n")
+    binary.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path))
+    monkeypatch.setattr("linguard.core.config.wireguard.SBIN_FOLDERS", ())
+    monkeypatch.setattr(WireguardConfig, "_WireguardConfig__default_binaries", {})
+    assert WireguardConfig().wg_bin == str(binary)
+    assert WireguardConfig().wg_quick_bin == ""
+
+    moved = tmp_path / "bin"
+    moved.mkdir()
+    binary.rename(moved / "wg")
+    monkeypatch.setenv("PATH", str(moved))
+    # Cached until explicitly revalidated
+    assert WireguardConfig().wg_bin == str(binary)
+    WireguardConfig.revalidate_binaries()
+    assert WireguardConfig().wg_bin == str(moved / "wg")
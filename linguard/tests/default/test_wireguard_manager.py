@@ -0,0 +1,31 @@
+from time import sleep, monotonic
+
+import pytest
+
+from linguard.core.exceptions import WireguardError
+from linguard.core.managers.wireguard import wireguard_manager
+from linguard.core.models import Interface
+from linguard.tests.utils import default_cleanup, create_test_iface
+
+
+@pytest.fixture(autouse=True)
+def cleanup():
+    yield
+    default_cleanup()
+
+
+def up(self):
+    sleep(0.3)
+    if self.name == "iface2":
+        raise WireguardError("unable to start")
+
+
+def test_start(monkeypatch):
+    ifaces = [create_test_iface(f"iface{i}", f"10.0.{i}.1/24", 50000 + i) for i in range(4)]
+    monkeypatch.setattr(Interface, "up", up)
+    start = monotonic()
+    errors = wireguard_manager.start(ifaces)
+    assert monotonic() - start < 1.2
+    assert list(errors.keys()) == ["iface2"]
+    assert errors["iface2"].cause == "unable to start"
+    assert wireguard_manager.start([]) == {}
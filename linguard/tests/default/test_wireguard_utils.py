@@ -0,0 +1,77 @@
+import base64
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from linguard.core.exceptions import WireguardError
+from linguard.core.utils.wireguard import parse_wg_dump, WireguardInterfaceStats, WireguardPeerStats, \
+    generate_privkey, generate_pubkey, get_interfaces_status, invalidate_interfaces_status
+
+DUMP = [
+    "wg0\tprivate0=\tpublic0=\t51820\toff",
+    "wg0\tpeer0=\t(none)\t203.0.113.5:51820\t10.0.0.2/32,fd00::2/128\t1631712274\t1024\t2048\t25",
+    "wg0\tpeer1=\tpsk1=\t(none)\t(none)\t0\t0\t0\toff",
+    "wg1\tprivate1=\t(none)\t0\t0xca6c",
+    "",
+]
+
+
+def test_parse_dump():
+    records = list(parse_wg_dump(DUMP))
+    assert [type(record) for record in records] == [WireguardInterfaceStats, WireguardPeerStats,
+                                                    WireguardPeerStats, WireguardInterfaceStats]
+    wg0, peer0, peer1, wg1 = records
+    assert wg0.name == "wg0"
+    assert wg0.public_key == "public0="
+    assert wg0.listen_port == 51820
+    assert wg0.fwmark is None
+    assert not hasattr(wg0, "private_key")
+    assert peer0.interface == "wg0"
+    assert peer0.endpoint == "203.0.113.5:51820"
+    assert peer0.allowed_ips == ["10.0.0.2/32", "fd00::2/128"]
+    assert peer0.latest_handshake == datetime.fromtimestamp(1631712274)
+    assert peer0.transfer_rx == 1024
+    assert peer0.transfer_tx == 2048
+    assert peer0.persistent_keepalive == 25
+    assert peer1.preshared_key == "psk1="
+    assert peer1.endpoint is None
+    assert peer1.allowed_ips == []
+    assert peer1.latest_handshake is None
+    assert peer1.persistent_keepalive is None
+    assert wg1.public_key is None
+    assert wg1.listen_port is None
+    assert wg1.fwmark == 0xca6c
+
+
+def test_skip_unexpected_lines():
+    records = list(parse_wg_dump(["unexpected\tline", DUMP[0]]))
+    assert len(records) == 1
+    assert records[0].name == "wg0"
+
+
+def test_generate_keys():
+    # RFC 7748, section 6.1
+    privkey = base64.b64encode(bytes.fromhex("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a"))
+    pubkey = base64.b64encode(bytes.fromhex("8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a"))
+    assert generate_pubkey(privkey.decode()) == pubkey.decode()
+    key = base64.b64decode(generate_privkey())
+    assert len(key) == 32
+    assert key[0] & 7 == 0
+    assert key[31] & 192 == 64
+    with pytest.raises(WireguardError):
+        generate_pubkey("not a key")
+
+
+def test_interfaces_status():
+    status = get_interfaces_status()
+    assert status.is_up("lo")
+    assert not status.is_up("nonexistent0")
+    assert status.get_status("nonexistent0") == "down"
+    # Outside of a request, the status is gathered every time
+    assert get_interfaces_status() is not status
+    with Flask(__name__).test_request_context():
+        status = get_interfaces_status()
+        assert get_interfaces_status() is status
+        invalidate_interfaces_status()
+        assert get_interfaces_status() is not status
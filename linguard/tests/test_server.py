@@ -8,7 +8,6 @@ from flask_login import current_user
 
 from linguard.common.models.user import users, User
 from linguard.common.properties import global_properties
-from linguard.common.utils.system import try_makedir
 from linguard.core.config.web import config as web_config
 from linguard.core.managers.config import config_manager
 from linguard.core.managers.wireguard import wireguard_manager
@@ -70,23 +69,21 @@ def test_login_ko(client):
     assert not current_user.is_authenticated
 
 
-def test_default_server():
+def test_default_server(monkeypatch, tmp_path):
     """Test with not existent configuration file, so that the app loads all default values."""
-    workdir = join(dirname(__file__), "data")
-    try_makedir(workdir)
-    global_properties.workdir = workdir
+    workdir = str(tmp_path)
+    monkeypatch.setattr(global_properties, "workdir", workdir)
     config_manager.load()
     wireguard_manager.start()
     sleep(1)
     wireguard_manager.stop()
 
 
-def test_sample_server():
-    workdir = join(dirname(__file__), "data")
-    try_makedir(workdir)
+def test_sample_server(monkeypatch, tmp_path):
+    workdir = str(tmp_path)
+    monkeypatch.setattr(global_properties, "workdir", workdir)
     sample_file = join(dirname(dirname(dirname(__file__))), "config", "linguard.sample.yaml")
     shutil.copy(sample_file, workdir)
-    global_properties.workdir = workdir
     config_manager.load()
     wireguard_manager.start()
     sleep(1)
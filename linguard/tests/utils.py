@@ -2,12 +2,15 @@ import http
 import os
 import shutil
 import sys
+from tempfile import mkdtemp
+from typing import Dict
 
 from flask_login import current_user
 
 from linguard.common.models.user import users, User
 from linguard.common.properties import global_properties
 from linguard.common.utils.network import get_system_interfaces
+from linguard.core.drivers.traffic_storage_driver import TrafficData
 from linguard.core.managers.cron import cron_manager
 from linguard.core.models import interfaces, Interface
 from linguard.web.client import clients
@@ -67,7 +70,8 @@ def login(client):
 
 
 def get_testing_app():
-    workdir = "data"
+    # Anything written to the working directory (i.e. traffic data saved at exit) must not end up in the tree
+    workdir = mkdtemp(prefix="linguard-tests-")
     sys.argv = [sys.argv[0], workdir]
     global_properties.setup_required = False
     global_properties.dev_env = True
@@ -91,4 +95,13 @@ def create_test_iface(name, ipv4, port):
         f"{config.iptables_bin} -t nat -D POSTROUTING -o {gw} -j MASQUERADE\n"
     ]
     return Interface(name=name, description="", gw_iface=gw, ipv4_address=ipv4, listen_port=port, auto=False,
-                     on_up=on_up, on_down=on_down)
\ No newline at end of file
+                     on_up=on_up, on_down=on_down)
+
+
+class SessionDataMock:
+    """Mixin for traffic storage drivers which makes them see the same session data of two devices."""
+
+    @staticmethod
+    def get_session_data() -> Dict[str, TrafficData]:
+        return {"39a855187c4c4ca694d8c3f215e76cdd": TrafficData(10, 20),
+                "39a855187c4c4ca694d8c3f215e76cde": TrafficData(30, 40)}
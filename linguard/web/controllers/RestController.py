@@ -33,11 +33,14 @@ class RestController:
                    gw_iface=form.gateway.data, ipv4_address=form.ipv4.data, port=form.port.data,
                    auto=form.auto.data, on_up=str_to_list(form.on_up.data),
                    on_down=str_to_list(form.on_down.data))
-        config_manager.save()
+        config_manager.save_interface(iface)
 
     def apply_iface(self, iface: Interface, form):
-        self.__save_iface__(iface, form)
-        iface.apply()
+        with config_manager.batch():
+            # Saving restarts the interface if it is running and any of its settings changed
+            self.__save_iface__(iface, form)
+            if iface.is_down:
+                iface.up()
 
     @staticmethod
     def add_iface(form):
@@ -48,12 +51,13 @@ class RestController:
                           on_down=on_down)
         interfaces[iface.uuid] = iface
         interfaces.sort()
-        config_manager.save()
+        config_manager.save_interface(iface)
 
     def remove_iface(self) -> Response:
         try:
-            interfaces[self.uuid].remove()
-            config_manager.save()
+            iface = interfaces[self.uuid]
+            iface.remove()
+            config_manager.remove_interface(iface)
             return Response(status=NO_CONTENT)
         except WireguardError as e:
             log_exception(e)
@@ -68,15 +72,19 @@ class RestController:
         peer = Peer(name=form.name.data, description=form.description.data,
                     interface=iface, ipv4_address=form.ipv4.data,
                     dns1=form.dns1.data, dns2=form.dns2.data, nat=form.nat.data)
-        iface.add_peer(peer)
-        config_manager.save()
+        try:
+            iface.add_peer(peer)
+        finally:
+            config_manager.save_peer(peer)
         return peer
 
     @staticmethod
     def remove_peer(peer: Peer) -> Response:
         try:
-            peer.remove()
-            config_manager.save()
+            try:
+                peer.remove()
+            finally:
+                config_manager.remove_peer(peer)
             return Response(status=NO_CONTENT)
         except Exception as e:
             log_exception(e)
@@ -85,9 +93,11 @@ class RestController:
     @staticmethod
     def save_peer(peer: Peer, form):
         iface = interfaces.get_value_by_attr("name", form.interface.data)
-        peer.edit(name=form.name.data, description=form.description.data, interface=iface,
-                  ipv4_address=form.ipv4.data, nat=form.nat.data, dns1=form.dns1.data, dns2=form.dns2.data)
-        config_manager.save()
+        try:
+            peer.edit(name=form.name.data, description=form.description.data, interface=iface,
+                      ipv4_address=form.ipv4.data, nat=form.nat.data, dns1=form.dns1.data, dns2=form.dns2.data)
+        finally:
+            config_manager.save_peer(peer)
 
     def download_peer(self, peer: Peer) -> Response:
         try:
@@ -118,47 +128,54 @@ class RestController:
 
     @staticmethod
     def save_settings(form):
-        sample_logger = LoggerConfig()
+        # Settings are written as soon as they are all set
+        with config_manager.batch():
+            sample_logger = LoggerConfig()
 
-        logger_config.overwrite = form.log_overwrite.data
-        logger_config.level = form.log_level.data or sample_logger.level
+            logger_config.overwrite = form.log_overwrite.data
+            logger_config.level = form.log_level.data or sample_logger.level
 
-        sample_web = WebConfig()
+            sample_web = WebConfig()
 
-        web_config.login_attempts = form.web_login_attempts.data or sample_web.login_attempts
-        web_config.login_ban_time = form.web_login_ban_time.data or sample_web.login_ban_time
+            web_config.login_attempts = form.web_login_attempts.data or sample_web.login_attempts
+            web_config.login_ban_time = form.web_login_ban_time.data or sample_web.login_ban_time
 
-        web_config.secret_key = form.web_secret_key.data or sample_web.secret_key
+            web_config.secret_key = form.web_secret_key.data or sample_web.secret_key
 
-        sample_wireguard = WireguardConfig()
+            # The default binaries may have been installed or moved since they were looked for
+            WireguardConfig.revalidate_binaries()
+            sample_wireguard = WireguardConfig()
 
-        wireguard_config.endpoint = form.app_endpoint.data or sample_wireguard.endpoint
-        wireguard_config.wg_bin = form.app_wg_bin.data or sample_wireguard.wg_bin
-        wireguard_config.wg_quick_bin = form.app_wg_quick_bin.data or sample_wireguard.wg_quick_bin
-        wireguard_config.iptables_bin = form.app_iptables_bin.data or sample_wireguard.iptables_bin
+            wireguard_config.endpoint = form.app_endpoint.data or sample_wireguard.endpoint
+            wireguard_config.wg_bin = form.app_wg_bin.data or sample_wireguard.wg_bin
+            wireguard_config.wg_quick_bin = form.app_wg_quick_bin.data or sample_wireguard.wg_quick_bin
+            wireguard_config.iptables_bin = form.app_iptables_bin.data or sample_wireguard.iptables_bin
 
-        traffic_config.enabled = form.traffic_enabled.data
-        driver_name = form.traffic_driver.data
-        driver = traffic_storage.registered_drivers[driver_name]
-        options = json.loads(form.traffic_driver_options.data.replace("\'", "\""))
-        traffic_config.driver = driver.__from_yaml_dict__(options)
+            traffic_config.enabled = form.traffic_enabled.data
+            driver_name = form.traffic_driver.data
+            driver = traffic_storage.registered_drivers[driver_name]
+            options = json.loads(form.traffic_driver_options.data.replace("\'", "\""))
+            traffic_config.driver = driver.__from_yaml_dict__(options)
 
-        config_manager.save()
+            config_manager.save()
 
     @staticmethod
     def apply_setup(form):
-        logger_config.overwrite = form.log_overwrite.data
+        with config_manager.batch():
+            logger_config.overwrite = form.log_overwrite.data
 
-        sample_wireguard = WireguardConfig()
+            # The default binaries may have been installed or moved since they were looked for
+            WireguardConfig.revalidate_binaries()
+            sample_wireguard = WireguardConfig()
 
-        wireguard_config.endpoint = form.app_endpoint.data or sample_wireguard.endpoint
-        wireguard_config.wg_bin = form.app_wg_bin.data or sample_wireguard.wg_bin
-        wireguard_config.wg_quick_bin = form.app_wg_quick_bin.data or sample_wireguard.wg_quick_bin
-        wireguard_config.iptables_bin = form.app_iptables_bin.data or sample_wireguard.iptables_bin
+            wireguard_config.endpoint = form.app_endpoint.data or sample_wireguard.endpoint
+            wireguard_config.wg_bin = form.app_wg_bin.data or sample_wireguard.wg_bin
+            wireguard_config.wg_quick_bin = form.app_wg_quick_bin.data or sample_wireguard.wg_quick_bin
+            wireguard_config.iptables_bin = form.app_iptables_bin.data or sample_wireguard.iptables_bin
 
-        traffic_config.enabled = form.traffic_enabled.data
+            traffic_config.enabled = form.traffic_enabled.data
 
-        config_manager.save()
+            config_manager.save()
 
     @staticmethod
     def signup(form):
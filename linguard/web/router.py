@@ -8,7 +8,7 @@ from time import sleep
 from typing import List, Dict, Any, Union
 from urllib.parse import parse_qs, urlparse
 
-from flask import Blueprint, abort, request, Response, redirect, url_for
+from flask import Blueprint, abort, request, Response, redirect, url_for, jsonify
 from flask_login import current_user, login_required, login_user
 
 from linguard.common.models.user import users
@@ -24,8 +24,10 @@ from linguard.core.config.wireguard import config as wireguard_config
 from linguard.core.drivers.traffic_storage_driver import TrafficData
 from linguard.core.exceptions import WireguardError
 from linguard.core.managers.config import config_manager
+from linguard.core.managers.startup import startup_manager
+from linguard.core.managers.wireguard import wireguard_manager
 from linguard.core.models import interfaces, Interface, get_all_peers, Peer
-from linguard.core.utils.wireguard import is_wg_iface_up
+from linguard.core.utils.wireguard import get_wg_interfaces_status
 from linguard.web.client import clients, Client
 from linguard.web.controllers.RestController import RestController
 from linguard.web.controllers.ViewController import ViewController
@@ -49,8 +51,6 @@ class Router(Blueprint):
 
 router = Router("router", __name__)
 
-config_manager.load()
-
 
 def setup_required(f):
     @wraps(f)
@@ -68,9 +68,10 @@ def setup_required(f):
 @setup_required
 def index():
     if traffic_config.enabled:
-        traffic = traffic_config.driver.get_session_and_stored_data()
+        devices = list(interfaces.keys()) + list(get_all_peers().keys())
+        traffic = traffic_config.driver.get_session_and_stored_totals(devices)
     else:
-        traffic = {datetime.now(): traffic_config.driver.get_session_data()}
+        traffic = traffic_config.driver.get_session_data()
     iface_names = []
     ifaces_traffic = [
         {"label": "Received", "data": []},
@@ -83,12 +84,12 @@ def index():
     ]
     for iface in interfaces.values():
         iface_names.append(iface.name)
-        iface_traffic = __get_total_traffic__(iface.uuid, traffic)
+        iface_traffic = traffic.get(iface.uuid, TrafficData(0, 0))
         ifaces_traffic[0]["data"].append(iface_traffic.rx)
         ifaces_traffic[1]["data"].append(iface_traffic.tx)
         for peer in iface.peers.values():
             peer_names.append(peer.name)
-            peer_traffic = __get_total_traffic__(peer.uuid, traffic)
+            peer_traffic = traffic.get(peer.uuid, TrafficData(0, 0))
             peers_traffic[0]["data"].append(peer_traffic.rx)
             peers_traffic[1]["data"].append(peer_traffic.tx)
 
@@ -104,18 +105,6 @@ def index():
     return ViewController("web/index.html", **context).load()
 
 
-def __get_total_traffic__(uuid: str, traffic: Dict[datetime, Dict[str, TrafficData]]) -> TrafficData:
-    rx = 0
-    tx = 0
-    for data in reversed(list(traffic.values())):
-        # Get only last appearance
-        if uuid in data:
-            rx += data[uuid].rx
-            tx += data[uuid].tx
-            break
-    return TrafficData(rx, tx)
-
-
 @router.route("/logout")
 @login_required
 @setup_required
@@ -223,6 +212,9 @@ def network():
 
 def get_network_ifaces(wg_interfaces: List[Interface]) -> Dict[str, Dict[str, Any]]:
     interfaces = get_system_interfaces_summary()
+    unknown = [iface.name for iface in wg_interfaces
+               if iface.name in interfaces and interfaces[iface.name]["status"] == "unknown"]
+    wg_status = get_wg_interfaces_status(unknown)
     for iface in wg_interfaces:
         if iface.name not in interfaces:
             interfaces[iface.name] = {
@@ -238,10 +230,7 @@ def get_network_ifaces(wg_interfaces: List[Interface]) -> Dict[str, Dict[str, An
             if iface in wg_interfaces:
                 interfaces[iface.name]["uuid"] = iface.uuid
             if interfaces[iface.name]["status"] == "unknown":
-                if is_wg_iface_up(iface.name):
-                    interfaces[iface.name]["status"] = "up"
-                else:
-                    interfaces[iface.name]["status"] = "down"
+                interfaces[iface.name]["status"] = wg_status[iface.name]
         interfaces[iface.name]["editable"] = True
 
     return interfaces
@@ -332,16 +321,10 @@ def add_wireguard_iface():
 
 
 def load_traffic_data(item: Union[Peer, Interface]):
-    labels = []
-    datasets = {"rx": [], "tx": []}
-    for timestamp, traffic_data in traffic_config.driver.load_data().items():
-        labels.append(str(timestamp))
-        for device, data in traffic_data.items():
-            if device == item.uuid:
-                datasets["rx"].append(data.rx)
-                datasets["tx"].append(data.tx)
-                break
-    return {"labels": labels, "datasets": datasets}
+    driver = traffic_config.driver
+    arrays = driver.query_arrays(item.uuid)
+    labels = [datetime.fromtimestamp(timestamp).strftime(driver.timestamp_format) for timestamp in arrays.timestamps]
+    return {"labels": labels, "datasets": {"rx": list(arrays.rx), "tx": list(arrays.tx)}}
 
 
 @router.route("/wireguard/interfaces/<uuid>", methods=['GET', "POST"])
@@ -355,6 +338,11 @@ def get_wireguard_iface(uuid: str):
     data = load_traffic_data(iface)
     session_data = traffic_config.driver.get_session_data()
     iface_traffic = session_data.get(iface.uuid, TrafficData(0, 0))
+    total_traffic = None
+    if traffic_config.enabled:
+        totals = traffic_config.driver.load_totals()
+        total_traffic = totals.get(iface.uuid, TrafficData(0, 0))
+        total_traffic = TrafficData(total_traffic.rx + iface_traffic.rx, total_traffic.tx + iface_traffic.tx)
     context = {
         "title": "Interface",
         "iface": iface,
@@ -362,6 +350,7 @@ def get_wireguard_iface(uuid: str):
         "EMPTY_FIELD": EMPTY_FIELD,
         "chart": {"labels": data["labels"], "datasets": data["datasets"]},
         "iface_traffic": TrafficData(iface_traffic.rx, iface_traffic.tx),
+        "total_traffic": total_traffic,
         "session_traffic": session_data,
         "traffic_config": traffic_config
     }
@@ -422,18 +411,17 @@ def operate_wireguard_ifaces(action: str):
     action = action.lower()
     try:
         if action == "start":
-            for iface in interfaces.values():
-                iface.up()
-            return Response(status=NO_CONTENT)
-        if action == "restart":
-            for iface in interfaces.values():
-                iface.restart()
-            return Response(status=NO_CONTENT)
-        if action == "stop":
-            for iface in interfaces.values():
-                iface.down()
-            return Response(status=NO_CONTENT)
-        raise WireguardError(f"invalid operation: {action}", BAD_REQUEST)
+            errors = wireguard_manager.start(interfaces.values())
+        elif action == "restart":
+            errors = wireguard_manager.restart()
+        elif action == "stop":
+            errors = wireguard_manager.stop()
+        else:
+            raise WireguardError(f"invalid operation: {action}", BAD_REQUEST)
+        if errors:
+            cause = "\n".join(f"{name}: {e.cause}" for name, e in errors.items())
+            return Response(cause, status=next(iter(errors.values())).http_code)
+        return Response(status=NO_CONTENT)
     except WireguardError as e:
         return Response(e.cause, status=e.http_code)
 
@@ -681,10 +669,18 @@ def about():
     view = "web/about.html"
     context = {
         "title": "About",
+        "startup": startup_manager,
     }
     return ViewController(view, **context).load()
 
 
+@router.route("/about/startup", methods=['GET'])
+@login_required
+@setup_required
+def get_startup_times():
+    return jsonify(startup_manager.to_dict())
+
+
 @router.route("/profile", methods=['GET'])
 @login_required
 @setup_required
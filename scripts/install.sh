@@ -69,13 +69,20 @@ if [ $? -ne 0 ]; then
 fi
 deactivate
 
+info "Installing privileged helper..."
+# Root-owned and out of $INSTALL_DIR, so that the linguard user cannot modify what it runs as root
+HELPER_DIR="/usr/local/lib/linguard"
+install -d -o root -g root -m 755 "$HELPER_DIR"
+install -o root -g root -m 644 linguard/common/utils/privileged.py "$HELPER_DIR/privileged.py"
+
 info "Settings permissions..."
 groupadd linguard
 useradd -g linguard linguard
 chown -R linguard:linguard "$INSTALL_DIR"
-chmod +x -R "$SOURCE_DIR/core/tools"
 echo "linguard ALL=(ALL) NOPASSWD: /usr/bin/wg" > /etc/sudoers.d/linguard
 echo "linguard ALL=(ALL) NOPASSWD: /usr/bin/wg-quick" >> /etc/sudoers.d/linguard
+# Native interfaces run ip and their PostUp/PostDown hooks through the helper only: they need this entry
+echo "linguard ALL=(root) NOPASSWD: /usr/bin/python3 $HELPER_DIR/privileged.py /tmp/linguard-*/helper.sock $DATA_DIR/interfaces" >> /etc/sudoers.d/linguard
 
 info "Adding linguard service..."
 cp systemd/linguard.service /etc/systemd/system/